@@ -0,0 +1,803 @@
+#!/usr/bin/env python3
+"""Benchmarks de las rutas críticas del servidor de Memorama.
+
+Uso: python MemoBench.py [filtro]
+
+Cada resultado se imprime como una línea JSON en la salida estándar para
+poder comparar versiones (por ejemplo redirigiendo a bench_output.txt). Con
+un filtro solo se ejecutan los benchmarks cuyo nombre lo contiene.
+"""
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import selectors
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import protocolo
+from admision import BACKLOG, CONEXIONES_POR_SEGUNDO_IP
+from diario import DiarioPartidas
+from emparejamiento import Emparejador, Espera
+from mazos import MAZO_BASICO, CatalogoMazos, catalogo
+from sala import Sala, VENTANA_REVANCHA
+from tablero import Tablero
+from temporizador import RuedaTemporizadores
+
+TABLEROS = [(4, 4), (6, 6), (20, 20), (100, 100), (200, 200)]
+JUGADORES = [2, 8, 64, 512]
+JUGADORES_MASIVOS = [512, 4096, 16384]  # Partidas masivas: clasificación y orden de turnos
+ESPECTADORES = [0, 100, 1000, 10000]
+TIEMPO_MINIMO = 0.2  # Segundos por repetición de cada microbenchmark
+REPETICIONES = 5
+
+# Ciclo completo sobre sockets locales
+TABLEROS_CICLO = [(10, 10), (50, 50)]
+JUGADORES_CICLO = [2, 8, 32]
+JUGADAS_CICLO = 200
+PUERTO_CICLO = 47650
+
+# Modo multiproceso: muchas salas a la vez con 1, 2 y tantos procesos como núcleos
+PROCESOS_SERVIDOR = sorted({1, 2, os.cpu_count() or 1})
+SALAS_SIMULTANEAS = 8         # Un proceso cliente por sala
+DURACION_MULTIPROCESO = 3.0   # Segundos jugando en cada medición
+
+# Recuperación del diario de partidas
+PARTIDAS_DIARIO = [100, 1000, 5000]
+JUGADAS_DIARIO = 50  # Jugadas anotadas por partida
+
+# Sala de espera: jugadores ya en cola al medir
+ESPERANDO = [0, 1000, 10000, 50000]
+
+# Mazos: uno sintético de este tamaño, leído de un archivo
+PALABRAS_MAZO_GRANDE = 50000
+
+# Tiempo entre partidas: revancha en la misma conexión frente a volver a conectarse
+JUGADORES_REVANCHA = [2, 8, 32]
+PARTIDAS_REVANCHA = 20
+
+# Avalancha de conexiones: todas a la vez, con la cola de antes (listen(5)) y la nueva, con y sin límite
+CONEXIONES_AVALANCHA = [500, 2000]
+ESPERA_AVALANCHA = 20.0  # Segundos máximos esperando la respuesta de cada conexión
+
+# Clientes que inundan la sala de mensajes mientras dos jugadores juegan, sin y con límite por conexión
+ABUSONES = [0, 4]
+JUGADAS_ABUSO = 300
+PAUSA_ABUSO = 0.002         # Los jugadores juegan cada 2 ms, muy por encima de una persona
+MENSAJES_ABUSO = 1000.0     # Límite por conexión holgado para los jugadores y no para quien inunda
+
+# Vuelta tras un corte: unirse de nuevo (tablero completo) frente a reanudar la sesión
+TABLEROS_REANUDAR = [(50, 50), (200, 200)]
+JUGADAS_PERDIDAS = 10       # Jugadas que se hacen mientras el jugador está sin conexión
+CORTES_REANUDAR = 20
+
+class ConexionMedicion:
+    """Conexión en memoria: codifica cada mensaje como una real pero no lo envía"""
+    __slots__ = ("tramas", "deltas", "rtt_medio")
+    
+    def __init__(self, tramas=True, deltas=False):
+        self.tramas = tramas
+        self.deltas = deltas
+        self.rtt_medio = None
+    
+    def enviar(self, mensaje):
+        protocolo.codificar(mensaje, self.tramas)
+    
+    def close(self):
+        pass
+
+def informar(resultado):
+    resultado["python"] = platform.python_version()
+    print(json.dumps(resultado, ensure_ascii=False), file=sys.__stdout__, flush=True)
+
+def medir(funcion):
+    """Devuelve los tiempos por llamada (en µs) de cada repetición"""
+    # Calibrar el número de llamadas para que cada repetición dure TIEMPO_MINIMO
+    iteraciones = 1
+    while True:
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        transcurrido = time.perf_counter() - inicio
+        if transcurrido >= TIEMPO_MINIMO / 10:
+            break
+        iteraciones *= 10
+    iteraciones = max(1, int(iteraciones * TIEMPO_MINIMO / max(transcurrido, 1e-9) / 10) * 10)
+    
+    tiempos = []
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        tiempos.append((time.perf_counter() - inicio) / iteraciones * 1e6)
+    return iteraciones, tiempos
+
+def informar_medicion(nombre, funcion, **parametros):
+    iteraciones, tiempos = medir(funcion)
+    tiempos.sort()
+    informar({"benchmark": nombre, **parametros, "iteraciones": iteraciones,
+              "mejor_us": round(tiempos[0], 3), "mediana_us": round(tiempos[len(tiempos) // 2], 3)})
+
+def crear_sala(filas, columnas, jugadores=0, deltas=False):
+    sala = Sala("bench", f"{filas}x{columnas}")
+    for puerto in range(1, jugadores + 1):
+        sala.agregar_cliente(ConexionMedicion(deltas=deltas), "127.0.0.1", puerto)
+    return sala
+
+def pares_del_tablero(tablero):
+    posiciones = {}
+    for indice, carta in enumerate(tablero.cartas):
+        if carta:
+            posiciones.setdefault(carta, []).append(indice)
+    return list(posiciones.values())
+
+def par_distinto(tablero):
+    """Dos casillas con cartas distintas: la jugada falla y no cambia el tablero"""
+    primera = tablero.cartas[0]
+    for indice in range(1, len(tablero.cartas)):
+        if tablero.cartas[indice] != primera and tablero.cartas[indice]:
+            return divmod(0, tablero.columnas), divmod(indice, tablero.columnas)
+
+def bench_procesar_jugada():
+    for filas, columnas in TABLEROS:
+        sala = crear_sala(filas, columnas, 2)
+        (fila1, col1), (fila2, col2) = par_distinto(sala.tablero)
+        informar_medicion("procesar_jugada_fallo",
+                          lambda: sala.procesar_jugada(fila1, col1, fila2, col2, "127.0.0.1", 1),
+                          filas=filas, columnas=columnas)
+        
+        # Aciertos: resolver tableros completos (crear el tablero no se mide)
+        tiempos = []
+        for _ in range(REPETICIONES):
+            sala = crear_sala(filas, columnas, 2)
+            jugadas = [divmod(a, columnas) + divmod(b, columnas) for a, b in pares_del_tablero(sala.tablero)]
+            inicio = time.perf_counter()
+            for fila1, col1, fila2, col2 in jugadas:
+                sala.procesar_jugada(fila1, col1, fila2, col2, "127.0.0.1", 1)
+            tiempos.append((time.perf_counter() - inicio) / len(jugadas) * 1e6)
+        tiempos.sort()
+        informar({"benchmark": "procesar_jugada_acierto", "filas": filas, "columnas": columnas,
+                  "iteraciones": len(jugadas), "mejor_us": round(tiempos[0], 3),
+                  "mediana_us": round(tiempos[len(tiempos) // 2], 3)})
+
+def bench_cambiar_turno():
+    for jugadores in JUGADORES:
+        sala = crear_sala(4, 4, jugadores)
+        informar_medicion("cambiar_turno", lambda: sala.cambiar_turno(False), jugadores=jugadores)
+
+def bench_partida_masiva():
+    for jugadores in JUGADORES_MASIVOS:
+        sala = crear_sala(4, 4, jugadores)
+        # Reparto de puntos para que haya muchos grupos de puntuación distintos
+        for puerto in range(1, jugadores + 1):
+            for _ in range(puerto % 7):
+                sala.clasificacion.sumar(f"127.0.0.1:{puerto}")
+        informar_medicion("ganador_y_empate", lambda: (sala.obtener_ganador(), sala.hay_empate()),
+                          jugadores=jugadores)
+        
+        # Un jugador de la mitad del orden de turnos sale y vuelve a entrar
+        conn = ConexionMedicion()
+        medio = jugadores // 2
+        def salir_y_volver():
+            sala.eliminar_cliente("127.0.0.1", medio)
+            sala.agregar_cliente(conn, "127.0.0.1", medio)
+        informar_medicion("salir_y_volver", salir_y_volver, jugadores=jugadores)
+        
+        # El jugador con el turno sale: el turno pasa al siguiente
+        def salir_con_turno():
+            turno = sala.turno_actual
+            ip, puerto = turno.rsplit(":", 1)
+            sala.eliminar_cliente(ip, int(puerto))
+            sala.agregar_cliente(conn, ip, int(puerto))
+        informar_medicion("salir_con_turno", salir_con_turno, jugadores=jugadores)
+
+def bench_enviar_a_todos():
+    for jugadores in JUGADORES:
+        sala = crear_sala(4, 4, jugadores)
+        informar_medicion("enviar_a_todos", lambda: sala.enviar_a_todos("TURNO:127.0.0.1:1"), jugadores=jugadores)
+
+def bench_enviar_jugada():
+    for filas, columnas in TABLEROS:
+        for jugadores in JUGADORES:
+            for deltas in (True, False):
+                sala = crear_sala(filas, columnas, jugadores, deltas)
+                informar_medicion("enviar_jugada",
+                                  lambda: sala.enviar_jugada("127.0.0.1", 1, 0, 0, "casa", 0, 1, "perro", False,
+                                                             sala.instantanea),
+                                  filas=filas, columnas=columnas, jugadores=jugadores, deltas=deltas)
+
+class RepartidorMedicion:
+    """Repartidor que descarta lo publicado: mide solo el coste en la ruta del jugador"""
+    
+    @staticmethod
+    def programar(canal):
+        canal.pendientes.clear()
+
+def bench_espectadores():
+    for espectadores in ESPECTADORES:
+        sala = crear_sala(10, 10, 2, deltas=True)
+        for puerto in range(1000, 1000 + espectadores):
+            sala.agregar_espectador(ConexionMedicion(deltas=True), "127.0.0.1", puerto)
+        canal = sala.espectadores
+        canal.repartidor = RepartidorMedicion
+        informar_medicion("enviar_jugada_espectadores",
+                          lambda: sala.enviar_jugada("127.0.0.1", 1, 0, 0, "casa", 0, 1, "perro", False,
+                                                     sala.instantanea),
+                          espectadores=espectadores)
+        
+        # Reparto de una jugada a todos los espectadores, fuera de la ruta del jugador
+        if espectadores:
+            mensaje = protocolo.Difusion("DELTA:1:127.0.0.1:1:0,0:casa:0,1:perro:0:0")
+            def repartir():
+                canal.pendientes.append(mensaje)
+                canal.repartir()
+            informar_medicion("repartir_espectadores", repartir, espectadores=espectadores)
+
+def bench_obtener_tablero_visible_json():
+    for filas, columnas in TABLEROS:
+        sala = crear_sala(filas, columnas, 2)
+        # Destapar la mitad de los pares para tener un tablero mixto
+        for a, b in pares_del_tablero(sala.tablero)[::2]:
+            sala.tablero.destapar_par(a, b)
+        informar_medicion("obtener_tablero_visible_json", sala.obtener_tablero_visible_json,
+                          filas=filas, columnas=columnas)
+
+def _ejecutar_servidor(modo, puerto, procesos=1, backlog=None, maximo=0, mensajes=0.0, conexiones_ip=0.0):
+    sys.stdout = open(os.devnull, "w")
+    import MemoServer
+    import trabajadores
+    MemoServer.PORT = puerto
+    MemoServer.gestor_salas.ventana_revancha = VENTANA_REVANCHA
+    if backlog is not None:
+        MemoServer.BACKLOG = backlog
+    MemoServer.admision.maximo = maximo
+    MemoServer.admision.mensajes = mensajes
+    MemoServer.admision.tasa = conexiones_ip
+    codigo_modo = "2" if modo == "asyncio" else "1"
+    if procesos > 1:
+        trabajadores.lanzar(procesos, MemoServer.ejecutar_trabajador, codigo_modo, None)
+    else:
+        MemoServer.ejecutar(codigo_modo, None)
+
+def _esperar_puerto(puerto):
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", puerto)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"El servidor no escucha en el puerto {puerto}")
+
+class ClienteCiclo:
+    """Cliente mínimo con tramas para medir el ciclo completo"""
+    
+    def __init__(self, puerto, sala, dificultad, deltas, revancha=False):
+        self.sock = socket.create_connection(("127.0.0.1", puerto))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.direccion = f"127.0.0.1:{self.sock.getsockname()[1]}"
+        self.decodificador = protocolo.DecodificadorTramas()
+        self.pendientes = []
+        capacidades = ":DELTAS" if deltas else ""
+        if revancha:
+            capacidades += ",REVANCHA"
+        self.sock.sendall(protocolo.codificar_trama(f"UNIR:{sala}:{dificultad}{capacidades}"))
+    
+    def siguiente(self):
+        while not self.pendientes:
+            datos = self.sock.recv(1 << 20)
+            if not datos:
+                raise ConnectionError("El servidor cerró la conexión")
+            self.pendientes.extend(self.decodificador.alimentar(datos))
+        return self.pendientes.pop(0)
+    
+    def esperar(self, prefijos):
+        while True:
+            mensaje = self.siguiente()
+            if mensaje.startswith(prefijos):
+                return mensaje
+
+def medir_ciclo(modo, puerto, filas, columnas, jugadores, deltas):
+    sala = f"bench-{filas}x{columnas}-{jugadores}-{int(deltas)}"
+    clientes = []
+    for _ in range(jugadores):
+        cliente = ClienteCiclo(puerto, sala, f"{filas}x{columnas}", deltas)
+        cliente.esperar(("CONFIG:",))
+        clientes.append(cliente)
+    turno = clientes[0].esperar(("TURNO:",))[len("TURNO:"):]
+    for cliente in clientes[1:]:
+        cliente.pendientes.clear()
+    
+    destapadas = set()
+    prefijo_jugada = ("DELTA:",) if deltas else ("JUGADA:",)
+    latencias = []
+    inicio_total = time.perf_counter()
+    for _ in range(JUGADAS_CICLO):
+        jugador = next(c for c in clientes if c.direccion == turno)
+        ocultas = random.sample([i for i in range(filas * columnas) if i not in destapadas][:1000], 2)
+        (fila1, col1), (fila2, col2) = divmod(ocultas[0], columnas), divmod(ocultas[1], columnas)
+        
+        inicio = time.perf_counter()
+        jugador.sock.sendall(protocolo.codificar_trama(f"JUGAR:{fila1},{col1}:{fila2},{col2}"))
+        acierto = False
+        for cliente in clientes:
+            partes = cliente.esperar(prefijo_jugada).split(":")
+            acierto = partes[8 if deltas else 7] == "1"
+            if not acierto:
+                turno = cliente.esperar(("TURNO:",))[len("TURNO:"):]
+        latencias.append(time.perf_counter() - inicio)
+        if acierto:
+            destapadas.update(ocultas)
+    total = time.perf_counter() - inicio_total
+    
+    for cliente in clientes:
+        cliente.sock.close()
+    latencias.sort()
+    informar({"benchmark": "ciclo_completo", "modo": modo, "filas": filas, "columnas": columnas,
+              "jugadores": jugadores, "deltas": deltas, "iteraciones": len(latencias),
+              "jugadas_por_s": round(len(latencias) / total, 1),
+              "mediana_us": round(latencias[len(latencias) // 2] * 1e6, 1),
+              "p99_us": round(latencias[int(len(latencias) * 0.99)] * 1e6, 1)})
+
+def bench_ciclo_completo():
+    for indice, modo in enumerate(("hilos", "asyncio")):
+        puerto = PUERTO_CICLO + indice
+        servidor = multiprocessing.Process(target=_ejecutar_servidor, args=(modo, puerto), daemon=True)
+        servidor.start()
+        try:
+            _esperar_puerto(puerto)
+            for filas, columnas in TABLEROS_CICLO:
+                for jugadores in JUGADORES_CICLO:
+                    for deltas in (True, False):
+                        medir_ciclo(modo, puerto, filas, columnas, jugadores, deltas)
+        finally:
+            servidor.terminate()
+            servidor.join()
+
+def bench_recuperar_diario():
+    for partidas in PARTIDAS_DIARIO:
+        with tempfile.TemporaryDirectory() as directorio:
+            diario = DiarioPartidas(os.path.join(directorio, "bench.diario"))
+            diario.abrir()
+            for numero in range(partidas):
+                sala = Sala(f"bench-{numero}", "6x6")
+                diario.crear(sala)
+                diario.unir(sala, "127.0.0.1:1")
+                diario.unir(sala, "127.0.0.1:2")
+                for version in range(1, JUGADAS_DIARIO + 1):
+                    diario.jugada(sala, "127.0.0.1:1", 0, 0, 0, 1, False, version)
+            diario.cerrar()
+            tamano = os.path.getsize(diario.ruta)
+            
+            tiempos = []
+            for _ in range(REPETICIONES):
+                inicio = time.perf_counter()
+                recuperadas = diario.leer()
+                tiempos.append(time.perf_counter() - inicio)
+            assert len(recuperadas) == partidas
+        tiempos.sort()
+        informar({"benchmark": "recuperar_diario", "partidas": partidas, "jugadas_por_partida": JUGADAS_DIARIO,
+                  "bytes": tamano, "mejor_ms": round(tiempos[0] * 1000, 1),
+                  "mediana_ms": round(tiempos[len(tiempos) // 2] * 1000, 1)})
+
+def bench_emparejamiento():
+    for esperando in ESPERANDO:
+        # La partida nunca se completa: se mide entrar y salir de una cola de ese tamaño
+        emparejador = Emparejador(RuedaTemporizadores(), lambda dificultad, grupo: None,
+                                  jugadores_por_partida=esperando + 2)
+        for puerto in range(esperando):
+            emparejador.agregar(Espera(None, "127.0.0.1", puerto, "6x6", set()))
+        
+        def entrar_y_salir():
+            espera = Espera(None, "127.0.0.1", 0, "6x6", set())
+            emparejador.agregar(espera)
+            emparejador.cancelar(espera)
+        informar_medicion("emparejar_entrar_salir", entrar_y_salir, esperando=esperando)
+
+def bench_mazos():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "grande.txt")
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            archivo.write("\n".join(f"palabra{numero}" for numero in range(PALABRAS_MAZO_GRANDE)))
+        catalogo_bench = CatalogoMazos()
+        catalogo_bench.registrar_archivo("grande", ruta)
+        inicio = time.perf_counter()
+        grande = catalogo_bench.obtener("grande")
+        transcurrido = time.perf_counter() - inicio
+    # Lo que ocuparía la misma lista como objetos str
+    bytes_lista = sys.getsizeof([]) + sum(8 + sys.getsizeof(grande.palabra(i)) for i in range(len(grande)))
+    informar({"benchmark": "cargar_mazo", "palabras": len(grande), "ms": round(transcurrido * 1000, 1),
+              "bytes": sys.getsizeof(grande.texto) + sys.getsizeof(grande.inicios), "bytes_lista": bytes_lista})
+    
+    for mazo in (catalogo.obtener(MAZO_BASICO), grande):
+        for filas, columnas in TABLEROS:
+            informar_medicion("repartir_tablero", lambda: Tablero(filas, columnas, mazo, 12345),
+                              mazo=mazo.nombre, filas=filas, columnas=columnas)
+
+def _jugar_sala(puerto, sala, inicio, duracion, resultados):
+    """Dos jugadores alternan jugadas en su sala hasta que pasa la duración"""
+    jugadores = []
+    for _ in range(2):
+        cliente = ClienteCiclo(puerto, sala, "50x50", True)
+        cliente.esperar(("CONFIG:",))
+        jugadores.append(cliente)
+    turno = jugadores[0].esperar(("TURNO:",))[len("TURNO:"):]
+    jugadores[1].pendientes.clear()
+    
+    while time.time() < inicio:
+        time.sleep(0.001)
+    jugadas = 0
+    aleatorio = random.Random(sala)
+    while time.time() < inicio + duracion:
+        jugador = next(c for c in jugadores if c.direccion == turno)
+        indice = aleatorio.randrange(0, 2500, 2)
+        fila1, col1 = divmod(indice, 50)
+        jugador.sock.sendall(protocolo.codificar_trama(f"JUGAR:{fila1},{col1}:{fila1},{col1 + 1}"))
+        for cliente in jugadores:
+            partes = cliente.esperar(("DELTA:", "ERROR:")).split(":")
+            if partes[0] == "DELTA" and partes[8] == "0":
+                turno = cliente.esperar(("TURNO:",))[len("TURNO:"):]
+        jugadas += 1
+    for cliente in jugadores:
+        cliente.sock.close()
+    resultados.put(jugadas)
+
+def _terminar_partida(clientes, turno):
+    """Juega un tablero de 2x2 hasta el final. Devuelve el instante en que se envió la última jugada"""
+    ocultas = {(0, 0), (0, 1), (1, 0), (1, 1)}
+    vistas = {}  # {(fila, col): palabra} de casillas vistas y aún ocultas
+    while True:
+        jugador = next(c for c in clientes if c.direccion == turno)
+        por_palabra = {}
+        par = None
+        for casilla, palabra in vistas.items():
+            if palabra in por_palabra:
+                par = (por_palabra[palabra], casilla)
+                break
+            por_palabra[palabra] = casilla
+        if par is None:
+            nuevas = sorted(ocultas - vistas.keys())
+            par = (nuevas[0], nuevas[1] if len(nuevas) > 1 else next(iter(vistas)))
+        (fila1, col1), (fila2, col2) = par
+        inicio = time.perf_counter()
+        jugador.sock.sendall(protocolo.codificar_trama(f"JUGAR:{fila1},{col1}:{fila2},{col2}"))
+        partes = clientes[0].esperar(("DELTA:",)).split(":")
+        if partes[8] == "1":
+            ocultas -= set(par)
+            for casilla in par:
+                vistas.pop(casilla, None)
+            if not ocultas:
+                return inicio
+        else:
+            vistas[(fila1, col1)], vistas[(fila2, col2)] = partes[5], partes[7]
+            turno = clientes[0].esperar(("TURNO:",))[len("TURNO:"):]
+
+def medir_entre_partidas(modo, puerto, jugadores, revancha):
+    sala = f"bench-revancha-{jugadores}-{int(revancha)}"
+    clientes = [ClienteCiclo(puerto, sala, "2x2", True, revancha) for _ in range(jugadores)]
+    turno = None
+    for cliente in clientes:
+        turno = cliente.esperar(("TURNO:",))[len("TURNO:"):]
+    
+    tiempos = []
+    for _ in range(PARTIDAS_REVANCHA):
+        fin = _terminar_partida(clientes, turno)
+        if revancha:
+            # Todos aceptan en cuanto llega la oferta; la partida nueva empieza sin esperar a la ventana
+            for cliente in clientes:
+                cliente.esperar(("REVANCHA:",))
+                cliente.sock.sendall(protocolo.codificar_trama("REVANCHA"))
+            for cliente in clientes:
+                turno = cliente.esperar(("TURNO:",))[len("TURNO:"):]
+        else:
+            # Como antes: cada jugador recibe la despedida y vuelve a conectarse a la misma sala
+            for indice, cliente in enumerate(clientes):
+                cliente.esperar(("DESPEDIDA:",))
+                cliente.sock.close()
+                clientes[indice] = ClienteCiclo(puerto, sala, "2x2", True)
+            for cliente in clientes:
+                turno = cliente.esperar(("TURNO:",))[len("TURNO:"):]
+        tiempos.append(time.perf_counter() - fin)
+    
+    for cliente in clientes:
+        cliente.sock.close()
+    tiempos.sort()
+    informar({"benchmark": "entre_partidas", "modo": modo, "jugadores": jugadores,
+              "flujo": "revancha" if revancha else "reconectar", "iteraciones": len(tiempos),
+              "mediana_ms": round(tiempos[len(tiempos) // 2] * 1000, 2),
+              "max_ms": round(tiempos[-1] * 1000, 2)})
+
+def bench_entre_partidas():
+    for indice, modo in enumerate(("hilos", "asyncio")):
+        puerto = PUERTO_CICLO + 20 + indice
+        servidor = multiprocessing.Process(target=_ejecutar_servidor, args=(modo, puerto), daemon=True)
+        servidor.start()
+        try:
+            _esperar_puerto(puerto)
+            for jugadores in JUGADORES_REVANCHA:
+                for revancha in (True, False):
+                    medir_entre_partidas(modo, puerto, jugadores, revancha)
+        finally:
+            servidor.terminate()
+            servidor.join()
+
+def medir_avalancha(modo, puerto, conexiones, backlog, maximo):
+    """Abre todas las conexiones a la vez y mide cuánto tarda cada una en recibir CONFIG u OCUPADO"""
+    selector = selectors.DefaultSelector()
+    sockets = []
+    inicio = time.perf_counter()
+    for numero in range(conexiones):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.connect_ex(("127.0.0.1", puerto))
+        sockets.append(sock)
+        # Salas de 4 jugadores, como tras un corte de red con muchas partidas pequeñas
+        selector.register(sock, selectors.EVENT_WRITE, (f"avalancha-{numero // 4}", protocolo.DecodificadorTramas()))
+    
+    tiempos = {"CONFIG": [], "OCUPADO": []}
+    fallidas = 0
+    limite = inicio + ESPERA_AVALANCHA
+    while selector.get_map() and time.perf_counter() < limite:
+        for clave, eventos in selector.select(0.1):
+            sock = clave.fileobj
+            sala, decodificador = clave.data
+            try:
+                if eventos & selectors.EVENT_WRITE:
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                        raise ConnectionError
+                    sock.send(protocolo.codificar_trama(f"UNIR:{sala}:4x4:DELTAS"))
+                    selector.modify(sock, selectors.EVENT_READ, clave.data)
+                    continue
+                datos = sock.recv(1 << 16)
+                if not datos:
+                    raise ConnectionError
+                mensajes = decodificador.alimentar(datos)
+            except OSError:
+                fallidas += 1
+                selector.unregister(sock)
+                continue
+            if mensajes:
+                # Basta con la primera respuesta; la conexión sigue abierta hasta el final
+                tipo = mensajes[0].split(":", 1)[0]
+                tiempos.setdefault(tipo, []).append(time.perf_counter() - inicio)
+                selector.unregister(sock)
+    sin_respuesta = len(selector.get_map())
+    selector.close()
+    for sock in sockets:
+        sock.close()
+    
+    atendidas = sorted(tiempos["CONFIG"] + tiempos["OCUPADO"])
+    informar({"benchmark": "avalancha", "modo": modo, "conexiones": conexiones, "backlog": backlog,
+              "maximo": maximo, "config": len(tiempos["CONFIG"]), "ocupado": len(tiempos["OCUPADO"]),
+              "fallidas": fallidas, "sin_respuesta": sin_respuesta,
+              "mediana_ms": round(atendidas[len(atendidas) // 2] * 1000, 1) if atendidas else None,
+              "p99_ms": round(atendidas[int(len(atendidas) * 0.99)] * 1000, 1) if atendidas else None,
+              "max_ms": round(atendidas[-1] * 1000, 1) if atendidas else None})
+
+def bench_avalancha():
+    puerto = PUERTO_CICLO + 30
+    for modo in ("hilos", "asyncio"):
+        for conexiones in CONEXIONES_AVALANCHA:
+            # Antes: listen(5) y sin límite; ahora: cola amplia, y además con límite por debajo de la avalancha
+            for backlog, maximo in ((5, 0), (None, 0), (None, conexiones // 2)):
+                servidor = multiprocessing.Process(target=_ejecutar_servidor,
+                                                   args=(modo, puerto, 1, backlog, maximo), daemon=True)
+                servidor.start()
+                try:
+                    _esperar_puerto(puerto)
+                    time.sleep(0.2)  # Que se cierre la conexión de prueba de _esperar_puerto
+                    medir_avalancha(modo, puerto, conexiones, backlog or BACKLOG, maximo)
+                finally:
+                    servidor.terminate()
+                    servidor.join()
+                puerto += 1
+
+def _inundar_sala(puerto, sala, fin):
+    """Espectador que envía sin parar ESTADO, jugadas prohibidas y mal formadas sin leer las respuestas"""
+    os.nice(19)  # Quien inunda no usa la CPU del servidor en una instalación real
+    rafaga = b"".join(protocolo.codificar_trama(mensaje)
+                      for mensaje in ("ESTADO", "JUGAR:0,0:0,1", "JUGAR:x", "JUGAR:1,1:") * 50)
+    while time.time() < fin:
+        try:
+            sock = socket.create_connection(("127.0.0.1", puerto))
+            sock.sendall(protocolo.codificar_trama(f"UNIR:{sala}:50x50:DELTAS,ESPECTADOR"))
+            while time.time() < fin:
+                sock.sendall(rafaga)
+        except OSError:
+            time.sleep(0.01)  # El servidor lo desconectó: volver a entrar
+        finally:
+            sock.close()
+
+def medir_abuso(modo, puerto, abusones, mensajes):
+    sala = f"bench-abuso-{abusones}"
+    jugadores = []
+    for _ in range(2):
+        cliente = ClienteCiclo(puerto, sala, "50x50", True)
+        cliente.esperar(("CONFIG:",))
+        jugadores.append(cliente)
+    turno = jugadores[0].esperar(("TURNO:",))[len("TURNO:"):]
+    jugadores[1].pendientes.clear()
+    
+    fin = time.time() + 60.0
+    inundadores = [multiprocessing.Process(target=_inundar_sala, args=(puerto, sala, fin), daemon=True)
+                   for _ in range(abusones)]
+    for proceso in inundadores:
+        proceso.start()
+    time.sleep(0.5 if abusones else 0)  # Que la inundación esté en marcha al medir
+    
+    aleatorio = random.Random(sala)
+    latencias = []
+    for _ in range(JUGADAS_ABUSO):
+        jugador = next(c for c in jugadores if c.direccion == turno)
+        indice = aleatorio.randrange(0, 2500, 2)
+        fila1, col1 = divmod(indice, 50)
+        inicio = time.perf_counter()
+        jugador.sock.sendall(protocolo.codificar_trama(f"JUGAR:{fila1},{col1}:{fila1},{col1 + 1}"))
+        for cliente in jugadores:
+            partes = cliente.esperar(("DELTA:", "ERROR:")).split(":")
+            if partes[0] == "DELTA" and partes[8] == "0":
+                turno = cliente.esperar(("TURNO:",))[len("TURNO:"):]
+        latencias.append(time.perf_counter() - inicio)
+        time.sleep(PAUSA_ABUSO)
+    
+    for proceso in inundadores:
+        proceso.terminate()
+        proceso.join()
+    for cliente in jugadores:
+        cliente.sock.close()
+    latencias.sort()
+    informar({"benchmark": "abuso", "modo": modo, "abusones": abusones, "mensajes_por_s": mensajes,
+              "iteraciones": len(latencias),
+              "mediana_us": round(latencias[len(latencias) // 2] * 1e6, 1),
+              "p99_us": round(latencias[int(len(latencias) * 0.99)] * 1e6, 1)})
+
+def bench_abuso():
+    puerto = PUERTO_CICLO + 40
+    for modo in ("hilos", "asyncio"):
+        for mensajes in (0.0, MENSAJES_ABUSO):
+            # Con límite, también el de conexiones por IP: quien es expulsado no puede volver a entrar al momento
+            conexiones_ip = CONEXIONES_POR_SEGUNDO_IP if mensajes else 0.0
+            servidor = multiprocessing.Process(target=_ejecutar_servidor,
+                                               args=(modo, puerto, 1, None, 0, mensajes, conexiones_ip), daemon=True)
+            servidor.start()
+            try:
+                _esperar_puerto(puerto)
+                for abusones in ABUSONES:
+                    medir_abuso(modo, puerto, abusones, mensajes)
+            finally:
+                servidor.terminate()
+                servidor.join()
+            puerto += 1
+
+def _resincronizar(puerto, primer_mensaje):
+    """Conecta, envía el primer mensaje y lee hasta TURNO. Devuelve (segundos, bytes recibidos, socket, mensajes)"""
+    inicio = time.perf_counter()
+    sock = socket.create_connection(("127.0.0.1", puerto))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(protocolo.codificar_trama(primer_mensaje))
+    decodificador = protocolo.DecodificadorTramas()
+    recibidos = 0
+    mensajes = []
+    while not mensajes or not mensajes[-1].startswith("TURNO:"):
+        datos = sock.recv(1 << 20)
+        if not datos:
+            raise ConnectionError("El servidor cerró la conexión")
+        recibidos += len(datos)
+        mensajes.extend(decodificador.alimentar(datos))
+    return time.perf_counter() - inicio, recibidos, sock, mensajes
+
+def medir_reanudar(modo, puerto, filas, columnas, reanudar):
+    sala = f"bench-reanudar-{filas}x{columnas}-{int(reanudar)}"
+    dificultad = f"{filas}x{columnas}"
+    jugador = ClienteCiclo(puerto, sala, dificultad, True)
+    jugador.esperar(("TURNO:",))
+    _, _, sock, mensajes = _resincronizar(puerto, f"UNIR:{sala}:{dificultad}:DELTAS,SESION")
+    token = next(mensaje for mensaje in mensajes if mensaje.startswith("SESION:")).split(":")[2]
+    
+    version = 0
+    casilla = 0
+    tiempos = []
+    recibidos = []
+    for _ in range(CORTES_REANUDAR):
+        sock.close()
+        vista = version  # Última versión que recibió antes del corte
+        time.sleep(0.05)  # Que el servidor note el corte
+        # El otro jugador sigue (siempre tiene el turno): casillas nuevas en orden, nunca repetidas
+        for _ in range(JUGADAS_PERDIDAS):
+            (fila1, col1), (fila2, col2) = divmod(casilla, columnas), divmod(casilla + 1, columnas)
+            casilla += 2
+            jugador.sock.sendall(protocolo.codificar_trama(f"JUGAR:{fila1},{col1}:{fila2},{col2}"))
+            version = int(jugador.esperar(("DELTA:",)).split(":")[1])
+        if reanudar:
+            primer_mensaje = f"REANUDAR:{sala}:{token}:{vista}:DELTAS"
+        else:
+            # Como antes: entra como jugador nuevo, con el tablero completo y sin su puntuación
+            primer_mensaje = f"UNIR:{sala}:{dificultad}:DELTAS"
+        segundos, cantidad, sock, _ = _resincronizar(puerto, primer_mensaje)
+        tiempos.append(segundos)
+        recibidos.append(cantidad)
+    
+    sock.close()
+    jugador.sock.close()
+    tiempos.sort()
+    recibidos.sort()
+    informar({"benchmark": "reanudar", "modo": modo, "tablero": dificultad,
+              "flujo": "reanudar" if reanudar else "unir", "jugadas_perdidas": JUGADAS_PERDIDAS,
+              "iteraciones": len(tiempos), "bytes": recibidos[len(recibidos) // 2],
+              "mediana_ms": round(tiempos[len(tiempos) // 2] * 1000, 2),
+              "max_ms": round(tiempos[-1] * 1000, 2)})
+
+def bench_reanudar():
+    for indice, modo in enumerate(("hilos", "asyncio")):
+        puerto = PUERTO_CICLO + 50 + indice
+        servidor = multiprocessing.Process(target=_ejecutar_servidor, args=(modo, puerto), daemon=True)
+        servidor.start()
+        try:
+            _esperar_puerto(puerto)
+            for filas, columnas in TABLEROS_REANUDAR:
+                for reanudar in (False, True):
+                    medir_reanudar(modo, puerto, filas, columnas, reanudar)
+        finally:
+            servidor.terminate()
+            servidor.join()
+
+def bench_multiproceso():
+    for indice, procesos in enumerate(PROCESOS_SERVIDOR):
+        puerto = PUERTO_CICLO + 10 + indice
+        # No es daemon porque lanza sus propios procesos; se detiene con SIGINT como con Ctrl+C
+        servidor = multiprocessing.Process(target=_ejecutar_servidor, args=("asyncio", puerto, procesos))
+        servidor.start()
+        try:
+            _esperar_puerto(puerto)
+            time.sleep(0.5)  # Que todos los procesos estén escuchando
+            resultados = multiprocessing.Queue()
+            inicio = time.time() + 1.0
+            clientes = [multiprocessing.Process(target=_jugar_sala,
+                                                args=(puerto, f"multi-{numero}", inicio, DURACION_MULTIPROCESO, resultados))
+                        for numero in range(SALAS_SIMULTANEAS)]
+            for cliente in clientes:
+                cliente.start()
+            jugadas = sum(resultados.get() for _ in clientes)
+            for cliente in clientes:
+                cliente.join()
+        finally:
+            os.kill(servidor.pid, signal.SIGINT)
+            servidor.join(10.0)
+            if servidor.is_alive():
+                servidor.terminate()
+                servidor.join()
+        informar({"benchmark": "multiproceso", "modo": "asyncio", "procesos": procesos,
+                  "nucleos": os.cpu_count(), "salas": SALAS_SIMULTANEAS, "jugadas": jugadas,
+                  "jugadas_por_s": round(jugadas / DURACION_MULTIPROCESO, 1)})
+
+BENCHMARKS = [
+    ("procesar_jugada", bench_procesar_jugada),
+    ("cambiar_turno", bench_cambiar_turno),
+    ("partida_masiva", bench_partida_masiva),
+    ("enviar_a_todos", bench_enviar_a_todos),
+    ("enviar_jugada", bench_enviar_jugada),
+    ("obtener_tablero_visible_json", bench_obtener_tablero_visible_json),
+    ("espectadores", bench_espectadores),
+    ("ciclo_completo", bench_ciclo_completo),
+    ("recuperar_diario", bench_recuperar_diario),
+    ("emparejamiento", bench_emparejamiento),
+    ("mazos", bench_mazos),
+    ("entre_partidas", bench_entre_partidas),
+    ("avalancha", bench_avalancha),
+    ("abuso", bench_abuso),
+    ("reanudar", bench_reanudar),
+    ("multiproceso", bench_multiproceso),
+]
+
+if __name__ == "__main__":
+    filtro = sys.argv[1] if len(sys.argv) > 1 else ""
+    random.seed(12345)
+    # Los mensajes de consola del servidor no forman parte de la salida del benchmark
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        for nombre, benchmark in BENCHMARKS:
+            if filtro in nombre:
+                benchmark()
@@ -0,0 +1,221 @@
+import heapq
+import random
+import selectors
+import time
+
+from MemoCliente import ClienteMemorama
+
+class EstadisticasCarga:
+    """Resultados de una prueba de carga"""
+    
+    def __init__(self):
+        self.latencias = []           # Segundos entre enviar JUGAR y recibir su DELTA o JUGADA
+        self.jugadas = 0
+        self.partidas_terminadas = 0
+        self.errores_conexion = 0
+        self.rechazos = 0             # Conexiones que el servidor respondió con OCUPADO
+    
+    def registrar_latencia(self, segundos):
+        self.jugadas += 1
+        self.latencias.append(segundos)
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+class BotMemorama(ClienteMemorama):
+    """Jugador automático sin consola.
+    
+    Reutiliza los manejadores de mensajes del cliente (procesar_jugada,
+    procesar_turno, procesar_fin_juego, ...) y juega en cuanto tiene el
+    turno, recordando las cartas que ya se han visto.
+    """
+    
+    def __init__(self, estadisticas):
+        super().__init__()
+        self.estadisticas = estadisticas
+        self.conocidas = {}           # {(fila, col): palabra} de casillas vistas y aún ocultas
+        self.jugada_enviada = None    # Instante en que se envió la última JUGAR
+        self.termino = False          # Se recibió FIN
+        # Sin Nagle ni esperas al ACK retardado: la carga mide al servidor, no la pila TCP
+        self.sin_retardo = True
+    
+    def imprimir(self, *args, **kwargs):
+        pass
+    
+    def al_terminar(self):
+        self.termino = True
+        # Todos los bots de la sala reciben FIN y ven las mismas puntuaciones finales:
+        # la partida la cuenta solo el primero (por dirección) de los que tienen la más alta
+        if self.puntuaciones:
+            maximo = max(self.puntuaciones.values())
+            if self.mi_direccion == min(addr for addr, puntos in self.puntuaciones.items() if puntos == maximo):
+                self.estadisticas.partidas_terminadas += 1
+    
+    def al_ofrecer_revancha(self):
+        # Los bots siempre se quedan: la siguiente partida empieza sin volver a conectarse
+        self.enviar_mensaje("REVANCHA")
+        return True
+    
+    def procesar_revancha(self, data):
+        super().procesar_revancha(data)
+        self.conocidas = {}
+        self.jugada_enviada = None
+        self.termino = False
+    
+    def despachar_mensaje(self, data):
+        # ultima_jugada solo queda asignada si este mensaje aplicó una jugada
+        self.ultima_jugada = None
+        continuar = super().despachar_mensaje(data)
+        if self.ultima_jugada is not None:
+            self._registrar_jugada()
+        return continuar
+    
+    def _registrar_jugada(self):
+        jugador, fila1, col1, palabra1, fila2, col2, palabra2, acierto = self.ultima_jugada
+        if acierto:
+            self.conocidas.pop((fila1, col1), None)
+            self.conocidas.pop((fila2, col2), None)
+        else:
+            self.conocidas[(fila1, col1)] = palabra1
+            self.conocidas[(fila2, col2)] = palabra2
+        
+        if jugador == self.mi_direccion and self.jugada_enviada is not None:
+            self.estadisticas.registrar_latencia(time.perf_counter() - self.jugada_enviada)
+            self.jugada_enviada = None
+    
+    def elegir_jugada(self):
+        # Un par que ya se ha visto
+        vistas = {}
+        for casilla, palabra in self.conocidas.items():
+            if self.tablero_visible[casilla[0]][casilla[1]] != "?":
+                continue  # Destapada por un estado completo recibido después
+            if palabra in vistas:
+                return vistas[palabra], casilla
+            vistas[palabra] = casilla
+        
+        # Casillas ocultas que aún no se han visto
+        desconocidas = [(i, j) for i in range(self.filas) for j in range(self.columnas)
+                        if self.tablero_visible[i][j] == "?" and (i, j) not in self.conocidas]
+        if len(desconocidas) >= 2:
+            return tuple(random.sample(desconocidas, 2))
+        ocultas = [casilla for casilla in self.conocidas if self.tablero_visible[casilla[0]][casilla[1]] == "?"]
+        if desconocidas and ocultas:
+            return desconocidas[0], ocultas[0]
+        return None
+    
+    def intentar_jugar(self):
+        if not self.juego_activo or self.turno_actual != self.mi_direccion or self.jugada_pendiente:
+            return
+        jugada = self.elegir_jugada()
+        if jugada is None:
+            return
+        (fila1, col1), (fila2, col2) = jugada
+        self.jugada_pendiente = True
+        self.jugada_enviada = time.perf_counter()
+        self.enviar_mensaje(f"JUGAR:{fila1},{col1}:{fila2},{col2}")
+
+def generar_carga(host, puerto, num_bots, num_salas, dificultad, duracion):
+    """Lanza num_bots bots repartidos en num_salas salas durante duracion segundos.
+    
+    Todos los bots se atienden desde un solo hilo con un selector. Cuando
+    termina una partida sus bots aceptan la revancha y siguen en la misma
+    conexión; si el servidor no la ofrece, se vuelven a conectar a la misma
+    sala para empezar otra. Un bot rechazado con OCUPADO vuelve a intentarlo
+    pasados los segundos que indica el servidor.
+    """
+    estadisticas = EstadisticasCarga()
+    selector = selectors.DefaultSelector()
+    reintentos = []  # montículo de (instante, número, sala) de bots que esperan para reconectarse
+    
+    def conectar_bot(sala):
+        bot = BotMemorama(estadisticas)
+        try:
+            pendientes = bot.conectar(host, puerto, sala, dificultad, revancha=True)
+        except OSError:
+            estadisticas.errores_conexion += 1
+            return
+        if bot.reintentar is not None:
+            estadisticas.rechazos += 1
+            bot.cliente_socket.close()
+            heapq.heappush(reintentos, (time.perf_counter() + bot.reintentar, len(reintentos), sala))
+            return
+        bot.sala = sala
+        selector.register(bot.cliente_socket, selectors.EVENT_READ, bot)
+        for data in pendientes:
+            bot.despachar_mensaje(data)
+        bot.intentar_jugar()
+    
+    def cerrar_bot(bot):
+        selector.unregister(bot.cliente_socket)
+        try:
+            bot.cliente_socket.close()
+        except OSError:
+            pass
+    
+    for i in range(num_bots):
+        conectar_bot(f"carga-{i % num_salas}")
+    
+    inicio = time.perf_counter()
+    fin = inicio + duracion
+    while time.perf_counter() < fin:
+        while reintentos and reintentos[0][0] <= time.perf_counter():
+            conectar_bot(heapq.heappop(reintentos)[2])
+        for clave, _ in selector.select(0.1):
+            bot = clave.data
+            try:
+                mensajes = bot.recibir_mensajes()
+                continuar = mensajes is not None
+                for data in mensajes or ():
+                    if not bot.despachar_mensaje(data):
+                        continuar = False
+                        break
+                if continuar:
+                    bot.intentar_jugar()
+                    continue
+            except OSError:
+                pass
+            
+            # La partida terminó sin revancha o la conexión se perdió: volver a entrar en la sala
+            if not bot.termino:
+                estadisticas.errores_conexion += 1
+            cerrar_bot(bot)
+            conectar_bot(bot.sala)
+    
+    transcurrido = time.perf_counter() - inicio
+    for clave in list(selector.get_map().values()):
+        cerrar_bot(clave.data)
+    selector.close()
+    return estadisticas, transcurrido
+
+def imprimir_informe(estadisticas, transcurrido, num_bots, num_salas):
+    latencias = sorted(estadisticas.latencias)
+    print("\nResultados de la prueba de carga")
+    print(f"Bots: {num_bots}  Salas: {num_salas}  Duración: {transcurrido:.1f} segundos")
+    print(f"Jugadas: {estadisticas.jugadas} ({estadisticas.jugadas / transcurrido:.1f} jugadas/s)")
+    print("Latencia jugada -> difusión (ms): "
+          f"p50 {percentil(latencias, 50) * 1000:.2f}  "
+          f"p90 {percentil(latencias, 90) * 1000:.2f}  "
+          f"p99 {percentil(latencias, 99) * 1000:.2f}  "
+          f"máx {(latencias[-1] if latencias else 0) * 1000:.2f}")
+    print(f"Partidas terminadas: {estadisticas.partidas_terminadas}")
+    print(f"Errores de conexión: {estadisticas.errores_conexion}")
+    print(f"Conexiones rechazadas por servidor ocupado: {estadisticas.rechazos}")
+
+if __name__ == "__main__":
+    print("Generador de carga de Memorama Multijugador")
+    host = input("Ingrese la dirección IP del servidor (presione Enter para usar 127.0.0.1): ") or "127.0.0.1"
+    try:
+        puerto = int(input("Ingrese el puerto del servidor (presione Enter para usar 65432): ") or "65432")
+        num_bots = int(input("Número de bots (presione Enter para usar 20): ") or "20")
+        num_salas = int(input("Número de salas (presione Enter para usar 5): ") or "5")
+        duracion = float(input("Duración en segundos (presione Enter para usar 30): ") or "30")
+    except ValueError:
+        print("Valor inválido. Usando 65432, 20 bots, 5 salas y 30 segundos.")
+        puerto, num_bots, num_salas, duracion = 65432, 20, 5, 30.0
+    dificultad = input("Dificultad de las salas (1, 2 o un tamaño como 20x30, Enter para la del servidor): ").strip()
+    
+    estadisticas, transcurrido = generar_carga(host, puerto, num_bots, max(1, num_salas), dificultad, duracion)
+    imprimir_informe(estadisticas, transcurrido, num_bots, num_salas)
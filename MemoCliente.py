@@ -2,383 +2,783 @@ import socket
 import threading
 import time
 import json
+import re
 
-# Variables globales
-buffer_size = 1024
-tablero_visible = []
-filas = 0
-columnas = 0
-puntuaciones = {}
-cliente_socket = None
-juego_activo = True
-turno_actual = None  # Nueva variable para rastrear de quién es el turno
-mi_direccion = None  # Para almacenar la dirección del cliente actual
+import protocolo
 
-def imprimir_tablero():
-    print("\n  ", end="")
-    for j in range(columnas):
-        print(f" {j} ", end="")
-    print()
-    
-    for i in range(filas):
-        print(f"{i} ", end="")
-        for j in range(columnas):
-            contenido = tablero_visible[i][j]
-            if contenido == "?":
-                print("[?  ]", end="")
-            else:
-                print(f"[{contenido[:3]:3}]", end="")
-        print()
-
-def imprimir_puntuaciones():
-    print("\nPuntuaciones:")
-    for addr, puntos in puntuaciones.items():
-        print(f"Jugador {addr}: {puntos} puntos")
-    
-    # Mostrar información sobre el turno actual
-    if turno_actual:
-        if turno_actual == mi_direccion:
-            print("\n¡ES TU TURNO PARA JUGAR!")
-        else:
-            print(f"\nEs el turno del jugador {turno_actual}")
-
-def solicitar_coordenadas():
-    while True:
-        try:
-            print("\nIngrese las coordenadas de las dos casillas a destapar")
-            fila1 = int(input("Fila de la primera casilla: "))
-            col1 = int(input("Columna de la primera casilla: "))
-            fila2 = int(input("Fila de la segunda casilla: "))
-            col2 = int(input("Columna de la segunda casilla: "))
-            
-            # Validar coordenadas
-            if not (0 <= fila1 < filas and 0 <= col1 < columnas and 
-                    0 <= fila2 < filas and 0 <= col2 < columnas):
-                print("Coordenadas fuera de rango, intente de nuevo")
-                continue
-            
-            # Verificar que no sean la misma casilla
-            if fila1 == fila2 and col1 == col2:
-                print("No puede seleccionar la misma casilla dos veces, intente de nuevo")
-                continue
-            
-            # Verificar que las casillas no estén ya destapadas
-            if tablero_visible[fila1][col1] != "?" or tablero_visible[fila2][col2] != "?":
-                print("Una o ambas casillas ya están destapadas, intente de nuevo")
-                continue
-            
-            return fila1, col1, fila2, col2
-        
-        except ValueError:
-            print("Por favor, ingrese números enteros válidos")
-        except IndexError:
-            print(f"Error: Coordenadas fuera de rango. El tablero es de {filas}x{columnas}")
+SALA_BUSCAR = "*"  # Nombre de sala para pedir partida en la sala de espera del servidor
 
-def procesar_jugada(data):
-    global puntuaciones, tablero_visible, juego_activo
+class ClienteMemorama:
+    """Estado y manejo de mensajes de un jugador.
     
-    try:
-        # JUGADA:IP:puerto:fila1,col1:palabra1:fila2,col2:palabra2:acierto:tablero:puntuaciones
-        partes = data.split(":", 9)  # Máximo 10 partes
-        ip_jugador = partes[1]
-        puerto_jugador = partes[2]
-        coord1 = partes[3].split(",")
-        palabra1 = partes[4]
-        coord2 = partes[5].split(",")
-        palabra2 = partes[6]
-        acierto = partes[7] == "1"
-        tablero_json = partes[8]
-        if len(partes) > 9:
-            puntuaciones_json = partes[9]
-            try:
-                puntuaciones = json.loads(puntuaciones_json)
-            except json.JSONDecodeError:
-                print(f"Error al decodificar puntuaciones: {puntuaciones_json}")
-    except Exception as e:
-        print(f"Error al procesar mensaje de jugada: {e}")
-        print(f"Mensaje recibido: {data}")
-        return False
+    El cliente interactivo y los bots de MemoBot.py comparten esta clase:
+    los bots reutilizan los manejadores de mensajes y solo cambian cómo se
+    eligen las jugadas y qué se muestra por consola.
+    """
     
-    fila1, col1 = int(coord1[0]), int(coord1[1])
-    fila2, col2 = int(coord2[0]), int(coord2[1])
+    def __init__(self):
+        self.buffer_size = 65536
+        self.decodificador = protocolo.DecodificadorTramas()
+        self.tablero_visible = []
+        self.filas = 0
+        self.columnas = 0
+        self.dificultad = None
+        self.puntuaciones = {}
+        self.cliente_socket = None
+        self.juego_activo = True
+        self.turno_actual = None  # Nueva variable para rastrear de quién es el turno
+        self.mi_direccion = None  # Para almacenar la dirección del cliente actual
+        self.ultima_jugada = None  # (ip:puerto, fila1, col1, palabra1, fila2, col2, palabra2, acierto)
+        self.version = None        # Versión del estado aplicado; None mientras se espera un ESTADO
+        self.espectador = False    # Solo mira la partida: nunca tiene turno
+        self.revancha = False      # Pidió poder quedarse a la revancha al terminar (capacidad REVANCHA)
+        self.oferta_revancha = None  # Segundos para aceptar la revancha que ofrece el servidor
+        self.sin_procesar = []     # Mensajes recibidos que el hilo de escucha no llegó a procesar
+        self.hilo = None           # Hilo de escucha de la partida en curso
+        self.reintentar = None     # Segundos que pidió esperar el servidor al responder OCUPADO
+        self.servidor = None       # (host, puerto) del servidor, para volver a conectarse
+        self.sesion = None         # (sala, token, segundos de gracia) para volver al asiento tras un corte
+        self.sin_retardo = False   # TCP_NODELAY: cada mensaje sale sin esperar al ACK del anterior
+        
+        # El hilo de escucha avisa con esta condición cada vez que cambia el estado
+        self.condicion = threading.Condition()
+        self.jugada_pendiente = False  # Se envió una jugada y aún no llega su respuesta
+        
+        # Cambios desde la última vez que se mostró el estado (solo se muestra lo que cambió)
+        self.casillas_cambiadas = set()       # {(fila, col)} destapadas desde la última vez
+        self.revision_tablero = 0             # Aumenta cada vez que se destapan casillas
+        self.revision_mostrada = -1           # Revisión del último tablero completo mostrado
+        self.puntuaciones_mostradas = {}
+        self.turno_mostrado = None
     
-    # Actualizar tablero
-    try:
-        tablero_visible = json.loads(tablero_json)
-    except json.JSONDecodeError:
-        print(f"Error al decodificar tablero: {tablero_json}")
-    except Exception as e:
-        print(f"Error general al procesar tablero: {e}")
-        return False
+    def imprimir(self, *args, **kwargs):
+        """Salida por consola; los bots la desactivan"""
+        print(*args, **kwargs)
     
-    # Mostrar casillas destapadas
-    print(f"\nJugada del jugador {ip_jugador}:{puerto_jugador}:")
-    print(f"[{fila1},{col1}] = {palabra1}")
-    print(f"[{fila2},{col2}] = {palabra2}")
+    def imprimir_tablero(self):
+        self.revision_mostrada = self.revision_tablero
+        self.imprimir("\n  ", end="")
+        for j in range(self.columnas):
+            self.imprimir(f" {j} ", end="")
+        self.imprimir()
+        
+        for i in range(self.filas):
+            self.imprimir(f"{i} ", end="")
+            for j in range(self.columnas):
+                contenido = self.tablero_visible[i][j]
+                if contenido == "?":
+                    self.imprimir("[?  ]", end="")
+                else:
+                    self.imprimir(f"[{contenido[:3]:3}]", end="")
+            self.imprimir()
     
-    if acierto:
-        print(f"¡El jugador {ip_jugador}:{puerto_jugador} encontró un par!")
-    else:
-        print(f"Las casillas no coinciden.")
+    def imprimir_puntuaciones(self):
+        self.imprimir("\nPuntuaciones:")
+        for addr, puntos in self.puntuaciones.items():
+            self.imprimir(f"Jugador {addr}: {puntos} puntos")
+        self.puntuaciones_mostradas = dict(self.puntuaciones)
+        self.casillas_cambiadas.clear()
     
-    return acierto
-
-def procesar_fin_juego(data):
-    global juego_activo
+    def imprimir_turno(self):
+        self.turno_mostrado = self.turno_actual
+        if self.turno_actual == self.mi_direccion:
+            self.imprimir("\n¡ES TU TURNO PARA JUGAR!")
+        elif self.turno_actual:
+            self.imprimir(f"\nEs el turno del jugador {self.turno_actual}")
     
-    try:
-        # FIN:IP:puerto:duracion:maxPuntos:motivo
-        partes = data.split(":")
-        resultado = partes[1]
+    def imprimir_cambios(self):
+        """Muestra solo las casillas, puntuaciones y turno que cambiaron desde la última vez"""
+        if self.casillas_cambiadas:
+            casillas = ", ".join(f"[{fila},{col}] = {self.tablero_visible[fila][col]}"
+                                 for fila, col in sorted(self.casillas_cambiadas))
+            self.imprimir(f"Casillas destapadas: {casillas}")
+            self.casillas_cambiadas.clear()
+        
+        for addr, puntos in self.puntuaciones.items():
+            if self.puntuaciones_mostradas.get(addr) != puntos:
+                self.imprimir(f"Jugador {addr}: {puntos} puntos")
+                self.puntuaciones_mostradas[addr] = puntos
         
-        if resultado == "EMPATE":
-            duracion = float(partes[2])
-            max_puntos = int(partes[3])
-            motivo = partes[4] if len(partes) > 4 else "COMPLETADO"
+        if self.turno_actual != self.turno_mostrado:
+            self.imprimir_turno()
+    
+    def solicitar_coordenadas(self):
+        filas, columnas = self.filas, self.columnas
+        while True:
+            try:
+                print("\nIngrese las coordenadas de las dos casillas a destapar")
+                fila1 = int(input("Fila de la primera casilla: "))
+                col1 = int(input("Columna de la primera casilla: "))
+                fila2 = int(input("Fila de la segunda casilla: "))
+                col2 = int(input("Columna de la segunda casilla: "))
+                
+                # Validar coordenadas
+                if not (0 <= fila1 < filas and 0 <= col1 < columnas and
+                        0 <= fila2 < filas and 0 <= col2 < columnas):
+                    print("Coordenadas fuera de rango, intente de nuevo")
+                    continue
+                
+                # Verificar que no sean la misma casilla
+                if fila1 == fila2 and col1 == col2:
+                    print("No puede seleccionar la misma casilla dos veces, intente de nuevo")
+                    continue
+                
+                # Verificar que las casillas no estén ya destapadas
+                if self.tablero_visible[fila1][col1] != "?" or self.tablero_visible[fila2][col2] != "?":
+                    print("Una o ambas casillas ya están destapadas, intente de nuevo")
+                    continue
+                
+                return fila1, col1, fila2, col2
             
-            print("\n¡Juego terminado!")
-            print(f"Motivo: {motivo}")
-            print(f"Duración: {duracion:.2f} segundos")
-            print("El juego terminó en empate.")
+            except ValueError:
+                print("Por favor, ingrese números enteros válidos")
+            except IndexError:
+                print(f"Error: Coordenadas fuera de rango. El tablero es de {filas}x{columnas}")
+    
+    def procesar_jugada(self, data):
+        """Jugada de un servidor sin deltas.
+        
+        Se aplica en el sitio con las casillas y palabras del propio mensaje;
+        el tablero y las puntuaciones completos que vienen al final no se
+        decodifican.
+        """
+        try:
+            # JUGADA:IP:puerto:fila1,col1:palabra1:fila2,col2:palabra2:acierto:tablero:puntuaciones
+            partes = data.split(":", 8)
+            jugador = f"{partes[1]}:{partes[2]}"
+            fila1, col1 = map(int, partes[3].split(","))
+            fila2, col2 = map(int, partes[5].split(","))
+            acierto = partes[7] == "1"
+        except Exception as e:
+            self.imprimir(f"Error al procesar mensaje de jugada: {e}")
+            self.imprimir(f"Mensaje recibido: {data}")
+            return False
+        
+        puntos = self.puntuaciones.get(jugador, 0) + 1 if acierto else None
+        return self.aplicar_jugada(jugador, fila1, col1, partes[4], fila2, col2, partes[6], acierto, puntos)
+    
+    def procesar_delta(self, data):
+        """Jugada con versión: se aplica en el sitio si es la siguiente a la que ya se tiene"""
+        try:
+            # DELTA:version:IP:puerto:fila1,col1:palabra1:fila2,col2:palabra2:acierto:puntos
+            partes = data.split(":")
+            version = int(partes[1])
+            jugador = f"{partes[2]}:{partes[3]}"
+            fila1, col1 = map(int, partes[4].split(","))
+            fila2, col2 = map(int, partes[6].split(","))
+            acierto = partes[8] == "1"
+            puntos = int(partes[9])
+        except Exception as e:
+            self.imprimir(f"Error al procesar mensaje de jugada: {e}")
+            self.imprimir(f"Mensaje recibido: {data}")
+            return False
+        
+        if jugador == self.mi_direccion:
+            self.jugada_pendiente = False  # El servidor respondió aunque la jugada no se aplique aquí
+        if self.version is None or version <= self.version:
+            # Esperando un estado completo, o jugada ya incluida en él
+            return False
+        if version != self.version + 1:
+            # Se perdió alguna jugada: pedir el estado completo en lugar de aplicar esta
+            self.version = None
+            self.enviar_mensaje("ESTADO")
+            return False
+        
+        self.version = version
+        return self.aplicar_jugada(jugador, fila1, col1, partes[5], fila2, col2, partes[7], acierto, puntos)
+    
+    def aplicar_jugada(self, jugador, fila1, col1, palabra1, fila2, col2, palabra2, acierto, puntos):
+        """Actualiza el tablero y las puntuaciones en el sitio; el coste no depende de su tamaño"""
+        if acierto:
+            self.tablero_visible[fila1][col1] = palabra1
+            self.tablero_visible[fila2][col2] = palabra2
+            self.revision_tablero += 1
+        if puntos is not None:
+            self.puntuaciones[jugador] = puntos
+        elif jugador not in self.puntuaciones:
+            self.puntuaciones[jugador] = 0
+        
+        self.ultima_jugada = (jugador, fila1, col1, palabra1, fila2, col2, palabra2, acierto)
+        if jugador == self.mi_direccion:
+            self.jugada_pendiente = False
+        
+        # Mostrar casillas destapadas (la jugada ya las nombra, no hace falta repetirlas)
+        self.imprimir(f"\nJugada del jugador {jugador}:")
+        self.imprimir(f"[{fila1},{col1}] = {palabra1}")
+        self.imprimir(f"[{fila2},{col2}] = {palabra2}")
+        
+        if acierto:
+            self.imprimir(f"¡El jugador {jugador} encontró un par!")
         else:
-            ip_ganador = partes[1]
-            puerto_ganador = partes[2]
-            duracion = float(partes[3])
-            max_puntos = int(partes[4])
-            motivo = partes[5] if len(partes) > 5 else "COMPLETADO"
-            
-            print("\n¡Juego terminado!")
-            print(f"Motivo: {motivo}")
-            print(f"Duración: {duracion:.2f} segundos")
-            print(f"Ganador: Jugador {ip_ganador}:{puerto_ganador} con {max_puntos} puntos")
+            self.imprimir(f"Las casillas no coinciden.")
         
-        imprimir_puntuaciones()
-        juego_activo = False
+        return acierto
+    
+    def procesar_estado(self, data):
+        """Estado completo (al unirse o tras perder jugadas) - ESTADO:version:tablero:puntuaciones"""
+        try:
+            _, version, resto = data.split(":", 2)
+            version = int(version)
+            if self.version is not None and version <= self.version:
+                return  # Ya se tiene un estado igual o más reciente
+            tablero, fin = json.JSONDecoder().raw_decode(resto)
+            puntuaciones = json.loads(resto[fin + 1:])
+        except Exception as e:
+            self.imprimir(f"Error al procesar el estado completo: {e}")
+            return
+        
+        # Anotar las casillas que cambiaron para mostrar solo esas
+        for i, fila in enumerate(tablero):
+            for j, contenido in enumerate(fila):
+                if i < len(self.tablero_visible) and j < len(self.tablero_visible[i]) and self.tablero_visible[i][j] != contenido:
+                    self.casillas_cambiadas.add((i, j))
+        if self.casillas_cambiadas:
+            self.revision_tablero += 1
+        
+        self.tablero_visible = tablero
+        self.puntuaciones = puntuaciones
+        self.version = version
+    
+    def procesar_fin_juego(self, data):
+        try:
+            # FIN:IP:puerto:duracion:maxPuntos:motivo
+            partes = data.split(":")
+            resultado = partes[1]
+            
+            if resultado == "EMPATE":
+                duracion = float(partes[2])
+                max_puntos = int(partes[3])
+                motivo = partes[4] if len(partes) > 4 else "COMPLETADO"
+                
+                self.imprimir("\n¡Juego terminado!")
+                self.imprimir(f"Motivo: {motivo}")
+                self.imprimir(f"Duración: {duracion:.2f} segundos")
+                self.imprimir("El juego terminó en empate.")
+            else:
+                ip_ganador = partes[1]
+                puerto_ganador = partes[2]
+                duracion = float(partes[3])
+                max_puntos = int(partes[4])
+                motivo = partes[5] if len(partes) > 5 else "COMPLETADO"
+                
+                self.imprimir("\n¡Juego terminado!")
+                self.imprimir(f"Motivo: {motivo}")
+                self.imprimir(f"Duración: {duracion:.2f} segundos")
+                self.imprimir(f"Ganador: Jugador {ip_ganador}:{puerto_ganador} con {max_puntos} puntos")
+            
+            self.imprimir_puntuaciones()
+            self.juego_activo = False
+            
+            # Terminar la aplicación
+            self.imprimir("El juego ha terminado")
+            self.al_terminar()
         
-        # Terminar la aplicación
-        print("El juego ha terminado")
+        except Exception as e:
+            self.imprimir(f"Error al procesar mensaje de fin de juego: {e}")
+            self.imprimir(f"Mensaje recibido: {data}")
+            self.juego_activo = False
+    
+    def al_terminar(self):
+        """Se llama al recibir FIN; el cliente interactivo se cierra a los 5 segundos"""
+        if self.revancha:
+            return  # Se espera la oferta de revancha del servidor
         # Programar salida automática después de 5 segundos
-        import threading, time, sys
         def salida_automatica():
             time.sleep(5)
             import os
             os._exit(0)  # Forzar terminación
         # Iniciar hilo para salida automática
         threading.Thread(target=salida_automatica, daemon=True).start()
+    
+    def procesar_conexion(self, data):
+        try:
+            # CONEXION:IP:puerto
+            partes = data.split(":")
+            ip = partes[1]
+            puerto = partes[2]
+            
+            self.imprimir(f"\nNuevo jugador conectado: {ip}:{puerto}")
+        except Exception as e:
+            self.imprimir(f"Error al procesar mensaje de conexión: {e}")
+            self.imprimir(f"Mensaje recibido: {data}")
+    
+    def procesar_desconexion(self, data):
+        try:
+            # DESCONEXION:IP:puerto
+            partes = data.split(":")
+            ip = partes[1]
+            puerto = partes[2]
+            
+            self.imprimir(f"\nJugador desconectado: {ip}:{puerto}")
+            
+            # Eliminar jugador de puntuaciones si existe
+            addr = f"{ip}:{puerto}"
+            if addr in self.puntuaciones:
+                del self.puntuaciones[addr]
+        except Exception as e:
+            self.imprimir(f"Error al procesar mensaje de desconexión: {e}")
+            self.imprimir(f"Mensaje recibido: {data}")
+    
+    def procesar_turno(self, data):
+        try:
+            # TURNO:IP:puerto
+            partes = data.split(":")
+            self.turno_actual = partes[1]
+            if len(partes) > 2:
+                self.turno_actual = f"{self.turno_actual}:{partes[2]}"  # Asegurar formato IP:puerto
         
-    except Exception as e:
-        print(f"Error al procesar mensaje de fin de juego: {e}")
-        print(f"Mensaje recibido: {data}")
-        juego_activo = False
-
-def procesar_conexion(data):
-    try:
-        # CONEXION:IP:puerto
-        partes = data.split(":")
-        ip = partes[1]
-        puerto = partes[2]
-        
-        print(f"\nNuevo jugador conectado: {ip}:{puerto}")
-    except Exception as e:
-        print(f"Error al procesar mensaje de conexión: {e}")
-        print(f"Mensaje recibido: {data}")
-
-def procesar_desconexion(data):
-    try:
-        # DESCONEXION:IP:puerto
+        except Exception as e:
+            self.imprimir(f"Error al procesar mensaje de turno: {e}")
+            self.imprimir(f"Mensaje recibido: {data}")
+    
+    def al_ofrecer_revancha(self):
+        """Se llama al recibir REVANCHA. Devuelve False para dejar de escuchar y preguntar al jugador"""
+        return False
+    
+    def procesar_revancha(self, data):
+        """CONFIG de la revancha: misma conexión, pero tablero, puntuaciones y turno nuevos"""
+        self.oferta_revancha = None
+        self.puntuaciones = {}
+        self.version = None
+        self.turno_actual = None
+        self.ultima_jugada = None
+        self.jugada_pendiente = False
+        self.casillas_cambiadas.clear()
+        self.revision_tablero += 1
+        self.puntuaciones_mostradas = {}
+        self.turno_mostrado = None
+        self.juego_activo = True
+        self.procesar_config(data)
+    
+    def procesar_config(self, data):
+        # CONFIG:dificultad:filas:columnas
         partes = data.split(":")
-        ip = partes[1]
-        puerto = partes[2]
+        self.dificultad = partes[1]
+        self.filas = int(partes[2])
+        self.columnas = int(partes[3])
         
-        print(f"\nJugador desconectado: {ip}:{puerto}")
+        # Inicializar tablero visible (lo que el jugador puede ver)
+        self.tablero_visible = []
+        for i in range(self.filas):
+            fila = []
+            for j in range(self.columnas):
+                fila.append("?")
+            self.tablero_visible.append(fila)
+    
+    def recibir_mensajes(self):
+        """Recibe datos del servidor y devuelve los mensajes completos (puede ser una lista vacía)"""
+        datos = self.cliente_socket.recv(self.buffer_size)
+        if not datos:
+            return None
+        return self.decodificador.alimentar(datos)
+    
+    def enviar_mensaje(self, mensaje):
+        self.cliente_socket.sendall(protocolo.codificar_trama(mensaje))
+    
+    def despachar_mensaje(self, data):
+        """Procesa un mensaje del servidor. Devuelve False si hay que dejar de escuchar"""
+        # Responder a PING con PONG para mantener la conexión
+        if data == "PING":
+            self.enviar_mensaje("PONG")
+            return True
         
-        # Eliminar jugador de puntuaciones si existe
-        addr = f"{ip}:{puerto}"
-        if addr in puntuaciones:
-            del puntuaciones[addr]
-    except Exception as e:
-        print(f"Error al procesar mensaje de desconexión: {e}")
-        print(f"Mensaje recibido: {data}")
-
-def procesar_turno(data):
-    global turno_actual
+        if data.startswith("DELTA:"):
+            self.procesar_delta(data)
+            self.imprimir_cambios()
+        elif data.startswith("ESTADO:"):
+            self.procesar_estado(data)
+            self.imprimir_cambios()
+        elif data.startswith("JUGADA:"):
+            self.procesar_jugada(data)
+            self.imprimir_cambios()
+        elif data.startswith("FIN:"):
+            self.procesar_fin_juego(data)
+            # El juego ha terminado; si se pidió la revancha, falta la oferta del servidor
+            return self.revancha
+        elif data.startswith("REVANCHA:"):
+            # REVANCHA:segundos - se puede seguir en la sala con una partida nueva
+            self.oferta_revancha = float(data.split(":")[1])
+            return self.al_ofrecer_revancha()
+        elif data.startswith("CONFIG:"):
+            # La revancha empieza: llega la configuración como al unirse
+            self.procesar_revancha(data)
+        elif data.startswith("DESPEDIDA:"):
+            mensaje = data.split(":", 1)[1]
+            self.imprimir(f"\n{mensaje}")
+            self.imprimir("El servidor ha cerrado la conexión. Saliendo...")
+            self.juego_activo = False
+            return False
+        elif data.startswith("CONEXION:"):
+            self.procesar_conexion(data)
+        elif data.startswith("DESCONEXION:"):
+            self.procesar_desconexion(data)
+        elif data.startswith("ERROR:"):
+            self.jugada_pendiente = False
+            self.imprimir(f"\nError: {data.split(':')[1]}")
+        elif data.startswith("TURNO:"):
+            self.procesar_turno(data)
+            self.imprimir_cambios()
+        elif data.startswith("ESPERAR:"):
+            # ESPERAR:IP:puerto
+            self.jugada_pendiente = False
+            self.turno_actual = data[len("ESPERAR:"):]
+            self.imprimir(f"\nNo es tu turno. Actualmente es el turno del jugador {self.turno_actual}")
+        elif data.startswith("SESION:"):
+            # SESION:sala:token:segundos - con REANUDAR se puede volver al asiento si se corta la conexión
+            _, sala, token, gracia = data.split(":")
+            self.sesion = (sala, token, float(gracia))
+        elif data.startswith("ESPECTADOR:"):
+            # ESPECTADOR:motivo - el servidor nos ha sacado de los turnos; la partida sigue llegando
+            self.espectador = True
+            self.jugada_pendiente = False
+            self.imprimir(f"\n{data.split(':', 1)[1]}. Ahora solo ves la partida.")
+        else:
+            self.imprimir(f"Mensaje desconocido del servidor: {data}")
+        return True
     
-    try:
-        # TURNO:IP:puerto
-        partes = data.split(":")
-        turno_actual = partes[1]
-        if len(partes) > 2:
-            turno_actual = f"{turno_actual}:{partes[2]}"  # Asegurar formato IP:puerto
+    def conectar(self, host, puerto_servidor, sala, dificultad_sala, puerto_local=0, espectador=False, mazo="",
+                 revancha=False, sesion=False):
+        """Conecta con el servidor, se une a la sala (o la mira como espectador) y procesa CONFIG.
         
-        print(f"Procesando turno, mi dirección: {mi_direccion}, turno actual: {turno_actual}")
+        Con revancha, al terminar la partida el servidor ofrece quedarse a
+        otra en la misma conexión; con sesion, si la conexión se corta se
+        vuelve al mismo asiento (ver reanudar_sesion). Devuelve los mensajes
+        que llegaron junto con CONFIG y aún no se han procesado.
+        """
+        self.servidor = (host, puerto_servidor)
+        # Crear socket TCP
+        self.cliente_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.cliente_socket.bind(('', puerto_local))  # Bind a cualquier interfaz, puerto dinámico
+        self.cliente_socket.connect((host, puerto_servidor))
+        if self.sin_retardo:
+            self.cliente_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
-        if turno_actual == mi_direccion:
-            print("\n¡ES TU TURNO PARA JUGAR!")
+        # Aumentar el tiempo de espera del socket
+        self.cliente_socket.settimeout(100)  # 100 segundos
+        
+        # Obtener el puerto local asignado
+        _, puerto_asignado = self.cliente_socket.getsockname()
+        
+        # Guardar mi dirección para comparaciones futuras
+        self.mi_direccion = f"{host}:{puerto_asignado}"
+        
+        # Pedir al servidor unirse a la sala - UNIR:sala:dificultad:capacidades[::mazo]
+        # El cliente usa el protocolo con tramas desde el primer mensaje y
+        # recibe las jugadas como cambios (DELTA) en lugar del tablero completo
+        # Con la sala SALA_BUSCAR se pide partida en la sala de espera - BUSCAR:dificultad:capacidades
+        self.revancha = revancha and not espectador
+        capacidades = "DELTAS,REVANCHA" if self.revancha else "DELTAS"
+        if sesion and not espectador:
+            capacidades += ",SESION"
+        if sala == SALA_BUSCAR:
+            self.espectador = False
+            self.enviar_mensaje(f"BUSCAR:{dificultad_sala}:{capacidades}")
         else:
-            print(f"\nEs el turno del jugador {turno_actual}")
-            
-    except Exception as e:
-        print(f"Error al procesar mensaje de turno: {e}")
-        print(f"Mensaje recibido: {data}")
-
-def hilo_escucha(cliente_socket):
-    global juego_activo, turno_actual
+            self.espectador = espectador
+            if espectador:
+                capacidades = "DELTAS,ESPECTADOR"
+            # El campo vacío entre las capacidades y el mazo deja el plazo por turno del servidor
+            self.enviar_mensaje(f"UNIR:{sala}:{dificultad_sala}:{capacidades}" + (f"::{mazo}" if mazo else ""))
+        
+        # Recibir configuración inicial - CONFIG:dificultad:filas:columnas
+        return self.esperar_config(self.procesar_config)
     
-    while juego_activo:
+    def aceptar_revancha(self):
+        """Acepta la revancha ofrecida y espera su CONFIG.
+        
+        Devuelve los mensajes que llegaron junto con CONFIG, o None si el
+        servidor ya cerró la ventana de revancha.
+        """
         try:
-            data = cliente_socket.recv(buffer_size).decode()
-            if not data:
-                print("Servidor desconectado")
-                juego_activo = False
-                break
-                
-            # Responder a PING con PONG para mantener la conexión
+            self.enviar_mensaje("REVANCHA")
+            pendientes = self.esperar_config(self.procesar_revancha)
+        except OSError:
+            self.imprimir("La conexión se cerró antes de empezar la revancha")
+            return None
+        return pendientes if self.juego_activo else None
+    
+    def reanudar_sesion(self):
+        """Vuelve a conectarse tras un corte y recupera el asiento con REANUDAR.
+        
+        Lo intenta con esperas crecientes mientras dura la gracia de la
+        sesión. El servidor responde REANUDADO:ip:puerto (la dirección del
+        asiento) y después solo las jugadas que se perdieron, o el ESTADO
+        completo si ya no las tiene. Devuelve los mensajes que siguen a
+        REANUDADO, o None si no se pudo volver a la partida.
+        """
+        sala, token, gracia = self.sesion
+        limite = time.monotonic() + gracia
+        espera = 0.1
+        while time.monotonic() < limite:
+            try:
+                self.cliente_socket.close()
+                self.cliente_socket = socket.create_connection(self.servidor, timeout=min(gracia, 5))
+                self.cliente_socket.settimeout(100)
+                self.decodificador = protocolo.DecodificadorTramas()
+                self.sin_procesar = []
+                # REANUDAR:sala:token:versión:capacidades - versión -1 si no hay tablero que conservar
+                version = -1 if self.version is None else self.version
+                capacidades = "DELTAS,REVANCHA" if self.revancha else "DELTAS"
+                self.enviar_mensaje(f"REANUDAR:{sala}:{token}:{version}:{capacidades}")
+                while True:
+                    data = self.siguiente_mensaje()
+                    if data is None or data.startswith("REANUDADO:"):
+                        break
+                    if data == "PING":
+                        self.enviar_mensaje("PONG")
+                    elif data.startswith("OCUPADO:"):
+                        espera = max(espera, float(data.split(":")[1]))
+                        break
+                    elif data.startswith("ERROR:"):
+                        self.imprimir(data.split(":", 1)[1])
+                        self.sesion = None
+                        return None
+                if data is not None and data.startswith("REANUDADO:"):
+                    # La dirección del asiento es la de la conexión original
+                    self.mi_direccion = data[len("REANUDADO:"):]
+                    self.jugada_pendiente = False
+                    pendientes, self.sin_procesar = self.sin_procesar, []
+                    return pendientes
+            except OSError:
+                pass
+            time.sleep(espera)
+            espera = min(espera * 2, 2.0)
+        return None
+    
+    def _recibir_o_reanudar(self):
+        """Como recibir_mensajes, pero si la conexión se corta intenta volver al asiento de la sesión"""
+        try:
+            mensajes = self.recibir_mensajes()
+            if mensajes is not None:
+                return mensajes
+        except socket.timeout:
+            raise
+        except OSError:
+            if self.sesion is None:
+                raise
+        if self.sesion is None or not self.juego_activo:
+            return None
+        self.imprimir("\nConexión perdida. Intentando volver a la partida...")
+        mensajes = self.reanudar_sesion()
+        if mensajes is not None:
+            self.imprimir("De vuelta en la partida")
+        return mensajes
+    
+    def esperar_config(self, procesar):
+        """Lee mensajes hasta CONFIG y lo procesa con la función dada. Devuelve los mensajes que le siguen"""
+        # En la sala de espera (o entre partidas) llegan antes COLA y PING
+        while True:
+            data = self.siguiente_mensaje()
+            if data is None:
+                raise ConnectionResetError("El servidor cerró la conexión")
             if data == "PING":
-                cliente_socket.sendall("PONG".encode())
-                continue
-                
-            if data.startswith("JUGADA:"):
-                procesar_jugada(data)
-                # Mostrar tablero actualizado
-                imprimir_tablero()
-                imprimir_puntuaciones()
-            elif data.startswith("FIN:"):
-                procesar_fin_juego(data)
-                # El juego ha terminado
-                break
-            elif data.startswith("DESPEDIDA:"):
-                mensaje = data.split(":", 1)[1]
-                print(f"\n{mensaje}")
-                print("El servidor ha cerrado la conexión. Saliendo...")
-                juego_activo = False
-                import sys
-                sys.exit(0)
-            elif data.startswith("CONEXION:"):
-                procesar_conexion(data)
-            elif data.startswith("DESCONEXION:"):
-                procesar_desconexion(data)
-            elif data.startswith("ERROR:"):
-                print(f"\nError: {data.split(':')[1]}")
-            elif data.startswith("TURNO:"):
-                procesar_turno(data)
-                # Mostrar tablero actualizado después del cambio de turno
-                imprimir_tablero()
-                imprimir_puntuaciones()
-            elif data.startswith("ESPERAR:"):
-                partes = data.split(":")
-                jugador_turno = partes[1]
-                print(f"\nNo es tu turno. Actualmente es el turno del jugador {jugador_turno}")
+                self.enviar_mensaje("PONG")
+            elif data.startswith("COLA:"):
+                _, dificultad_cola, en_cola = data.split(":")
+                self.imprimir(f"Esperando partida (dificultad {dificultad_cola}, {en_cola} jugador(es) en cola)...")
             else:
-                print(f"Mensaje desconocido del servidor: {data}")
-                
-        except socket.timeout:
-            print("Timeout: No se recibió respuesta del servidor en el tiempo esperado")
-            print("La conexión se ha perdido. Saliendo del juego.")
-            juego_activo = False
-            break
-        except ConnectionResetError:
-            print("Conexión cerrada por el servidor")
-            juego_activo = False
-            break
-        except Exception as e:
-            print(f"Error en la recepción: {e}")
-            juego_activo = False
-            break
-
-# Inicializamos la conexión
-print("Cliente de Memorama Multijugador")
-# Configurar la conexión
-host = input("Ingrese la dirección IP del servidor (presione Enter para usar 127.0.0.1): ") or "127.0.0.1"
-    
-try:
-    puerto_local = 0  # Usar puerto dinámico asignado por el sistema
-    puerto_servidor = int(input("Ingrese el puerto del servidor (presione Enter para usar 65432): ") or "65432")
-except ValueError:
-    puerto_servidor = 65432
-    print("Puerto inválido. Usando puerto 65432 por defecto.")
-
-# Crear socket TCP
-cliente_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-try:
-    print(f"Conectando al servidor en {host}:{puerto_servidor}...")
-    cliente_socket.bind(('', puerto_local))  # Bind a cualquier interfaz, puerto dinámico
-    cliente_socket.connect((host, puerto_servidor))
+                break
+        pendientes, self.sin_procesar = self.sin_procesar, []
+        if data.startswith("CONFIG:"):
+            procesar(data)
+        elif data.startswith(("DESPEDIDA:", "ERROR:")):
+            self.imprimir(data.split(":", 1)[1])
+            self.juego_activo = False
+        elif data.startswith("OCUPADO:"):
+            # OCUPADO:segundos:motivo - el servidor no admite la conexión por ahora
+            _, segundos, motivo = data.split(":", 2)
+            self.reintentar = float(segundos)
+            self.imprimir(f"{motivo}. Vuelva a intentarlo en {segundos} segundos.")
+            self.juego_activo = False
+        else:
+            self.imprimir("Respuesta inesperada del servidor")
+            self.imprimir(f"Mensaje recibido: {data}")
+            self.juego_activo = False
+        return pendientes
     
-    # Obtener el puerto local asignado
-    _, puerto_asignado = cliente_socket.getsockname()
+    def siguiente_mensaje(self):
+        """Siguiente mensaje del servidor, empezando por los que quedaron sin procesar. None si cerró"""
+        while not self.sin_procesar:
+            mensajes = self.recibir_mensajes()
+            if mensajes is None:
+                return None
+            self.sin_procesar = mensajes
+        return self.sin_procesar.pop(0)
     
-    # Guardar mi dirección para comparaciones futuras
-    mi_direccion = f"{host}:{puerto_asignado}"
-    print(f"Conectado con dirección local: {mi_direccion}")
+    def hilo_escucha(self, pendientes):
+        try:
+            self._escuchar(pendientes)
+        finally:
+            # Despertar al bucle principal también cuando termina la partida
+            self.juego_activo = False
+            with self.condicion:
+                self.condicion.notify_all()
     
-    # Aumentar el tiempo de espera del socket
-    cliente_socket.settimeout(100)  # 100 segundos
-    print("Conexión establecida")
+    def _escuchar(self, pendientes):
+        # Mensajes que llegaron en el mismo recv que CONFIG
+        with self.condicion:
+            for i, data in enumerate(pendientes):
+                if not self.despachar_mensaje(data):
+                    self.sin_procesar = pendientes[i + 1:]
+                    return
+            self.condicion.notify_all()
+        
+        # Tras FIN se sigue escuchando si se espera la oferta de revancha
+        while self.juego_activo or self.revancha:
+            try:
+                mensajes = self._recibir_o_reanudar()
+                if mensajes is None:
+                    self.imprimir("Servidor desconectado")
+                    self.juego_activo = False
+                    break
+                
+                # El bucle principal despierta en cuanto cambia el turno o llega la respuesta
+                with self.condicion:
+                    for i, data in enumerate(mensajes):
+                        if not self.despachar_mensaje(data):
+                            # Lo que venga detrás (la revancha) lo lee el bucle principal
+                            self.sin_procesar = mensajes[i + 1:]
+                            return
+                    self.condicion.notify_all()
+            
+            except socket.timeout:
+                self.imprimir("Timeout: No se recibió respuesta del servidor en el tiempo esperado")
+                self.imprimir("La conexión se ha perdido. Saliendo del juego.")
+                self.juego_activo = False
+                break
+            except ConnectionResetError:
+                self.imprimir("Conexión cerrada por el servidor")
+                self.juego_activo = False
+                break
+            except Exception as e:
+                self.imprimir(f"Error en la recepción: {e}")
+                self.juego_activo = False
+                break
     
-    # Recibir configuración inicial - CONFIG:dificultad:filas:columnas
-    data = cliente_socket.recv(buffer_size).decode()
-    if data.startswith("CONFIG:"):
-        partes = data.split(":")
-        dificultad = partes[1]
-        filas = int(partes[2])
-        columnas = int(partes[3])
+    def jugar(self, pendientes):
+        """Bucle principal del jugador humano"""
+        # Mensajes que llegaron junto con CONFIG, antes de mostrar el estado inicial
+        for data in pendientes:
+            if not self.despachar_mensaje(data):
+                return
         
-        # Inicializar tablero visible (lo que el jugador puede ver)
-        tablero_visible = []
-        for i in range(filas):
-            fila = []
-            for j in range(columnas):
-                fila.append("?")
-            tablero_visible.append(fila)
+        # Mostrar el estado inicial completo; después solo se muestran los cambios
+        self.imprimir_tablero()
+        self.imprimir_puntuaciones()
+        if self.turno_mostrado != self.turno_actual:
+            self.imprimir_turno()
         
-        print(f"\nIniciando juego en dificultad {'Principiante' if dificultad == '1' else 'Avanzado'}")
-        print(f"Tablero de {filas}x{columnas}")
-    else:
-        print("Respuesta inesperada del servidor")
-        print(f"Mensaje recibido: {data}")
-        juego_activo = False
-    
-    if juego_activo:
         # Iniciar hilo para escuchar mensajes del servidor
-        escucha_thread = threading.Thread(target=hilo_escucha, args=(cliente_socket,))
-        escucha_thread.daemon = True
-        escucha_thread.start()
+        self.hilo = threading.Thread(target=self.hilo_escucha, args=([],))
+        self.hilo.daemon = True
+        self.hilo.start()
+        
+        # Un espectador solo muestra los cambios hasta que termina la partida
+        if self.espectador:
+            with self.condicion:
+                while self.juego_activo:
+                    self.condicion.wait()
+            return
         
         # Bucle principal de juego
-        while juego_activo:
-            # Mostrar tablero actual
-            imprimir_tablero()
-            imprimir_puntuaciones()
-            
-            # Verificar si es nuestro turno
-            if turno_actual and turno_actual != mi_direccion:
-                print(f"Esperando tu turno... Actualmente es turno de {turno_actual}")
-                # Debug: mostrar detalles de las variables para diagnóstico
-                print(f"DEBUG - Mi dirección: '{mi_direccion}', Turno actual: '{turno_actual}'")
-                time.sleep(2)  # Esperar un poco antes de verificar de nuevo
-                continue
+        while self.juego_activo:
+            with self.condicion:
+                # Esperar sin sondear a que sea nuestro turno y a la respuesta de la jugada anterior
+                if self.turno_actual != self.mi_direccion and not self.jugada_pendiente:
+                    print(f"Esperando tu turno... Actualmente es turno de {self.turno_actual}")
+                while self.juego_activo and (self.turno_actual != self.mi_direccion or self.jugada_pendiente):
+                    self.condicion.wait()
+                if not self.juego_activo:
+                    break
+                
+                # Tablero completo solo cuando hay que elegir casillas y ha cambiado
+                if self.revision_mostrada != self.revision_tablero:
+                    self.imprimir_tablero()
+                    self.imprimir_puntuaciones()
             
             # Solicitar coordenadas al usuario
             print("\n¡ES TU TURNO! Selecciona las casillas:")
-            fila1, col1, fila2, col2 = solicitar_coordenadas()
+            fila1, col1, fila2, col2 = self.solicitar_coordenadas()
+            if not self.juego_activo:
+                break  # La partida terminó mientras se elegían las casillas
             
             # Enviar jugada al servidor - JUGAR:fila1,col1:fila2,col2
             mensaje = f"JUGAR:{fila1},{col1}:{fila2},{col2}"
             print(f"Enviando jugada: {mensaje}")
-            cliente_socket.sendall(mensaje.encode())
+            with self.condicion:
+                self.jugada_pendiente = True
+            try:
+                self.enviar_mensaje(mensaje)
+            except OSError:
+                # Conexión cortada: el hilo de escucha intenta volver a la partida
+                print("No se pudo enviar la jugada; vuelve a intentarlo cuando se recupere la conexión")
+                with self.condicion:
+                    self.jugada_pendiente = False
+
+def main():
+    # Inicializamos la conexión
+    print("Cliente de Memorama Multijugador")
+    # Configurar la conexión
+    host = input("Ingrese la dirección IP del servidor (presione Enter para usar 127.0.0.1): ") or "127.0.0.1"
+    
+    try:
+        puerto_servidor = int(input("Ingrese el puerto del servidor (presione Enter para usar 65432): ") or "65432")
+    except ValueError:
+        puerto_servidor = 65432
+        print("Puerto inválido. Usando puerto 65432 por defecto.")
+    
+    # Sala a la que unirse; la dificultad solo se usa si la sala es nueva
+    sala = input(f"Ingrese el nombre de la sala (presione Enter para usar la sala principal, {SALA_BUSCAR} para buscar partida con otros jugadores): ").strip().replace(":", "") or "principal"
+    dificultad_sala = input("Dificultad si la sala es nueva (1: Principiante - 4x4, 2: Avanzado - 6x6, un tamaño como 20x30, Enter para la del servidor): ").strip()
+    if dificultad_sala not in ["1", "2"] and not re.fullmatch(r"\d+x\d+", dificultad_sala):
+        dificultad_sala = ""
+    espectador = sala != SALA_BUSCAR and input("¿Entrar como espectador? Solo verás la partida (s/N): ").strip().lower() == "s"
+    mazo = ""
+    if sala != SALA_BUSCAR and not espectador:
+        mazo = input("Mazo de palabras si la sala es nueva (presione Enter para usar el del servidor): ").strip().replace(":", "")
+    
+    cliente = ClienteMemorama()
+    
+    try:
+        print(f"Conectando al servidor en {host}:{puerto_servidor}...")
+        pendientes = cliente.conectar(host, puerto_servidor, sala, dificultad_sala, espectador=espectador, mazo=mazo,
+                                      revancha=True, sesion=True)
+        print(f"Conectado con dirección local: {cliente.mi_direccion}")
+        print("Conexión establecida")
+        
+        if cliente.juego_activo:
+            nombre_dificultad = {"1": "Principiante", "2": "Avanzado"}.get(cliente.dificultad, "Personalizada")
+            print(f"\nIniciando juego en dificultad {nombre_dificultad}")
+            print(f"Tablero de {cliente.filas}x{cliente.columnas}")
+            
+            cliente.jugar(pendientes)
             
-            # Esperar un breve momento para permitir al hilo de escucha procesar la respuesta
-            time.sleep(0.5)
+            # Revancha: otra partida en la misma sala sin volver a conectarse
+            while cliente.revancha:
+                cliente.hilo.join()  # El hilo de escucha se detiene al llegar la oferta (o la despedida)
+                if cliente.oferta_revancha is None:
+                    break
+                respuesta = input(f"\n¿Jugar la revancha? Tienes {cliente.oferta_revancha:g} segundos para responder (s/N): ")
+                if respuesta.strip().lower() != "s":
+                    break
+                pendientes = cliente.aceptar_revancha()
+                if pendientes is None:
+                    break
+                print("\n¡Empieza la revancha!")
+                print(f"Tablero de {cliente.filas}x{cliente.columnas}")
+                cliente.jugar(pendientes)
+    
+    except ConnectionRefusedError:
+        print("No se pudo conectar al servidor. Verifique que el servidor esté en ejecución.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if cliente.cliente_socket:
+            try:
+                cliente.cliente_socket.close()
+            except:
+                pass
+            print("Conexión cerrada.")
 
-except ConnectionRefusedError:
-    print("No se pudo conectar al servidor. Verifique que el servidor esté en ejecución.")
-except Exception as e:
-    print(f"Error: {e}")
-finally:
-    if cliente_socket:
-        try:
-            cliente_socket.close()
-        except:
-            pass
-        print("Conexión cerrada.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
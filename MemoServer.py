@@ -1,555 +1,1078 @@
 #!/usr/bin/env python3
+import asyncio
+import ipaddress
+import json
+import re
+import selectors
 import socket
 import threading
-import random
 import time
-import json
+
+import protocolo
+import trabajadores
+from admision import (ControlAdmision, rechazar, BACKLOG, LOTE_ACEPTAR, MAXIMO_CONEXIONES,
+                      CONEXIONES_POR_SEGUNDO_IP, MENSAJES_POR_SEGUNDO)
+from conexion import ConexionSocket, ConexionAsync, POLITICA_AGRUPAR
+from diario import DiarioPartidas
+from emparejamiento import Emparejador, Espera, clave_dificultad
+from espectadores import RepartidorEspectadores
+from latidos import GestorLatidos
+from mazos import MAZO_BASICO, catalogo
+from metricas import COMANDO_ESTADISTICAS, metricas
+from plazos import PlazosTurno, PLAZO_TURNO, MAXIMO_TURNOS_VENCIDOS
+from registro import registro, NIVELES, INFO
+from sala import GestorSalas, SALA_PRINCIPAL, VENTANA_REVANCHA
+from sesiones import GestorSesiones, GRACIA_SESION
+from tablero import dimensiones_dificultad
+from temporizador import RuedaTemporizadores
 
 # Variables globales
 HOST = "127.0.0.1"
 PORT = 65432
 buffer_size = 1024
-lock = threading.RLock()  # Para proteger acceso concurrente
-conexiones_clientes = {}  # diccionario {addr_str: conn}
-hilos_clientes = {}       # diccionario {addr_str: thread}
-puntuaciones = {}         # diccionario {addr_str: puntos}
-palabras_disponibles = [
-    "árbol", "casa", "perro", "gato", "sol", "luna", "mar", "río",
-    "montaña", "bosque", "nube", "estrella", "flor", "pájaro", "libro", "pluma",
-    "avión", "tren", "camino", "jardín", "fuego", "agua", "tierra", "viento",
-    "puerta", "ventana", "mesa", "silla", "reloj", "lápiz", "papel", "tijera",
-    "manzana", "naranja", "plátano", "uva"
-]
-
-# Variables del juego
-dificultad = "1"
-filas = 4
-columnas = 4
-num_pares = 8
-tablero = []
-tablero_visible = []
-casillas_destapadas = 0
-tiempo_inicio = time.time()
-juego_activo = True
-
-# Variables para control de turnos
-turno_actual = None  # Almacena el cliente que tiene el turno actualmente
-orden_turnos = []    # Lista ordenada de jugadores
-condiciones_clientes = {}  # Condiciones para cada cliente {addr_str: threading.Condition()}
-
-def inicializar_tablero():
-    global tablero, tablero_visible
-    
-    with lock:
-        # Crear tablero con pares de palabras
-        palabras_juego = random.sample(palabras_disponibles, num_pares)
-        cartas = palabras_juego * 2
-        random.shuffle(cartas)
-        
-        # Crear el tablero como una matriz
-        tablero = []
-        for i in range(filas):
-            fila = []
-            for j in range(columnas):
-                if i*columnas + j < len(cartas):
-                    fila.append(cartas[i*columnas + j])
-                else:
-                    fila.append("")
-            tablero.append(fila)
-        
-        # Crear tablero visible para los jugadores (inicialmente todas las cartas ocultas)
-        tablero_visible = []
-        for i in range(filas):
-            fila = []
-            for j in range(columnas):
-                fila.append("?")
-            tablero_visible.append(fila)
-
-def imprimir_tablero_servidor():
-    """Imprime el tablero completo con todas las casillas destapadas (solo para el servidor)"""
-    print("\nTablero del servidor (todas las casillas):")
-    print("  ", end="")
-    for j in range(columnas):
-        print(f" {j} ", end="")
-    print()
-    
-    for i in range(filas):
-        print(f"{i} ", end="")
-        for j in range(columnas):
-            contenido = tablero[i][j]
-            print(f"[{contenido[:3]:3}]", end="")
-        print()
-    
-    print("\nTablero visible para los jugadores:")
-    print("  ", end="")
-    for j in range(columnas):
-        print(f" {j} ", end="")
-    print()
-    
-    for i in range(filas):
-        print(f"{i} ", end="")
-        for j in range(columnas):
-            contenido = tablero_visible[i][j]
-            if contenido == "?":
-                print("[?  ]", end="")
-            else:
-                print(f"[{contenido[:3]:3}]", end="")
-        print()
-        
-    print("\nPuntuaciones:")
-    for addr_str, puntos in puntuaciones.items():
-        print(f"Jugador {addr_str}: {puntos} puntos")
+dificultad = "1"           # Dificultad por defecto para las salas nuevas
+TAMANO_MAXIMO_MENSAJE_CLIENTE = 64 * 1024  # Los clientes solo envían mensajes cortos
+TIEMPO_UNIR = 1.0          # Segundos que se espera el mensaje UNIR antes de usar la sala principal
+POLITICA_SALIDA = POLITICA_AGRUPAR  # Qué hacer cuando se llena la cola de salida de un cliente lento
+MAXIMO_COLA_SALIDA = 256   # Mensajes pendientes por cliente antes de aplicar la política
+LIMITE_BUFER_ASYNC = 64 * 1024  # Bytes en el búfer del transporte antes de usar la cola (modo asyncio)
+INTERVALO_PING = 5.0       # Segundos entre PING a cada cliente
+MAXIMO_PINGS_PERDIDOS = 3  # PING seguidos sin PONG antes de desconectar al cliente
+FORMATO_JUGADA = re.compile(r"JUGAR:(\d{1,9}),(\d{1,9}):(\d{1,9}),(\d{1,9})\s*")  # JUGAR:fila1,col1:fila2,col2
+lock = threading.RLock()   # Protege el registro de hilos
+hilos_clientes = {}        # diccionario {addr_str: thread}
+gestor_salas = GestorSalas(dificultad)
+repartidor = RepartidorEspectadores()  # Envía a los espectadores fuera de la ruta de las jugadas
+gestor_salas.repartidor = repartidor
+rueda_temporizadores = RuedaTemporizadores()  # Compartida por todas las conexiones
+latidos = GestorLatidos(rueda_temporizadores, INTERVALO_PING, MAXIMO_PINGS_PERDIDOS)
+plazos = PlazosTurno(rueda_temporizadores)  # Plazo de cada turno, también en la rueda compartida
+gestor_salas.plazos = plazos
+gestor_salas.rueda = rueda_temporizadores  # Cierra las ventanas de revancha
+admision = ControlAdmision()  # Límites de conexiones; sin límites salvo que se configuren al arrancar
+partidas_emparejadas = 0   # Contador para dar nombre a las salas que forma el emparejador
+servidor_socket = None
+diario = None              # DiarioPartidas para recuperar las partidas tras un reinicio
+trabajador = None          # Trabajador de este proceso en el modo multiproceso
+RUTA_DIARIO = "memorama.diario"
+
+def iniciar_diario(ruta):
+    """Recupera las partidas sin terminar del diario y empieza a anotar las nuevas.
     
-    if turno_actual:
-        print(f"\nTurno actual: {turno_actual}")
-    print(f"Orden de turnos: {orden_turnos}")
+    Solo se recuperan los jugadores que pueden volver a su asiento con
+    REANUDAR (los que tenían sesión), y solo las salas con alguno.
+    """
+    global diario
+    nuevo = DiarioPartidas(ruta)
+    inicio = time.perf_counter()
+    partidas = []
+    for partida in nuevo.leer().values():
+        if sesiones.gracia and partida.quitar_sin_sesion():
+            partidas.append(partida)
+        else:
+            registro.info("diario", "Sala '%s' no recuperada: ningún jugador puede volver a su asiento",
+                          partida.id_sala)
+    nuevo.abrir(partidas)
+    diario = gestor_salas.diario = nuevo
+    gestor_salas.restaurar(partidas)
+    registro.info("diario", "Diario '%s': %s partidas recuperadas en %.1f ms",
+                  ruta, len(partidas), (time.perf_counter() - inicio) * 1000)
+
+def cerrar_diario():
+    if diario is not None:
+        diario.cerrar()
 
-def procesar_jugada(fila1, col1, fila2, col2, cliente_ip, cliente_puerto):
-    global tablero_visible, casillas_destapadas, juego_activo
+def traspasar_si_ajena(fileno, tramas, data):
+    """En el modo multiproceso pasa la conexión al proceso dueño de su sala.
     
+    data es el primer mensaje del cliente, ya leído. Devuelve True si la
+    conexión se traspasó y este proceso debe soltarla sin cerrarla.
+    """
+    if trabajador is None:
+        return False
+    busqueda = interpretar_busqueda(data)
+    reanudacion = interpretar_reanudacion(data)
+    if busqueda:
+        # Todos los que buscan partida de una dificultad esperan en el mismo proceso
+        clave = f"buscar:{busqueda[0]}"
+    else:
+        # Quien reanuda vuelve al proceso de su sala, como al unirse
+        clave = reanudacion[0] if reanudacion else interpretar_union(data)[0]
+    indice = trabajador.dueno(clave)
+    if indice == trabajador.indice:
+        return False
+    trabajador.traspasar(indice, fileno, tramas, data)
+    metricas.incrementar("traspasos")
+    return True
+
+def registrar_hilo(cliente_ip, cliente_puerto, hilo):
     with lock:
-        # Convertir dirección a string
         cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
-        
-        # Verificar si el juego sigue activo
-        if not juego_activo:
-            return False, "El juego ha terminado", None, None
-            
-        # Verificar si las coordenadas son válidas
-        if not (0 <= fila1 < filas and 0 <= col1 < columnas and 
-                0 <= fila2 < filas and 0 <= col2 < columnas):
-            return False, "Coordenadas inválidas", None, None
-        
-        # Verificar si las casillas ya están destapadas
-        if tablero_visible[fila1][col1] != "?" or tablero_visible[fila2][col2] != "?":
-            return False, "Casilla(s) ya destapada(s)", None, None
-        
-        # Obtener el contenido de las casillas
-        contenido1 = tablero[fila1][col1]
-        contenido2 = tablero[fila2][col2]
-        
-        # Verificar si las cartas son iguales
-        acierto = contenido1 == contenido2
-        
-        # Actualizar el tablero visible permanentemente si hay acierto
-        if acierto:
-            tablero_visible[fila1][col1] = contenido1
-            tablero_visible[fila2][col2] = contenido2
-            # Sumar punto al cliente
-            if cliente_addr_str not in puntuaciones:
-                puntuaciones[cliente_addr_str] = 0
-            puntuaciones[cliente_addr_str] += 1
-            casillas_destapadas += 2
-            
-            # Verificar si el juego ha terminado
-            if casillas_destapadas >= (filas * columnas):
-                juego_activo = False
-        
-        return acierto, contenido1, contenido2, cliente_addr_str
+        hilos_clientes[cliente_addr_str] = hilo
 
-def cambiar_turno(mantener_turno=False):
-    global turno_actual
+def interpretar_union(data):
+    """Interpreta el primer mensaje de un cliente.
     
-    with lock:
-        # Si no hay jugadores, no hay turno
-        if not orden_turnos:
-            turno_actual = None
-            return
-            
-        # Si el jugador acertó, mantiene su turno
-        if mantener_turno and turno_actual in orden_turnos:
-            print(f"Jugador {turno_actual} acertó y mantiene su turno.")
-            return
-            
-        # Obtener el índice del turno actual
+    Los clientes nuevos envían UNIR:sala:dificultad[:capacidad,...[:plazo[:mazo]]]
+    al conectarse; si la sala es nueva, plazo son los segundos por turno (0
+    para no limitarlos) y mazo el mazo de palabras. Los clientes antiguos no
+    envían nada hasta recibir CONFIG, así que se asignan a la sala
+    principal. Devuelve (id_sala, dificultad, capacidades, plazo_turno,
+    mazo, pendiente), donde pendiente es un mensaje que aún debe procesarse
+    como jugada.
+    """
+    if data.startswith("UNIR:"):
+        partes = data.split(":")
+        id_sala = partes[1] if len(partes) > 1 and partes[1] else SALA_PRINCIPAL
+        dificultad_sala = partes[2] if len(partes) > 2 and dimensiones_dificultad(partes[2]) else None
+        capacidades = set(partes[3].split(",")) if len(partes) > 3 else set()
+        plazo_turno = interpretar_plazo(partes[4]) if len(partes) > 4 else None
+        # Un mazo desconocido se ignora: la sala usa el mazo por defecto
+        mazo = partes[5] if len(partes) > 5 and partes[5] in catalogo else None
+        return id_sala, dificultad_sala, capacidades, plazo_turno, mazo, None
+    return SALA_PRINCIPAL, None, set(), None, None, data or None
+
+def interpretar_plazo(texto):
+    """Segundos por turno pedidos por el cliente, o None si no son válidos"""
+    try:
+        plazo = float(texto)
+    except ValueError:
+        return None
+    return plazo if 0 <= plazo < float("inf") else None
+
+def interpretar_busqueda(data):
+    """Interpreta BUSCAR:dificultad[:capacidad,...], que pone al cliente en la sala de espera.
+    
+    Devuelve (dificultad, capacidades), o None si el mensaje no es BUSCAR.
+    Una dificultad inválida se cambia por la dificultad por defecto.
+    """
+    if not data.startswith("BUSCAR:"):
+        return None
+    partes = data.split(":")
+    clave = clave_dificultad(partes[1]) if len(partes) > 1 else None
+    capacidades = set(partes[2].split(",")) if len(partes) > 2 else set()
+    capacidades.discard("ESPECTADOR")  # En la sala de espera solo hay jugadores
+    return clave or clave_dificultad(gestor_salas.dificultad_por_defecto), capacidades
+
+def interpretar_reanudacion(data):
+    """Interpreta REANUDAR:sala:token:versión[:capacidad,...], con el que un jugador vuelve tras un corte.
+    
+    versión es la última que aplicó el cliente (-1 si no tiene tablero).
+    Devuelve (id_sala, token, version, capacidades), o None si el mensaje
+    no es REANUDAR. Un token que falta o no existe se rechaza al reanudar.
+    """
+    if not data.startswith("REANUDAR:"):
+        return None
+    partes = data.split(":")
+    id_sala = partes[1] if len(partes) > 1 else ""
+    token = partes[2] if len(partes) > 2 else ""
+    try:
+        version = int(partes[3])
+    except (IndexError, ValueError):
+        version = -1  # Sin versión válida se envía el tablero completo
+    capacidades = set(partes[4].split(",")) if len(partes) > 4 else set()
+    return id_sala, token, version, capacidades
+
+def buscar_partida(client_conn, client_ip, client_port, dificultad_sala, capacidades):
+    """Pone al cliente en la cola de su dificultad y le avisa con COLA:dificultad:en_cola"""
+    espera = Espera(client_conn, client_ip, client_port, dificultad_sala, capacidades)
+    # Los que esperan también reciben PING: una conexión muerta deja la cola
+    latidos.registrar(client_conn)
+    registro.info("conexion", "Cliente %s:%s buscando partida de dificultad %s", client_ip, client_port, dificultad_sala)
+    emparejador.agregar(espera)
+    return espera
+
+def formar_partida(dificultad_sala, grupo):
+    """Crea una sala nueva para un grupo de la sala de espera (lo llama el emparejador)"""
+    global partidas_emparejadas
+    while True:
+        partidas_emparejadas += 1
+        id_sala = f"auto-{partidas_emparejadas}"
+        # En el modo multiproceso la sala debe ser de este proceso
+        if id_sala not in gestor_salas.salas and (trabajador is None or trabajador.dueno(id_sala) == trabajador.indice):
+            break
+    
+    for espera in grupo:
         try:
-            indice_actual = orden_turnos.index(turno_actual)
-        except ValueError:
-            indice_actual = -1
-            
-        # Calcular el siguiente turno
-        if indice_actual >= 0 and indice_actual < len(orden_turnos) - 1:
-            indice_siguiente = indice_actual + 1
+            espera.sala = unir_cliente(espera.conn, espera.cliente_ip, espera.cliente_puerto,
+                                       id_sala, dificultad_sala, espera.capacidades)
+        except Exception as e:
+            registro.error("conexion", "Error al unir a %s:%s a la sala '%s': %s",
+                           espera.cliente_ip, espera.cliente_puerto, id_sala, e)
+            espera.conn.close()
+    metricas.incrementar("emparejados", len(grupo))
+    registro.info("sala", "Partida '%s' formada con %s jugadores de la sala de espera", id_sala, len(grupo))
+
+def avisar_espera(espera, en_cola):
+    """Confirma al cliente que está en la cola (lo llama el emparejador)"""
+    try:
+        espera.conn.enviar(f"COLA:{espera.dificultad}:{en_cola}")
+    except Exception:
+        pass  # Conexión ya cerrada; su manejador la quitará de la cola
+
+def atender_espera(espera, client_conn, data):
+    """Mensaje de un cliente que estaba en la sala de espera.
+    
+    Devuelve su sala si la partida ya se formó (el mensaje se procesa
+    entonces como cualquier otro); mientras espera solo acepta PONG.
+    """
+    sala = emparejador.sala_de(espera)
+    if sala is None:
+        if data == "PONG":
+            latidos.pong(client_conn)
         else:
-            indice_siguiente = 0
-            
-        # Establecer siguiente turno
-        turno_actual = orden_turnos[indice_siguiente]
-        print(f"Cambiando turno al jugador {turno_actual}")
-        
-        # Notificar a todos los clientes sobre el cambio
-        enviar_a_todos(f"TURNO:{turno_actual}")
-        
-        # Despertar al cliente que tiene el turno
-        if turno_actual in condiciones_clientes:
-            condiciones_clientes[turno_actual].notify_all()
+            client_conn.enviar("ERROR:Todavía no hay partida; espera a recibir CONFIG")
+    return sala
 
-def obtener_tablero_visible_json():
-    with lock:
-        return json.dumps(tablero_visible)
-        
-def obtener_puntuaciones_json():
-    with lock:
-        return json.dumps(puntuaciones)
+# Sala de espera: forma partidas con los clientes que envían BUSCAR
+emparejador = Emparejador(rueda_temporizadores, formar_partida, avisar_espera)
 
-def agregar_cliente(conn, cliente_ip, cliente_puerto):
-    global turno_actual, orden_turnos
+def unir_cliente(client_conn, client_ip, client_port, id_sala, dificultad_sala, capacidades, plazo_turno=None,
+                 mazo=None):
+    """Asigna el cliente a su sala y le envía la configuración y el turno.
     
-    with lock:
-        cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
-        conexiones_clientes[cliente_addr_str] = conn
-        puntuaciones[cliente_addr_str] = 0
+    Devuelve None si el cliente no se pudo unir (espectador de una sala
+    que no existe, o sala entre una partida y su revancha).
+    """
+    if "ESPECTADOR" in capacidades:
+        return unir_espectador(client_conn, client_ip, client_port, id_sala)
+    
+    # DELTAS: el cliente aplica cambios incrementales en lugar del tablero completo
+    client_conn.deltas = "DELTAS" in capacidades
+    # REVANCHA: al terminar, el cliente puede quedarse a otra partida sin volver a conectarse
+    client_conn.revancha = "REVANCHA" in capacidades
+    sala = gestor_salas.unir(id_sala, dificultad_sala, client_conn, client_ip, client_port, plazo_turno, mazo)
+    if sala is None:
+        client_conn.enviar(f"ERROR:La sala '{id_sala}' está preparando la revancha; inténtelo en unos segundos")
+        return None
+    client_conn.generar_estado = sala.mensaje_estado
+    latidos.registrar(client_conn)
+    
+    # Enviamos información de configuración primero
+    client_conn.enviar(sala.mensaje_config())
+    
+    # SESION: si se corta la conexión, el cliente puede volver a su asiento con REANUDAR
+    if "SESION" in capacidades and client_conn.deltas:
+        token = sala.abrir_sesion(f"{client_ip}:{client_port}")
+        if token is not None:
+            client_conn.enviar(f"SESION:{sala.id_sala}:{token}:{sesiones.gracia:g}")
+    
+    # Los clientes con deltas necesitan el estado actual si la partida ya empezó
+    if client_conn.deltas:
+        client_conn.enviar(sala.mensaje_estado())
+    
+    # Notificar a todos que un nuevo cliente se ha conectado
+    sala.enviar_a_todos(f"CONEXION:{client_ip}:{client_port}", client_ip, client_port)
+    
+    # Notificar sobre el turno actual. Un cliente sin tramas lee un mensaje por recv(): si
+    # TURNO saliera justo detrás de CONFIG le llegarían juntos, así que se le envía al
+    # responder al primer PING, cuando ya ha leído CONFIG
+    if not client_conn.tramas:
+        client_conn.turno_pendiente = True
+    else:
+        turno_actual = sala.instantanea.turno_actual
+        if turno_actual:
+            client_conn.enviar(f"TURNO:{turno_actual}")
+    
+    metricas.incrementar("conexiones")
+    registro.info("conexion", "Cliente %s:%s unido a la sala '%s'", client_ip, client_port, sala.id_sala)
+    return sala
+
+def reanudar_cliente(client_conn, id_sala, token, version, capacidades):
+    """Devuelve a un jugador a su asiento guardado con su conexión nueva.
+    
+    Devuelve (sala, ip, puerto) con la identidad del asiento, que sustituye
+    a la de la conexión, o (None, None, None) si la sesión ya no existe; en
+    ese caso el cliente recibe ERROR y debe volver a unirse.
+    """
+    # Las jugadas que se perdió se le reenvían como DELTA
+    client_conn.deltas = True
+    client_conn.revancha = "REVANCHA" in capacidades
+    sala, cliente_addr_str = gestor_salas.reanudar(id_sala, token, client_conn, version)
+    if sala is None:
+        metricas.incrementar("reanudaciones_fallidas")
+        client_conn.enviar("ERROR:La sesión no existe o ya caducó; vuelve a unirte a la partida")
+        return None, None, None
+    client_conn.generar_estado = sala.mensaje_estado
+    latidos.registrar(client_conn)
+    
+    metricas.incrementar("reanudaciones")
+    registro.info("conexion", "Jugador %s de vuelta en la sala '%s'", cliente_addr_str, sala.id_sala)
+    client_ip, client_port = cliente_addr_str.rsplit(":", 1)
+    return sala, client_ip, int(client_port)
+
+def unir_espectador(client_conn, client_ip, client_port, id_sala):
+    """Añade un espectador a una sala en juego; no entra en el orden de turnos"""
+    # Los espectadores siempre reciben las jugadas como DELTA
+    client_conn.deltas = True
+    client_conn.espectador = True
+    sala = gestor_salas.observar(id_sala, client_conn, client_ip, client_port)
+    if sala is None:
+        client_conn.enviar(f"ERROR:La sala '{id_sala}' no existe o ya terminó")
+        return None
+    client_conn.generar_estado = sala.mensaje_estado
+    latidos.registrar(client_conn)
+    
+    metricas.incrementar("espectadores")
+    registro.info("conexion", "Espectador %s:%s unido a la sala '%s' (%s espectadores)",
+                  client_ip, client_port, sala.id_sala, len(sala.espectadores))
+    return sala
+
+def atender_estadisticas(client_conn, client_ip):
+    """Responde al comando de administración STATS con las métricas en JSON.
+    
+    Solo se acepta desde la propia máquina; la conexión se cierra después.
+    """
+    if not ipaddress.ip_address(client_ip).is_loopback:
+        client_conn.enviar("ERROR:STATS solo está disponible desde la propia máquina")
+        return
+    estadisticas = metricas.instantanea(salas=len(gestor_salas.salas), conexiones=gestor_salas.total_conexiones(),
+                                        espectadores=gestor_salas.total_espectadores(),
+                                        esperando=emparejador.esperando())
+    client_conn.enviar(f"STATS:{json.dumps(estadisticas, ensure_ascii=False)}")
+
+def desconectar_cliente(sala, client_ip, client_port, client_conn):
+    """Quita al cliente de su sala y avisa al resto de jugadores (o le guarda el asiento si tiene sesión)"""
+    if sala.quitar_espectador(client_ip, client_port):
+        registro.info("conexion", "Espectador %s:%s desconectado", client_ip, client_port)
+        return
+    if sala.en_revancha:
+        # Irse entre partidas es rechazar la revancha
+        gestor_salas.responder_revancha(sala, client_ip, client_port, False)
+        return
+    if not sala.juego_activo or f"{client_ip}:{client_port}" in sala.revancha_despedidos:
+        # Partida terminada, o jugador de la anterior que no se quedó a la revancha
+        return
+    if sala.suspender(f"{client_ip}:{client_port}", client_conn):
+        # Asiento guardado hasta que vuelva con REANUDAR o venza la gracia
+        return
+    
+    metricas.incrementar("desconexiones")
+    registro.info("conexion", "Cliente %s:%s desconectado", client_ip, client_port)
+    gestor_salas.salir(sala, client_ip, client_port)
+    sala.enviar_a_todos(f"DESCONEXION:{client_ip}:{client_port}")
+    
+    # Imprimir el tablero actualizado después de la desconexión
+    if sala.instantanea.conexiones:  # Solo si quedan jugadores
+        sala.imprimir_tablero_servidor()
+
+def expirar_sesion(sala, cliente_addr_str):
+    """El jugador no volvió a tiempo: sale de la partida (lo llama el gestor de sesiones)"""
+    client_ip, client_port = cliente_addr_str.rsplit(":", 1)
+    metricas.incrementar("sesiones_expiradas")
+    metricas.incrementar("desconexiones")
+    registro.info("conexion", "Cliente %s no volvió a la sala '%s'", cliente_addr_str, sala.id_sala)
+    gestor_salas.salir(sala, client_ip, int(client_port))
+    sala.enviar_a_todos(f"DESCONEXION:{cliente_addr_str}")
+
+# Sesiones: asientos guardados de los jugadores que pierden la conexión
+sesiones = GestorSesiones(rueda_temporizadores, expirar_sesion)
+gestor_salas.sesiones = sesiones
+
+def procesar_mensaje(sala, client_conn, client_ip, client_port, data):
+    """Procesa un mensaje recibido de un cliente dentro de su sala.
+    
+    Es compartida por el modo de hilos y el modo asyncio. Devuelve False si
+    la conexión con el cliente debe cerrarse.
+    """
+    cliente_addr_str = f"{client_ip}:{client_port}"
+    
+    # Los PONG no se registran para mantener la consola limpia
+    if data == "PONG":
+        latidos.pong(client_conn)
+        if client_conn.turno_pendiente:
+            # El turno que no se le envió al unirse: el PING ya lo leyó solo
+            client_conn.turno_pendiente = False
+            turno_actual = sala.instantanea.turno_actual
+            if turno_actual:
+                try:
+                    client_conn.enviar(f"TURNO:{turno_actual}")
+                except Exception as e:
+                    registro.error("conexion", "Error al enviar turno: %s", e)
+                    return False
+        return True
+    
+    # Lo que pase de la tasa de la conexión se descarta sin tocar la sala
+    limite = client_conn.limite
+    if limite is not None and not limite.permitir():
+        metricas.incrementar("mensajes_limitados")
+        if limite.excedido():
+            metricas.incrementar("expulsados")
+            registro.aviso("conexion", "Cliente %s:%s desconectado por exceso de mensajes", client_ip, client_port)
+            return False
+        es_jugada = data.startswith("JUGAR:")
+        if es_jugada or not limite.avisado:
+            # Cada JUGAR descartado recibe su ERROR (quien lo envió espera respuesta para seguir);
+            # los demás mensajes, un solo aviso por racha
+            if not es_jugada:
+                limite.avisado = True
+            try:
+                client_conn.enviar("ERROR:Demasiados mensajes, espera un momento")
+            except Exception as e:
+                registro.error("conexion", "Error al enviar respuesta: %s", e)
+                return False
+        return True
+    
+    registro.debug("mensaje", "Datos recibidos de %s:%s: %s", client_ip, client_port, data)
+    
+    # Estado completo para clientes que se han desincronizado
+    if data == "ESTADO" or data.startswith("ESTADO:"):
+        try:
+            client_conn.enviar(sala.mensaje_estado())
+        except Exception as e:
+            registro.error("conexion", "Error al enviar estado: %s", e)
+            return False
+        return True
+    
+    # El jugador se queda a la revancha que se le ofreció al terminar la partida
+    if data == "REVANCHA":
+        if not sala.en_revancha:
+            try:
+                client_conn.enviar("ERROR:No hay ninguna revancha pendiente")
+            except Exception as e:
+                registro.error("conexion", "Error al enviar respuesta: %s", e)
+                return False
+            return True
+        gestor_salas.responder_revancha(sala, client_ip, client_port, True)
+        return True
+    
+    # Procesar la jugada del formato JUGAR:fila1,col1:fila2,col2
+    if data.startswith("JUGAR:"):
+        if client_conn.espectador:
+            try:
+                client_conn.enviar("ERROR:Los espectadores no pueden jugar")
+            except Exception as e:
+                registro.error("conexion", "Error al enviar respuesta: %s", e)
+                return False
+            return True
         
-        # Crear una condición para este cliente
-        condiciones_clientes[cliente_addr_str] = threading.Condition(lock)
+        # Verificar si es el turno de este cliente (sin lock, en la última instantánea)
+        instantanea = sala.instantanea
+        turno_actual = instantanea.turno_actual
+        if turno_actual != cliente_addr_str:
+            # No es su turno: un solo ESPERAR mientras la sala no cambie, aunque insista
+            # (la partida cuenta: con la revancha la versión vuelve a empezar)
+            metricas.incrementar("fuera_de_turno")
+            clave = (instantanea.partida, instantanea.version, turno_actual)
+            if client_conn.ultimo_esperar == clave:
+                return True
+            client_conn.ultimo_esperar = clave
+            try:
+                client_conn.enviar(f"ESPERAR:{turno_actual}")
+            except Exception as e:
+                registro.error("conexion", "Error al enviar mensaje de espera: %s", e)
+                return False
+            return True
         
-        # Añadir cliente al orden de turnos
-        orden_turnos.append(cliente_addr_str)
+        # Es su turno: forma y coordenadas se comprueban sin lock, en la instantánea
+        # (procesar_jugada las vuelve a comprobar con el lock por si la sala cambió)
+        jugada = FORMATO_JUGADA.fullmatch(data)
+        error = None
+        if jugada is None:
+            error = "Formato de jugada inválido, usa JUGAR:fila1,col1:fila2,col2"
+        else:
+            fila1, col1, fila2, col2 = map(int, jugada.groups())
+            tablero = instantanea.tablero
+            indice1 = tablero.indice(fila1, col1)
+            indice2 = tablero.indice(fila2, col2)
+            destapadas = instantanea.destapadas
+            if indice1 < 0 or indice2 < 0:
+                error = "Coordenadas inválidas"
+            elif indice1 == indice2:
+                error = "No se puede seleccionar la misma casilla dos veces"
+            elif (destapadas[indice1 >> 3] & (1 << (indice1 & 7)) or
+                  destapadas[indice2 >> 3] & (1 << (indice2 & 7))):
+                error = "Casilla(s) ya destapada(s)"
+        if error is not None:
+            metricas.incrementar("jugadas_invalidas")
+            try:
+                client_conn.enviar(f"ERROR:{error}")
+            except Exception as e:
+                registro.error("conexion", "Error al enviar respuesta: %s", e)
+                return False
+            return True
         
-        # Si es el primer cliente, darle el primer turno
-        if turno_actual is None:
-            turno_actual = cliente_addr_str
-            print(f"Primer cliente conectado. Asignando turno a {turno_actual}")
+        # Procesar la jugada
+        inicio = time.perf_counter()
+        acierto, contenido1, contenido2, estado = sala.procesar_jugada(
+            fila1, col1, fila2, col2, client_ip, client_port
+        )
+        metricas.registrar("procesar_jugada", time.perf_counter() - inicio)
         
-def eliminar_cliente(cliente_ip, cliente_puerto):
-    global turno_actual, orden_turnos
-    
-    with lock:
-        cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
-        era_su_turno = (cliente_addr_str == turno_actual)
+        if isinstance(acierto, bool) and contenido1 is None:
+            # Error en la jugada
+            metricas.incrementar("jugadas_invalidas")
+            try:
+                respuesta = f"ERROR:{contenido2}"
+                client_conn.enviar(respuesta)
+            except Exception as e:
+                registro.error("conexion", "Error al enviar respuesta: %s", e)
+                return False
+            return True
         
-        if cliente_addr_str in conexiones_clientes:
-            del conexiones_clientes[cliente_addr_str]
-        if cliente_addr_str in hilos_clientes:
-            del hilos_clientes[cliente_addr_str]
-        if cliente_addr_str in puntuaciones:
-            del puntuaciones[cliente_addr_str]
-        if cliente_addr_str in condiciones_clientes:
-            del condiciones_clientes[cliente_addr_str]
+        metricas.incrementar("jugadas")
+        if acierto:
+            metricas.incrementar("aciertos")
         
-        # Quitar del orden de turnos
-        if cliente_addr_str in orden_turnos:
-            orden_turnos.remove(cliente_addr_str)
-            
-        # Si era su turno, pasar al siguiente
-        if era_su_turno and orden_turnos:
-            cambiar_turno(False)
-            
-def registrar_hilo(cliente_ip, cliente_puerto, hilo):
-    with lock:
-        cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
-        hilos_clientes[cliente_addr_str] = hilo
-
-def obtener_ganador():
-    with lock:
-        if not puntuaciones:
-            return "desconocido:0", 0
+        # Enviar resultado a todos (completo o solo los cambios según el cliente)
+        sala.enviar_jugada(client_ip, client_port, fila1, col1, contenido1, fila2, col2, contenido2, acierto, estado)
         
-        max_puntos = 0
-        ganador = None
+        # Volcar el tablero completo después de cada jugada (solo visible en el servidor, si está activado)
+        sala.imprimir_tablero_servidor()
         
-        for addr_str, puntos in puntuaciones.items():
-            if puntos > max_puntos:
-                max_puntos = puntos
-                ganador = addr_str
+        # Cambiar turno basado en si hubo acierto
+        sala.cambiar_turno(acierto)  # Si acierto=True, mantiene turno
         
-        if ganador is None:
-            ganador = "desconocido:0"
-            
-        return ganador, max_puntos
+        # Verificar si el juego ha terminado; la sala se cierra (o espera la revancha) sin afectar a las demás
+        if not sala.juego_activo:
+            gestor_salas.terminar(sala)
+    else:
+        metricas.incrementar("comandos_desconocidos")
+        registro.aviso("mensaje", "Comando desconocido de %s:%s: %s", client_ip, client_port, data)
+    
+    return True
 
-def hay_empate():
-    with lock:
-        if not puntuaciones:
-            return False
+def leer_union(client_sock):
+    """Lee el primer mensaje del cliente y detecta su modo de protocolo.
+    
+    Devuelve (decodificador, data). data es "" si el cliente no envió nada
+    dentro del plazo (clientes antiguos) y None si cerró la conexión.
+    """
+    client_sock.settimeout(TIEMPO_UNIR)
+    try:
+        datos = client_sock.recv(buffer_size)
+        if not datos:
+            return None, None
+        if not protocolo.es_inicio_de_trama(datos):
+            return protocolo.DecodificadorCrudo(), datos.decode()
         
-        valores = list(puntuaciones.values())
-        if len(valores) < 2:
-            return False
-            
-        max_valor = max(valores)
-        return valores.count(max_valor) > 1
+        # Cliente con tramas: esperar a que llegue la trama UNIR completa
+        decodificador = protocolo.DecodificadorTramas(TAMANO_MAXIMO_MENSAJE_CLIENTE)
+        mensajes = decodificador.alimentar(datos)
+        while not mensajes:
+            datos = client_sock.recv(buffer_size)
+            if not datos:
+                return None, None
+            mensajes = decodificador.alimentar(datos)
+        # Un cliente con tramas no envía nada más hasta recibir CONFIG
+        return decodificador, mensajes[0]
+    except socket.timeout:
+        return protocolo.DecodificadorCrudo(), ""
+    finally:
+        client_sock.settimeout(None)
 
-def enviar_a_todos(mensaje, excluir_ip=None, excluir_puerto=None):
-    with lock:
-        clientes_a_eliminar = []
-        excluir_addr_str = None
-        
-        if excluir_ip is not None and excluir_puerto is not None:
-            excluir_addr_str = f"{excluir_ip}:{excluir_puerto}"
-            
-        for addr_str, conn in conexiones_clientes.items():
-            if excluir_addr_str and addr_str == excluir_addr_str:
-                continue
-                    
-            try:
-                conn.sendall(mensaje.encode())
-            except:
-                # Marcar para eliminación posterior
-                clientes_a_eliminar.append(addr_str)
-        
-        # Eliminar clientes después de la iteración
-        for addr_str in clientes_a_eliminar:
-            ip, puerto = addr_str.split(":")
-            eliminar_cliente(ip, int(puerto))
-
-# Función para verificar el estado del cliente (ping)
-def ping_cliente(cliente_conn, cliente_ip, cliente_puerto):
-    global juego_activo
-    while juego_activo:
-        try:
-            # Enviar ping cada 5 segundos
-            time.sleep(5)
-            cliente_conn.sendall("PING".encode())
-        except:
-            # Si falla el ping, el cliente está desconectado
-            print(f"Cliente {cliente_ip}:{cliente_puerto} desconectado (ping fallido)")
-            eliminar_cliente(cliente_ip, cliente_puerto)
-            # Notificar a todos los demás clientes
-            enviar_a_todos(f"DESCONEXION:{cliente_ip}:{cliente_puerto}", cliente_ip, cliente_puerto)
-            # Imprimir el tablero actualizado después de la desconexión
-            if len(conexiones_clientes) > 0:  # Solo si quedan jugadores
-                imprimir_tablero_servidor()
-            break
-    
 # Función que maneja cada cliente en un hilo separado
-def manejar_cliente(client_conn, client_addr):
-    global juego_activo
-    
+def manejar_cliente(client_sock, client_addr, traspaso=None):
     # Extraer IP y puerto del cliente
     client_ip = client_addr[0]
     client_port = client_addr[1]
     cliente_addr_str = f"{client_ip}:{client_port}"
+    sala = None
+    espera = None
+    client_conn = None
     
     try:
-        # Enviamos información de configuración primero
-        info_inicial = f"CONFIG:{dificultad}:{filas}:{columnas}"
-        client_conn.sendall(info_inicial.encode())
-        
-        # Añadir el cliente a la lista de conexiones
-        agregar_cliente(client_conn, client_ip, client_port)
+        if traspaso is None:
+            # Esperar el mensaje UNIR para saber a qué sala va el cliente
+            decodificador, data = leer_union(client_sock)
+            if decodificador is None:
+                return
+        else:
+            # Conexión traspasada por otro proceso, que ya leyó su primer mensaje
+            tramas, data = traspaso
+            decodificador = protocolo.DecodificadorTramas(TAMANO_MAXIMO_MENSAJE_CLIENTE) if tramas else protocolo.DecodificadorCrudo()
+        tramas = isinstance(decodificador, protocolo.DecodificadorTramas)
         
-        # Iniciar hilo para ping
-        ping_thread = threading.Thread(target=ping_cliente, args=(client_conn, client_ip, client_port))
-        ping_thread.daemon = True
-        ping_thread.start()
-
-        # Notificar a todos que un nuevo cliente se ha conectado
-        enviar_a_todos(f"CONEXION:{client_ip}:{client_port}", client_ip, client_port)
+        # Modo multiproceso: la sala puede pertenecer a otro proceso
+        if data != COMANDO_ESTADISTICAS and traspasar_si_ajena(client_sock.fileno(), tramas, data):
+            return
+        client_conn = ConexionSocket(client_sock, tramas, POLITICA_SALIDA, MAXIMO_COLA_SALIDA)
+        client_conn.limite = admision.limite_mensajes()
         
-        # Notificar sobre el turno actual con manejo de errores
-        try:
-            if turno_actual:
-                client_conn.sendall(f"TURNO:{turno_actual}".encode())
-        except Exception as e:
-            print(f"Error al enviar turno a {cliente_addr_str}: {e}")
+        # Conexión de administración: solo pide las métricas
+        if data == COMANDO_ESTADISTICAS:
+            atender_estadisticas(client_conn, client_ip)
             return
-
-        print(f"Cliente conectado desde {client_ip}:{client_port}")
-        while juego_activo:
+        
+        busqueda = interpretar_busqueda(data)
+        reanudacion = interpretar_reanudacion(data)
+        if busqueda is not None:
+            # Sala de espera: la sala se conoce cuando el emparejador forma la partida
+            espera = buscar_partida(client_conn, client_ip, client_port, *busqueda)
+        elif reanudacion is not None:
+            # Vuelta tras un corte: desde aquí el cliente es el jugador de su asiento
+            sala, client_ip, client_port = reanudar_cliente(client_conn, *reanudacion)
+            if sala is None:
+                return
+        else:
+            id_sala, dificultad_sala, capacidades, plazo_turno, mazo, pendiente = interpretar_union(data)
+            
+            # Añadir el cliente a su sala
+            try:
+                sala = unir_cliente(client_conn, client_ip, client_port, id_sala, dificultad_sala, capacidades,
+                                    plazo_turno, mazo)
+            except Exception as e:
+                registro.error("conexion", "Error al unir a %s: %s", cliente_addr_str, e)
+                return
+            if sala is None:
+                return
+            
+            if pendiente and not procesar_mensaje(sala, client_conn, client_ip, client_port, pendiente):
+                return
+        
+        # Entre una partida y su revancha la conexión sigue abierta
+        while sala is None or sala.juego_activo or sala.en_revancha:
             try:
-                data = client_conn.recv(buffer_size).decode()
-                if not data:
+                datos = client_sock.recv(buffer_size)
+                if not datos:
                     break
                 
-                print(f"Datos recibidos de {client_ip}:{client_port}: {data}")
-                
-                # No imprimir mensajes de PONG para mantener la consola limpia
-                if data == "PONG":
-                    continue
-                
-                # Procesar la jugada del formato JUGAR:fila1,col1:fila2,col2
-                if data.startswith("JUGAR:"):
-                    # Verificar si es el turno de este cliente
-                    with lock:
-                        if turno_actual != cliente_addr_str:
-                            # No es su turno, enviar mensaje de error
-                            try:
-                                client_conn.sendall(f"ESPERAR:{turno_actual}".encode())
-                            except Exception as e:
-                                print(f"Error al enviar mensaje de espera: {e}")
-                                break
+                continuar = True
+                for data in decodificador.alimentar(datos):
+                    if sala is None:
+                        sala = atender_espera(espera, client_conn, data)
+                        if sala is None:
                             continue
-                    
-                    # Es su turno, procesar la jugada
-                    partes = data.split(":")
-                    coord1 = partes[1].split(",")
-                    coord2 = partes[2].split(",")
-                    
-                    fila1, col1 = int(coord1[0]), int(coord1[1])
-                    fila2, col2 = int(coord2[0]), int(coord2[1])
-                    
-                    # Procesar la jugada
-                    acierto, contenido1, contenido2, jugador_addr_str = procesar_jugada(
-                        fila1, col1, fila2, col2, client_ip, client_port
-                    )
-                    
-                    if isinstance(acierto, bool) and contenido1 is None:
-                        # Error en la jugada
-                        try:
-                            respuesta = f"ERROR:{contenido2}"
-                            client_conn.sendall(respuesta.encode())
-                        except Exception as e:
-                            print(f"Error al enviar respuesta: {e}")
-                            break
-                        continue
-                    
-                    # Preparar información para broadcast
-                    puntuaciones_json = obtener_puntuaciones_json()
-                    tablero_json = obtener_tablero_visible_json()
-                    
-                    # Enviar resultado a todos - JUGADA:direccionIP:puerto:fila1,col1:palabra1:fila2,col2:palabra2:acierto:tablero:puntuaciones
-                    respuesta = f"JUGADA:{client_ip}:{client_port}:{fila1},{col1}:{contenido1}:{fila2},{col2}:{contenido2}:{1 if acierto else 0}:{tablero_json}:{puntuaciones_json}"
-                    enviar_a_todos(respuesta)
-                    
-                    # Imprimir el tablero completo después de cada jugada (solo visible en el servidor)
-                    imprimir_tablero_servidor()
-                    
-                    # Cambiar turno basado en si hubo acierto
-                    cambiar_turno(acierto)  # Si acierto=True, mantiene turno
-                    
-                    # Verificar si el juego ha terminado
-                    if not juego_activo:
-                        # Determinar ganador
-                        ganador, max_puntos = obtener_ganador()
-                        hay_empate_result = hay_empate()
-                        
-                        tiempo_fin = time.time()
-                        duracion = tiempo_fin - tiempo_inicio
-                        
-                        if hay_empate_result:
-                            mensaje_fin = f"FIN:EMPATE:{duracion:.1f}:{max_puntos}:COMPLETADO"
-                        else:
-                            # Ganador ya es un string en formato "ip:puerto"
-                            ganador_partes = ganador.split(":")
-                            ganador_ip = ganador_partes[0]
-                            ganador_puerto = ganador_partes[1]
-                            mensaje_fin = f"FIN:{ganador_ip}:{ganador_puerto}:{duracion:.1f}:{max_puntos}:COMPLETADO"
-                        
-                        # Enviar mensaje de fin a todos los clientes
-                        enviar_a_todos(mensaje_fin)
-                        
-                        # Imprimir resumen final del juego
-                        print("\n¡JUEGO TERMINADO!")
-                        print(f"Duración total: {duracion:.2f} segundos")
-                        
-                        if hay_empate_result:
-                            print("El juego terminó en EMPATE")
-                        else:
-                            print(f"GANADOR: Jugador {ganador} con {max_puntos} puntos")
-                        
-                        print("\nPuntuaciones finales:")
-                        for addr_str, puntos in puntuaciones.items():
-                            print(f"Jugador {addr_str}: {puntos} puntos")
-                        
-                        # Cerrar todas las conexiones y terminar
-                        print("\nCerrando todas las conexiones...")
-                        for addr_str, conn in list(conexiones_clientes.items()):
-                            try:
-                                # Enviar mensaje de despedida antes de cerrar
-                                conn.sendall("DESPEDIDA:El servidor ha terminado la partida".encode())
-                                conn.close()
-                            except:
-                                pass
-                        
-                        # Cerrar el socket del servidor
-                        try:
-                            servidor_socket.close()
-                        except:
-                            pass
-                        
-                        # Esperar un momento para que los mensajes lleguen
-                        time.sleep(1)
-                        
-                        # Terminar el programa con código de salida 0 (éxito)
-                        print("¡Gracias por jugar! El servidor se cerrará.")
-                        
-                        # Forzar la terminación del programa, incluyendo todos los hilos
-                        import os
-                        os._exit(0)  # Esta es una manera más drástica de terminar que sys.exit()
-                else:
-                    print(f"Comando desconocido de {client_ip}:{client_port}: {data}")
-
+                    if not procesar_mensaje(sala, client_conn, client_ip, client_port, data):
+                        continuar = False
+                        break
+                if not continuar:
+                    break
+            
             except ConnectionResetError:
-                print(f"Conexión cerrada por el cliente {client_ip}:{client_port}")
+                registro.info("conexion", "Conexión cerrada por el cliente %s:%s", client_ip, client_port)
                 break
             except Exception as e:
-                print(f"Error con cliente {client_ip}:{client_port}: {e}")
+                metricas.incrementar("errores_conexion")
+                registro.error("conexion", "Error con cliente %s:%s: %s", client_ip, client_port, e)
                 break
-
+    
     except Exception as e:
-        print(f"Error en hilo cliente {client_ip}:{client_port}: {e}")
+        metricas.incrementar("errores_conexion")
+        registro.error("conexion", "Error en hilo cliente %s:%s: %s", client_ip, client_port, e)
     finally:
         # Al terminar el bucle, el cliente se ha desconectado
-        print(f"Cliente {client_ip}:{client_port} desconectado")
-        eliminar_cliente(client_ip, client_port)
-        enviar_a_todos(f"DESCONEXION:{client_ip}:{client_port}")
+        if espera is not None and sala is None:
+            # Dejar la cola, salvo que la partida se formara mientras se iba
+            sala = emparejador.cancelar(espera)
+        if sala is not None:
+            desconectar_cliente(sala, client_ip, client_port, client_conn)
+        # La conexión se cierra después de enviar lo que tenga pendiente
+        if client_conn is not None:
+            latidos.cancelar(client_conn)
+            client_conn.close()
+        else:
+            try:
+                client_sock.close()
+            except:
+                pass
+        admision.liberar()
+        with lock:
+            hilos_clientes.pop(cliente_addr_str, None)
+
+def iniciar_hilo_cliente(client_conn, client_addr, traspaso=None):
+    client_ip = client_addr[0]
+    client_port = client_addr[1]
+    
+    # Crear un hilo para manejar este cliente
+    cliente_thread = threading.Thread(target=manejar_cliente, args=(client_conn, client_addr, traspaso))
+    cliente_thread.daemon = True
+    cliente_thread.start()
+    
+    # Registrar el hilo
+    registrar_hilo(client_ip, client_port, cliente_thread)
+
+def atender_traspaso_hilo(client_conn, tramas, data):
+    """Conexión recibida de otro proceso (modo de hilos multiproceso)"""
+    try:
+        client_addr = client_conn.getpeername()
+    except OSError:
+        client_conn.close()  # El cliente se fue durante el traspaso
+        return
+    # Ya se admitió en el proceso que la aceptó: aquí solo se cuenta
+    admision.ocupar()
+    iniciar_hilo_cliente(client_conn, client_addr, (tramas, data))
+
+def aceptar_cliente(client_conn, client_addr):
+    """Admite (o rechaza al momento) una conexión recién aceptada en el modo de hilos"""
+    client_ip = client_addr[0]
+    client_port = client_addr[1]
+    rechazo = admision.admitir(client_ip)
+    if rechazo is not None:
+        # Sin hilos: se responde OCUPADO y se cierra
+        registro.debug("conexion", "Conexión de %s:%s rechazada: %s", client_ip, client_port, rechazo)
+        rechazar(client_conn, rechazo)
+        return
+    client_conn.setblocking(True)
+    # Sin Nagle: JUGADA y TURNO salen en escrituras separadas (asyncio ya lo desactiva)
+    client_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    iniciar_hilo_cliente(client_conn, client_addr)
+    
+    registro.info("conexion", "Cliente conectado: %s:%s. Total: %s", client_ip, client_port, len(hilos_clientes))
+
+def servidor_hilos():
+    """Modo clásico: un hilo por cliente (los PING los envía la rueda de temporizadores)"""
+    global servidor_socket
+    
+    # Configuración del servidor
+    servidor_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    servidor_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if trabajador is not None:
+        # Todos los procesos escuchan en el mismo puerto y el núcleo reparte las conexiones
+        servidor_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    servidor_socket.bind((HOST, PORT))
+    servidor_socket.listen(BACKLOG)  # Cola amplia: una avalancha de reconexiones no se pierde en el núcleo
+    servidor_socket.setblocking(False)
+    registro.info("servidor", "El servidor de Memorama está disponible en %s:%s", HOST, PORT)
+    registro.info("servidor", "Esperando conexión de clientes...")
+    
+    rueda_temporizadores.iniciar_hilo()
+    repartidor.iniciar_hilo()
+    if trabajador is not None:
+        trabajador.iniciar_hilo(atender_traspaso_hilo)
+    
+    selector = selectors.DefaultSelector()
+    selector.register(servidor_socket, selectors.EVENT_READ)
+    try:
+        while True:
+            # Esperar conexiones y aceptar en lote las que ya estén en la cola
+            selector.select()
+            for _ in range(LOTE_ACEPTAR):
+                try:
+                    client_conn, client_addr = servidor_socket.accept()
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    metricas.incrementar("errores_conexion")
+                    registro.error("servidor", "No se pudo aceptar una conexión: %s", e)
+                    break
+                aceptar_cliente(client_conn, client_addr)
+    
+    except KeyboardInterrupt:
+        registro.info("servidor", "Servidor interrumpido. Cerrando...")
+    finally:
+        # Cerrar el diario antes que las conexiones: las partidas en curso se recuperan al reiniciar
+        cerrar_diario()
+        # Cerrar todas las conexiones de clientes
+        for sala in list(gestor_salas.salas.values()):
+            for addr_str, conn in sala.instantanea.conexiones.items():
+                try:
+                    conn.close()
+                except:
+                    pass
+        if servidor_socket:
+            servidor_socket.close()
+        selector.close()
+        registro.info("servidor", "Servidor cerrado.")
+        registro.vaciar()
+
+# ---------------------------------------------------------------------------
+# Modo asyncio: un solo hilo y un solo bucle de eventos para todas las
+# conexiones (aceptar, recibir, procesar jugadas, pings y broadcasts)
+# ---------------------------------------------------------------------------
+
+class ProtocoloCliente(asyncio.Protocol):
+    """Maneja una conexión de cliente dentro del bucle de eventos"""
+    __slots__ = ("conn", "client_ip", "client_port", "sala", "espera", "espera_union", "decodificador", "traspaso",
+                 "admitida")
+    
+    def __init__(self, traspaso=None):
+        self.admitida = False
+        self.conn = None
+        self.client_ip = None
+        self.client_port = None
+        self.sala = None
+        self.espera = None  # Espera del emparejador si el cliente envió BUSCAR
+        self.espera_union = None
+        self.decodificador = None
+        self.traspaso = traspaso  # (tramas, primer mensaje) si otro proceso pasó la conexión
+    
+    def connection_made(self, transport):
+        self.client_ip, self.client_port = transport.get_extra_info("peername")[:2]
+        if self.traspaso is not None:
+            # Ya se admitió en el proceso que la aceptó: aquí solo se cuenta
+            admision.ocupar()
+        else:
+            rechazo = admision.admitir(self.client_ip)
+            if rechazo is not None:
+                registro.debug("conexion", "Conexión de %s:%s rechazada: %s", self.client_ip, self.client_port, rechazo)
+                transport.write(protocolo.codificar_trama(rechazo))
+                transport.close()
+                return
+        self.admitida = True
+        self.conn = ConexionAsync(transport, False, POLITICA_SALIDA, MAXIMO_COLA_SALIDA)
+        self.conn.limite = admision.limite_mensajes()
+        transport.set_write_buffer_limits(high=LIMITE_BUFER_ASYNC)
         
-        # Imprimir el tablero actualizado después de la desconexión
-        if len(conexiones_clientes) > 0:  # Solo si quedan jugadores
-            imprimir_tablero_servidor()
-
-# Función principal
-print("Iniciando servidor de Memorama Multijugador...")
-dificultad_input = input("Seleccione la dificultad (1: Principiante - tablero 4x4, 2: Avanzado - tablero 6x6): ")
-if dificultad_input in ["1", "2"]:
-    dificultad = dificultad_input
-    if dificultad == "2":
-        filas = 6
-        columnas = 6
-        num_pares = 18
-else:
-    print("Dificultad inválida. Usando dificultad Principiante por defecto.")
-
-# Inicializar el tablero
-inicializar_tablero()
-
-# Configuración del servidor
-host_input = input("Ingrese la dirección IP del servidor (presione Enter para usar 127.0.0.1): ")
-if host_input:
-    HOST = host_input
-
-try:
-    port_input = input("Ingrese el puerto del servidor (presione Enter para usar 65432): ")
-    if port_input:
-        PORT = int(port_input)
-except ValueError:
-    print("Puerto inválido. Usando puerto 65432 por defecto.")
-
-# Configuración del servidor
-servidor_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-servidor_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-servidor_socket.bind((HOST, PORT))
-servidor_socket.listen(5)  # Cola de hasta 5 conexiones pendientes
-print(f"El servidor de Memorama está disponible en {HOST}:{PORT}")
-print("Esperando conexión de clientes...")
-
-try:
-    while True:
-        # Aceptar conexiones (bloqueante)
-        client_conn, client_addr = servidor_socket.accept()
-        client_ip = client_addr[0]
-        client_port = client_addr[1]
-
-        # Crear un hilo para manejar este cliente
-        cliente_thread = threading.Thread(target=manejar_cliente, args=(client_conn, client_addr))
-        cliente_thread.daemon = True
-        cliente_thread.start()
+        if self.traspaso is not None:
+            # Otro proceso ya leyó el primer mensaje: unirse directamente
+            tramas, data = self.traspaso
+            self.traspaso = None
+            self.conn.tramas = tramas
+            self.decodificador = (protocolo.DecodificadorTramas(TAMANO_MAXIMO_MENSAJE_CLIENTE) if tramas
+                                  else protocolo.DecodificadorCrudo())
+            self.unirse(data)
+            return
         
-        # Registrar el hilo
-        registrar_hilo(client_ip, client_port, cliente_thread)
+        # Los clientes antiguos no envían UNIR: pasado el plazo van a la sala principal
+        loop = asyncio.get_running_loop()
+        self.espera_union = loop.call_later(TIEMPO_UNIR, self.unirse, "")
+    
+    def unirse(self, data):
+        self.espera_union = None
+        if self.decodificador is None:
+            self.decodificador = protocolo.DecodificadorCrudo()
+        # Modo multiproceso: la sala puede pertenecer a otro proceso
+        if traspasar_si_ajena(self.conn.transport.get_extra_info("socket").fileno(), self.conn.tramas, data):
+            self.conn.abortar()  # Solo se suelta el descriptor; la conexión sigue en el otro proceso
+            return
+        busqueda = interpretar_busqueda(data)
+        if busqueda is not None:
+            self.espera = buscar_partida(self.conn, self.client_ip, self.client_port, *busqueda)
+            return
+        reanudacion = interpretar_reanudacion(data)
+        if reanudacion is not None:
+            # Vuelta tras un corte: desde aquí el cliente es el jugador de su asiento
+            sala, client_ip, client_port = reanudar_cliente(self.conn, *reanudacion)
+            if sala is None:
+                self.conn.close()
+                return
+            self.sala, self.client_ip, self.client_port = sala, client_ip, client_port
+            return
+        id_sala, dificultad_sala, capacidades, plazo_turno, mazo, pendiente = interpretar_union(data)
+        self.sala = unir_cliente(self.conn, self.client_ip, self.client_port, id_sala, dificultad_sala, capacidades,
+                                 plazo_turno, mazo)
+        if self.sala is None:
+            self.conn.close()
+            return
+        registro.info("conexion", "Cliente conectado: %s:%s. Total: %s",
+                      self.client_ip, self.client_port, gestor_salas.total_conexiones())
+        if pendiente:
+            self.procesar(pendiente)
+    
+    def procesar(self, data):
+        try:
+            continuar = procesar_mensaje(self.sala, self.conn, self.client_ip, self.client_port, data)
+        except Exception as e:
+            metricas.incrementar("errores_conexion")
+            registro.error("conexion", "Error con cliente %s:%s: %s", self.client_ip, self.client_port, e)
+            continuar = False
+        
+        if not continuar:
+            self.conn.close()
+        return continuar
+    
+    def data_received(self, datos):
+        if self.decodificador is None:
+            # El primer byte indica si el cliente usa tramas
+            if protocolo.es_inicio_de_trama(datos):
+                self.decodificador = protocolo.DecodificadorTramas(TAMANO_MAXIMO_MENSAJE_CLIENTE)
+                self.conn.tramas = True
+            else:
+                self.decodificador = protocolo.DecodificadorCrudo()
+            # Ya se sabe que el cliente no es antiguo: esperar su UNIR
+            self.espera_union.cancel()
+            self.espera_union = None
+        
+        try:
+            mensajes = self.decodificador.alimentar(datos)
+        except (ValueError, UnicodeDecodeError) as e:
+            metricas.incrementar("errores_conexion")
+            registro.error("conexion", "Error con cliente %s:%s: %s", self.client_ip, self.client_port, e)
+            self.conn.close()
+            return
+        
+        for data in mensajes:
+            if self.sala is None and self.espera is not None:
+                # En la sala de espera: solo se procesa el mensaje si la partida ya se formó
+                self.sala = atender_espera(self.espera, self.conn, data)
+                if self.sala is not None and not self.procesar(data):
+                    break
+            elif self.sala is None:
+                if data == COMANDO_ESTADISTICAS:
+                    atender_estadisticas(self.conn, self.client_ip)
+                    self.conn.close()
+                    break
+                self.unirse(data)
+                if self.sala is None and self.espera is None:
+                    break
+            elif not (self.sala.juego_activo or self.sala.en_revancha) or not self.procesar(data):
+                break
+    
+    def pause_writing(self):
+        # El cliente no lee lo bastante rápido: los mensajes esperan en su cola
+        self.conn.pausar()
+    
+    def resume_writing(self):
+        self.conn.reanudar()
+    
+    def connection_lost(self, exc):
+        if not self.admitida:
+            return
+        admision.liberar()
+        latidos.cancelar(self.conn)
+        if self.espera_union is not None:
+            self.espera_union.cancel()
+        if self.espera is not None and self.sala is None:
+            self.sala = emparejador.cancelar(self.espera)
+        if self.sala is not None:
+            desconectar_cliente(self.sala, self.client_ip, self.client_port, self.conn)
 
-        print(f"Cliente conectado: {client_ip}:{client_port}. Total: {len(conexiones_clientes) + 1}")
+def atender_traspaso_async(client_sock, tramas, data):
+    """Conexión recibida de otro proceso (modo asyncio multiproceso)"""
+    loop = asyncio.get_running_loop()
+    loop.create_task(loop.connect_accepted_socket(lambda: ProtocoloCliente((tramas, data)), client_sock))
+
+async def servidor_asyncio():
+    """Modo asyncio: todas las conexiones se atienden en un solo hilo"""
+    loop = asyncio.get_running_loop()
+    
+    servidor = await loop.create_server(
+        ProtocoloCliente, HOST, PORT,
+        reuse_address=True, reuse_port=trabajador is not None, backlog=BACKLOG
+    )
+    registro.info("servidor", "El servidor de Memorama (asyncio) está disponible en %s:%s", HOST, PORT)
+    registro.info("servidor", "Esperando conexión de clientes...")
+    
+    rueda_temporizadores.iniciar_async(loop)
+    repartidor.iniciar_async(loop)
+    if trabajador is not None:
+        trabajador.iniciar_async(loop, atender_traspaso_async)
+    
+    async with servidor:
+        await servidor.serve_forever()
 
-except KeyboardInterrupt:
-    print("Servidor interrumpido. Cerrando...")
-finally:
-    # Cerrar todas las conexiones de clientes
-    for addr_str, conn in list(conexiones_clientes.items()):
+def ejecutar(modo, ruta_diario):
+    """Recupera el diario (si está activado) y atiende clientes en el modo elegido"""
+    if ruta_diario:
+        try:
+            iniciar_diario(ruta_diario)
+        except OSError as e:
+            registro.aviso("diario", "No se pudo abrir el diario (%s). Continuando sin diario.", e)
+    
+    if modo == "2":
         try:
-            conn.close()
-        except:
-            pass
-    if servidor_socket:
-        servidor_socket.close()
-    print("Servidor cerrado.")
\ No newline at end of file
+            asyncio.run(servidor_asyncio())
+        except KeyboardInterrupt:
+            registro.info("servidor", "Servidor interrumpido. Cerrando...")
+        cerrar_diario()
+        registro.info("servidor", "Servidor cerrado.")
+        registro.vaciar()
+    else:
+        servidor_hilos()
+
+def ejecutar_trabajador(trabajador_proceso, modo, ruta_diario):
+    """Punto de entrada de cada proceso del modo multiproceso"""
+    global trabajador
+    trabajador = trabajador_proceso
+    registro.info("servidor", "Proceso trabajador %s de %s", trabajador.indice, trabajador.num_trabajadores)
+    # Cada proceso anota solo sus salas; con el mismo número de procesos las recupera al reiniciar
+    ejecutar(modo, ruta_diario and f"{ruta_diario}.{trabajador.indice}")
+
+if __name__ == "__main__":
+    # Función principal
+    print("Iniciando servidor de Memorama Multijugador...")
+    dificultad_input = input("Seleccione la dificultad por defecto de las salas (1: Principiante - tablero 4x4, 2: Avanzado - tablero 6x6, o un tamaño como 20x30): ")
+    if dimensiones_dificultad(dificultad_input):
+        dificultad = dificultad_input
+        gestor_salas.dificultad_por_defecto = dificultad
+    else:
+        print("Dificultad inválida. Usando dificultad Principiante por defecto.")
+    
+    mazos_input = input("Directorio con mazos de palabras (archivos .txt, una palabra por línea; presione Enter para usar solo el mazo básico): ").strip()
+    if mazos_input:
+        try:
+            nombres = catalogo.registrar_directorio(mazos_input)
+            print(f"Mazos disponibles: {', '.join(catalogo.nombres())}")
+            if nombres:
+                mazo_input = input(f"Mazo por defecto de las salas nuevas (presione Enter para usar {MAZO_BASICO}): ").strip()
+                if mazo_input in catalogo:
+                    gestor_salas.mazo_por_defecto = mazo_input
+                elif mazo_input:
+                    print(f"Mazo desconocido. Usando {MAZO_BASICO} por defecto.")
+        except OSError as e:
+            print(f"No se pudo leer el directorio de mazos ({e}). Usando solo el mazo básico.")
+    
+    # Configuración del servidor
+    host_input = input("Ingrese la dirección IP del servidor (presione Enter para usar 127.0.0.1): ")
+    if host_input:
+        HOST = host_input
+    
+    try:
+        port_input = input("Ingrese el puerto del servidor (presione Enter para usar 65432): ")
+        if port_input:
+            PORT = int(port_input)
+    except ValueError:
+        print("Puerto inválido. Usando puerto 65432 por defecto.")
+    
+    nivel_input = input("Nivel de registro (DEBUG, INFO, AVISO o ERROR; presione Enter para usar INFO): ").strip().upper()
+    if nivel_input and nivel_input not in NIVELES:
+        print("Nivel inválido. Usando INFO por defecto.")
+    volcado_input = input("¿Mostrar el tablero completo tras cada jugada? (s/N): ").strip().lower()
+    registro.configurar(nivel=NIVELES.get(nivel_input, INFO), volcar_tablero=volcado_input == "s")
+    
+    try:
+        plazo_input = input("Segundos por turno (presione Enter para no limitarlos): ").strip()
+        if plazo_input:
+            plazos.plazo = float(plazo_input)
+            if not 0 <= plazos.plazo < float("inf"):
+                raise ValueError
+    except ValueError:
+        print("Plazo inválido. Los turnos no tendrán límite de tiempo.")
+        plazos.plazo = PLAZO_TURNO
+    if plazos.plazo:
+        degradar_input = input(f"¿Pasar a espectador al jugador que agote {MAXIMO_TURNOS_VENCIDOS} turnos seguidos sin jugar? (s/N): ")
+        plazos.degradar = degradar_input.strip().lower() == "s"
+    
+    try:
+        revancha_input = input(f"Segundos para aceptar la revancha al terminar una partida (presione Enter para usar {VENTANA_REVANCHA:g}, 0 para cerrar la sala): ").strip()
+        gestor_salas.ventana_revancha = float(revancha_input) if revancha_input else VENTANA_REVANCHA
+        if not 0 <= gestor_salas.ventana_revancha < float("inf"):
+            raise ValueError
+    except ValueError:
+        print(f"Tiempo inválido. Usando {VENTANA_REVANCHA:g} segundos por defecto.")
+        gestor_salas.ventana_revancha = VENTANA_REVANCHA
+    
+    try:
+        maximo_input = input(f"Máximo de conexiones simultáneas por proceso (presione Enter para usar {MAXIMO_CONEXIONES}, 0 para no limitarlas): ").strip()
+        admision.maximo = int(maximo_input) if maximo_input else MAXIMO_CONEXIONES
+        tasa_input = input(f"Conexiones nuevas por segundo desde una misma IP (presione Enter para usar {CONEXIONES_POR_SEGUNDO_IP:g}, 0 para no limitarlas): ").strip()
+        admision.tasa = float(tasa_input) if tasa_input else CONEXIONES_POR_SEGUNDO_IP
+        mensajes_input = input(f"Mensajes por segundo que se atienden de cada cliente (presione Enter para usar {MENSAJES_POR_SEGUNDO:g}, 0 para no limitarlos): ").strip()
+        admision.mensajes = float(mensajes_input) if mensajes_input else MENSAJES_POR_SEGUNDO
+        if admision.maximo < 0 or not 0 <= admision.tasa < float("inf") or not 0 <= admision.mensajes < float("inf"):
+            raise ValueError
+    except ValueError:
+        print(f"Límite inválido. Usando {MAXIMO_CONEXIONES} conexiones, {CONEXIONES_POR_SEGUNDO_IP:g} por segundo por IP "
+              f"y {MENSAJES_POR_SEGUNDO:g} mensajes por segundo por cliente.")
+        admision.maximo = MAXIMO_CONEXIONES
+        admision.tasa = CONEXIONES_POR_SEGUNDO_IP
+        admision.mensajes = MENSAJES_POR_SEGUNDO
+    
+    try:
+        gracia_input = input(f"Segundos que se guarda el asiento de un jugador que pierde la conexión (presione Enter para usar {GRACIA_SESION:g}, 0 para no guardarlo): ").strip()
+        sesiones.gracia = float(gracia_input) if gracia_input else GRACIA_SESION
+        if not 0 <= sesiones.gracia < float("inf"):
+            raise ValueError
+    except ValueError:
+        print(f"Tiempo inválido. Usando {GRACIA_SESION:g} segundos por defecto.")
+        sesiones.gracia = GRACIA_SESION
+    
+    diario_input = input(f"Archivo del diario de partidas (presione Enter para usar {RUTA_DIARIO}, 'n' para desactivarlo): ").strip()
+    ruta_diario = None if diario_input.lower() == "n" else diario_input or RUTA_DIARIO
+    
+    modo_input = input("Seleccione el modo del servidor (1: Hilos - un hilo por cliente, 2: Asyncio - un solo hilo para todas las conexiones): ")
+    
+    try:
+        procesos = int(input("Número de procesos (presione Enter para usar 1; con más, cada proceso atiende sus propias salas): ") or "1")
+    except ValueError:
+        print("Número inválido. Usando 1 proceso.")
+        procesos = 1
+    if procesos > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        print("Este sistema no admite SO_REUSEPORT. Usando 1 proceso.")
+        procesos = 1
+    
+    if procesos > 1:
+        trabajadores.lanzar(procesos, ejecutar_trabajador, modo_input, ruta_diario)
+    else:
+        ejecutar(modo_input, ruta_diario)
@@ -0,0 +1,149 @@
+import threading
+import time
+
+from metricas import metricas
+from protocolo import codificar_trama
+
+BACKLOG = 1024              # Conexiones pendientes de aceptar en el socket (el núcleo lo limita a somaxconn)
+LOTE_ACEPTAR = 64           # Conexiones aceptadas de una vez cada vez que el socket está listo (modo de hilos)
+MAXIMO_CONEXIONES = 2000    # Conexiones simultáneas por proceso (en modo de hilos, dos hilos cada una)
+CONEXIONES_POR_SEGUNDO_IP = 20.0  # Conexiones nuevas por segundo desde una misma IP
+RAFAGA_IP = 40              # Conexiones seguidas que se permiten a una IP antes de aplicar la tasa
+REINTENTAR_OCUPADO = 2.0    # Segundos que se pide esperar cuando el servidor está lleno
+MINIMO_PURGA = 1024         # IPs anotadas antes de buscar las que ya no hace falta recordar
+MENSAJES_POR_SEGUNDO = 20.0  # Mensajes por segundo que se atienden de cada conexión
+RAFAGA_MENSAJES = 40        # Mensajes seguidos que se atienden antes de aplicar la tasa
+MAXIMO_DESCARTADOS = 200    # Mensajes descartados sin que la conexión se calme antes de cerrarla
+
+class ControlAdmision:
+    """Decide si se atiende una conexión nueva antes de dedicarle hilos o memoria.
+    
+    Limita las conexiones simultáneas del proceso y, con un cubo de fichas
+    por IP, las conexiones nuevas por segundo de cada cliente, para que una
+    avalancha de reconexiones (por ejemplo tras un corte de red) no llene
+    la cola del socket ni lance miles de hilos a la vez. La conexión
+    rechazada recibe al momento OCUPADO:segundos:motivo y se cierra.
+    Con maximo 0 o tasa 0 el límite correspondiente no se aplica.
+    También guarda la tasa de mensajes por conexión (mensajes, 0 sin
+    límite) con la que se crea el LimiteMensajes de cada cliente admitido.
+    """
+    
+    def __init__(self, maximo=0, tasa=0.0, rafaga=RAFAGA_IP, reintentar=REINTENTAR_OCUPADO,
+                 mensajes=0.0, rafaga_mensajes=RAFAGA_MENSAJES):
+        self.maximo = maximo
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.reintentar = reintentar
+        self.mensajes = mensajes
+        self.rafaga_mensajes = rafaga_mensajes
+        self.abiertas = 0
+        self.cubos = {}  # diccionario {ip: [fichas, instante de la última recarga]}
+        self.limite_purga = MINIMO_PURGA
+        self.lock = threading.Lock()
+    
+    def admitir(self, ip):
+        """Reserva una plaza para una conexión de la IP.
+        
+        Devuelve None si se admite (hay que llamar a liberar() al cerrarla)
+        o el mensaje OCUPADO que hay que enviar antes de cerrarla.
+        """
+        with self.lock:
+            if self.maximo and self.abiertas >= self.maximo:
+                metricas.incrementar("rechazos_capacidad")
+                return f"OCUPADO:{self.reintentar:g}:El servidor está lleno"
+            if self.tasa:
+                espera = self._gastar_ficha(ip)
+                if espera:
+                    metricas.incrementar("rechazos_tasa")
+                    return f"OCUPADO:{espera:.1f}:Demasiadas conexiones desde tu dirección"
+            self.abiertas += 1
+            return None
+    
+    def ocupar(self):
+        """Cuenta una conexión ya admitida en otro proceso (traspaso del modo multiproceso)"""
+        with self.lock:
+            self.abiertas += 1
+    
+    def liberar(self):
+        with self.lock:
+            self.abiertas -= 1
+    
+    def limite_mensajes(self):
+        """LimiteMensajes para una conexión nueva, o None si los mensajes no se limitan"""
+        if not self.mensajes:
+            return None
+        return LimiteMensajes(self.mensajes, self.rafaga_mensajes)
+    
+    def _gastar_ficha(self, ip):
+        """Gasta una ficha del cubo de la IP (hay que tener el lock). Devuelve los segundos hasta la siguiente, o 0"""
+        ahora = time.monotonic()
+        cubo = self.cubos.get(ip)
+        if cubo is None:
+            if len(self.cubos) >= self.limite_purga:
+                self._purgar(ahora)
+            cubo = self.cubos[ip] = [self.rafaga, ahora]
+        else:
+            cubo[0] = min(self.rafaga, cubo[0] + (ahora - cubo[1]) * self.tasa)
+            cubo[1] = ahora
+        if cubo[0] < 1:
+            return max((1 - cubo[0]) / self.tasa, 0.1)
+        cubo[0] -= 1
+        return 0
+    
+    def _purgar(self, ahora):
+        # Un cubo que ya se habría llenado es igual que uno nuevo: no hace falta guardarlo
+        llenado = self.rafaga / self.tasa
+        self.cubos = {ip: cubo for ip, cubo in self.cubos.items() if ahora - cubo[1] < llenado}
+        self.limite_purga = max(MINIMO_PURGA, 2 * len(self.cubos))
+
+class LimiteMensajes:
+    """Cubo de fichas de los mensajes que envía una conexión.
+    
+    Cada mensaje gasta una ficha y las fichas se recuperan a la tasa
+    indicada hasta llenar la ráfaga. Lo usa solo quien lee la conexión (su
+    hilo o el bucle de eventos), así que no necesita lock. descartados
+    cuenta los mensajes rechazados desde la última vez que el cubo estuvo
+    lleno: solo crece mientras el cliente sigue por encima de la tasa.
+    """
+    __slots__ = ("tasa", "rafaga", "fichas", "instante", "descartados", "avisado")
+    
+    def __init__(self, tasa, rafaga):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.fichas = rafaga
+        self.instante = time.monotonic()
+        self.descartados = 0
+        self.avisado = False  # Ya se avisó al cliente desde el último mensaje atendido (los JUGAR siempre se responden)
+    
+    def permitir(self):
+        ahora = time.monotonic()
+        fichas = self.fichas + (ahora - self.instante) * self.tasa
+        self.instante = ahora
+        if fichas >= self.rafaga:
+            fichas = self.rafaga
+            self.descartados = 0
+        if fichas < 1:
+            self.fichas = fichas
+            self.descartados += 1
+            return False
+        self.fichas = fichas - 1
+        self.avisado = False
+        return True
+    
+    def excedido(self):
+        return self.descartados > MAXIMO_DESCARTADOS
+
+def rechazar(sock, mensaje):
+    """Envía la respuesta OCUPADO sin bloquear y cierra el socket.
+    
+    Se envía con trama, como la esperan los clientes actuales, sin leer
+    antes nada del cliente: si no cabe en el búfer del socket se cierra
+    sin más.
+    """
+    try:
+        sock.setblocking(False)
+        sock.send(codificar_trama(mensaje))
+    except OSError:
+        pass
+    finally:
+        sock.close()
@@ -0,0 +1,109 @@
+class Clasificacion:
+    """Puntuaciones de una sala ordenadas de forma incremental.
+    
+    Los jugadores se agrupan por puntos (un diccionario por puntuación, en
+    orden de llegada) y los grupos no vacíos forman una lista doblemente
+    enlazada de mayor a menor. Como cada acierto suma un solo punto, subir
+    a un jugador es mover su entrada al grupo contiguo: O(1). El líder y
+    el empate se leen del grupo más alto en O(1) y los K mejores se
+    recorren en O(K), sin ordenar ni copiar todas las puntuaciones.
+    """
+    
+    __slots__ = ("puntos", "grupos", "superior", "inferior", "maximo")
+    
+    def __init__(self):
+        self.puntos = {}    # diccionario {addr_str: puntos}
+        self.grupos = {}    # diccionario {puntos: {addr_str: None}} (solo grupos no vacíos)
+        self.superior = {}  # diccionario {puntos: puntuación del siguiente grupo más alto}
+        self.inferior = {}  # diccionario {puntos: puntuación del siguiente grupo más bajo}
+        self.maximo = None  # Puntuación del grupo más alto
+    
+    def __len__(self):
+        return len(self.puntos)
+    
+    def __contains__(self, addr_str):
+        return addr_str in self.puntos
+    
+    def agregar(self, addr_str, puntos=0):
+        """Añade un jugador (o cambia su puntuación) con los puntos indicados"""
+        if addr_str in self.puntos:
+            self.quitar(addr_str)
+        if puntos not in self.grupos:
+            # Buscar su sitio desde arriba; con 0 puntos (lo normal) es el final de la lista
+            arriba, abajo = None, self.maximo
+            while abajo is not None and abajo > puntos:
+                arriba, abajo = abajo, self.inferior[abajo]
+            self._enlazar(puntos, arriba, abajo)
+        self.grupos[puntos][addr_str] = None
+        self.puntos[addr_str] = puntos
+    
+    def quitar(self, addr_str):
+        puntos = self.puntos.pop(addr_str, None)
+        if puntos is None:
+            return
+        grupo = self.grupos[puntos]
+        del grupo[addr_str]
+        if not grupo:
+            self._desenlazar(puntos)
+    
+    def sumar(self, addr_str):
+        """Suma un punto al jugador. Devuelve su nueva puntuación"""
+        puntos = self.puntos.get(addr_str)
+        if puntos is None:
+            self.agregar(addr_str, 1)
+            return 1
+        nuevos = puntos + 1
+        if nuevos not in self.grupos:
+            # El grupo siguiente va justo encima del actual
+            self._enlazar(nuevos, self.superior[puntos], puntos)
+        grupo = self.grupos[puntos]
+        del grupo[addr_str]
+        self.grupos[nuevos][addr_str] = None
+        self.puntos[addr_str] = nuevos
+        if not grupo:
+            self._desenlazar(puntos)
+        return nuevos
+    
+    def lider(self):
+        """(addr_str, puntos) del primero que llegó a la puntuación más alta, o (None, 0)"""
+        if self.maximo is None:
+            return None, 0
+        return next(iter(self.grupos[self.maximo])), self.maximo
+    
+    def empate(self):
+        """True si más de un jugador comparte la puntuación más alta"""
+        return self.maximo is not None and len(self.grupos[self.maximo]) > 1
+    
+    def mejores(self, cantidad):
+        """Lista [(addr_str, puntos)] de los mejores jugadores, de mayor a menor"""
+        resultado = []
+        puntos = self.maximo
+        while puntos is not None and len(resultado) < cantidad:
+            for addr_str in self.grupos[puntos]:
+                resultado.append((addr_str, puntos))
+                if len(resultado) == cantidad:
+                    break
+            puntos = self.inferior[puntos]
+        return resultado
+    
+    def _enlazar(self, puntos, arriba, abajo):
+        self.grupos[puntos] = {}
+        self.superior[puntos] = arriba
+        self.inferior[puntos] = abajo
+        if arriba is None:
+            self.maximo = puntos
+        else:
+            self.inferior[arriba] = puntos
+        if abajo is not None:
+            self.superior[abajo] = puntos
+    
+    def _desenlazar(self, puntos):
+        arriba = self.superior.pop(puntos)
+        abajo = self.inferior.pop(puntos)
+        del self.grupos[puntos]
+        if arriba is None:
+            self.maximo = abajo
+        else:
+            self.inferior[arriba] = abajo
+        if abajo is not None:
+            self.superior[abajo] = arriba
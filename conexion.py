@@ -0,0 +1,261 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+
+import protocolo
+
+# Políticas cuando la cola de salida de un cliente lento se llena
+POLITICA_DESCARTAR = "descartar"      # Descartar las actualizaciones de estado más antiguas
+POLITICA_AGRUPAR = "agrupar"          # Sustituir las actualizaciones pendientes por una sola
+POLITICA_DESCONECTAR = "desconectar"  # Desconectar al cliente
+POLITICAS = (POLITICA_DESCARTAR, POLITICA_AGRUPAR, POLITICA_DESCONECTAR)
+
+MAXIMO_COLA = 256  # Mensajes pendientes por conexión
+PLAZO_CIERRE = 10.0  # Segundos que se espera a que el cliente lea lo pendiente al cerrar antes de abortar
+
+# Mensajes de estado: uno posterior deja obsoletos a los anteriores
+TIPOS_ESTADO = ("JUGADA:", "DELTA:", "ESTADO:")
+
+# Marca en la cola: enviar el estado completo de la sala en el momento del envío
+RESINCRONIZAR = object()
+
+class ColaSalida:
+    """Cola acotada de mensajes pendientes de enviar a un cliente.
+    
+    Añadir un mensaje nunca bloquea. Si la cola está llena se aplica la
+    política configurada sobre las actualizaciones de estado pendientes;
+    los demás mensajes (TURNO, FIN, ...) nunca se descartan.
+    """
+    __slots__ = ("mensajes", "maximo", "politica", "deltas", "descartados")
+    
+    def __init__(self, maximo=MAXIMO_COLA, politica=POLITICA_AGRUPAR):
+        self.mensajes = deque()
+        self.maximo = maximo
+        self.politica = politica
+        self.deltas = False
+        self.descartados = 0
+    
+    def __len__(self):
+        return len(self.mensajes)
+    
+    def agregar(self, mensaje):
+        """Añade un mensaje. Devuelve False si hay que desconectar al cliente"""
+        if len(self.mensajes) < self.maximo:
+            self.mensajes.append(mensaje)
+            return True
+        if self.politica == POLITICA_DESCARTAR:
+            return self._descartar(mensaje)
+        if self.politica == POLITICA_AGRUPAR:
+            return self._agrupar(mensaje)
+        return False
+    
+    def _es_estado(self, mensaje):
+        return mensaje is RESINCRONIZAR or mensaje.startswith(TIPOS_ESTADO)
+    
+    def _descartar(self, mensaje):
+        # Hacer sitio descartando la actualización de estado más antigua
+        for i, pendiente in enumerate(self.mensajes):
+            if self._es_estado(pendiente):
+                del self.mensajes[i]
+                self.descartados += 1
+                self.mensajes.append(mensaje)
+                return True
+        # No hay estado pendiente: se descarta el mensaje nuevo si es de estado.
+        # Los clientes con deltas detectan el salto de versión y piden ESTADO
+        if self._es_estado(mensaje):
+            self.descartados += 1
+            return True
+        return False
+    
+    def _agrupar(self, mensaje):
+        # Conservar solo la actualización de estado más reciente
+        nuevo_es_estado = self._es_estado(mensaje)
+        conservar = -1
+        if not nuevo_es_estado:
+            for i in range(len(self.mensajes) - 1, -1, -1):
+                if self._es_estado(self.mensajes[i]):
+                    conservar = i
+                    break
+        
+        restantes = deque()
+        for i, pendiente in enumerate(self.mensajes):
+            if i == conservar:
+                # Un DELTA suelto rompería la secuencia de versiones: enviar el estado completo
+                restantes.append(RESINCRONIZAR if self.deltas else pendiente)
+            elif not self._es_estado(pendiente):
+                restantes.append(pendiente)
+        
+        agrupados = len(self.mensajes) - len(restantes)
+        if agrupados == 0:
+            return False  # Solo hay mensajes que no se pueden descartar
+        if nuevo_es_estado and self.deltas:
+            mensaje = RESINCRONIZAR
+        self.descartados += agrupados
+        self.mensajes = restantes
+        self.mensajes.append(mensaje)
+        return True
+    
+    def extraer(self):
+        mensajes = self.mensajes
+        self.mensajes = deque()
+        return mensajes
+
+class Conexion:
+    """Estado común de la conexión de un cliente, sea cual sea el modo del servidor"""
+    __slots__ = ("tramas", "deltas", "espectador", "revancha", "cola", "generar_estado",
+                 "latido", "ping_enviado", "pings_perdidos", "rtt", "rtt_medio", "limite", "ultimo_esperar",
+                 "turno_pendiente")
+    
+    def __init__(self, tramas, politica, maximo):
+        self.tramas = tramas
+        self.deltas = False
+        self.espectador = False  # Solo recibe la partida, nunca tiene turno
+        self.revancha = False  # Entiende la oferta de revancha al terminar la partida
+        self.cola = ColaSalida(maximo, politica)
+        self.generar_estado = None  # Función que devuelve el mensaje ESTADO de la sala
+        self.turno_pendiente = False  # Cliente sin tramas que aún no ha recibido el turno al unirse
+        
+        # Mensajes entrantes: cubo de fichas (None sin límite) y último ESPERAR enviado (partida, versión, turno)
+        self.limite = None
+        self.ultimo_esperar = None
+        
+        # Latidos: temporizador en la rueda, PING sin respuesta y tiempos de ida y vuelta
+        self.latido = None
+        self.ping_enviado = 0
+        self.pings_perdidos = 0
+        self.rtt = None
+        self.rtt_medio = None
+    
+    def _codificar(self, mensaje):
+        if mensaje is RESINCRONIZAR:
+            mensaje = self.generar_estado()
+        return protocolo.codificar(mensaje, self.tramas)
+
+class ConexionSocket(Conexion):
+    """Socket bloqueante de un cliente con su propia cola de salida (modo de hilos).
+    
+    enviar() solo encola el mensaje; un hilo escritor por conexión lo
+    envía, así que un cliente con la ventana TCP llena no bloquea a la sala.
+    """
+    __slots__ = ("sock", "condicion", "cerrando", "cerrada", "hilo_escritor")
+    
+    def __init__(self, sock, tramas=False, politica=POLITICA_AGRUPAR, maximo=MAXIMO_COLA):
+        super().__init__(tramas, politica, maximo)
+        self.sock = sock
+        self.condicion = threading.Condition(threading.Lock())
+        self.cerrando = False
+        self.cerrada = False
+        self.hilo_escritor = threading.Thread(target=self._escritor, daemon=True)
+        self.hilo_escritor.start()
+    
+    def enviar(self, mensaje):
+        with self.condicion:
+            if self.cerrando or self.cerrada:
+                raise ConnectionError("Conexión cerrada")
+            self.cola.deltas = self.deltas
+            if not self.cola.agregar(mensaje):
+                self.cerrando = True
+                self.condicion.notify()
+                raise ConnectionError("Cliente demasiado lento, cola de salida llena")
+            self.condicion.notify()
+    
+    def _escritor(self):
+        while True:
+            with self.condicion:
+                while not self.cola and not self.cerrando:
+                    self.condicion.wait()
+                mensajes = self.cola.extraer()
+                terminar = self.cerrando
+            
+            try:
+                if mensajes and self.tramas:
+                    # Con tramas el cliente separa los mensajes: se envían juntos todos los pendientes
+                    self.sock.sendall(b"".join(self._codificar(m) for m in mensajes))
+                else:
+                    # Los clientes antiguos leen un mensaje por recv(): uno por escritura
+                    for mensaje in mensajes:
+                        self.sock.sendall(self._codificar(mensaje))
+            except Exception:
+                terminar = True
+            
+            if terminar:
+                break
+        
+        with self.condicion:
+            self.cerrada = True
+        # Despertar al hilo que está bloqueado en recv()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+    
+    def close(self):
+        """Cierra la conexión después de enviar los mensajes pendientes"""
+        with self.condicion:
+            self.cerrando = True
+            self.condicion.notify()
+    
+    def abortar(self):
+        """Cierra la conexión sin esperar a enviar lo pendiente (cliente muerto)"""
+        self.close()
+        # Interrumpe un sendall() bloqueado del hilo escritor y el recv() del manejador
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class ConexionAsync(Conexion):
+    """Transporte asyncio de un cliente con su propia cola de salida.
+    
+    Mientras el búfer del transporte está por debajo de su límite los
+    mensajes se escriben directamente; cuando asyncio pausa la escritura se
+    guardan en la cola acotada y se envían al reanudarse.
+    """
+    __slots__ = ("transport", "pausada")
+    
+    def __init__(self, transport, tramas=False, politica=POLITICA_AGRUPAR, maximo=MAXIMO_COLA):
+        super().__init__(tramas, politica, maximo)
+        self.transport = transport
+        self.pausada = False
+    
+    def _escribir(self, mensaje):
+        self.transport.write(self._codificar(mensaje))
+    
+    def enviar(self, mensaje):
+        if self.transport.is_closing():
+            raise ConnectionError("Conexión cerrada")
+        if not self.pausada and not self.cola:
+            self._escribir(mensaje)
+            return
+        self.cola.deltas = self.deltas
+        if not self.cola.agregar(mensaje):
+            self.transport.abort()
+            raise ConnectionError("Cliente demasiado lento, cola de salida llena")
+    
+    def pausar(self):
+        self.pausada = True
+    
+    def reanudar(self):
+        self.pausada = False
+        # write() puede volver a pausar la escritura de forma síncrona
+        while self.cola and not self.pausada and not self.transport.is_closing():
+            self._escribir(self.cola.mensajes.popleft())
+    
+    def close(self):
+        """Cierra la conexión después de pasar al transporte los mensajes pendientes.
+        
+        El transporte solo se cierra cuando ha enviado su búfer: si el
+        cliente ha dejado de leer, se aborta pasado PLAZO_CIERRE.
+        """
+        while self.cola and not self.transport.is_closing():
+            self._escribir(self.cola.mensajes.popleft())
+        self.transport.close()
+        if self.transport.get_write_buffer_size():
+            # abort() no hace nada si para entonces ya se ha cerrado
+            asyncio.get_running_loop().call_later(PLAZO_CIERRE, self.transport.abort)
+    
+    def abortar(self):
+        """Cierra la conexión sin esperar a enviar lo pendiente (cliente muerto)"""
+        self.transport.abort()
@@ -0,0 +1,324 @@
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from registro import registro
+
+# Cada registro: tipo (1 byte) + longitud de los datos (4 bytes) + datos
+CABECERA = struct.Struct("!BI")
+
+CREAR = 1     # Sala nueva: tamaño, palabras y cartas del mazo
+UNIR = 2      # Un jugador entra en la sala
+SALIR = 3     # Un jugador sale de la sala
+JUGADA = 4    # Jugada aceptada por procesar_jugada
+FIN = 5       # La sala terminó o se eliminó del registro
+ESTADO = 6    # Estado completo de una sala (al compactar el diario)
+CREAR_SEMILLA = 7  # Sala nueva cuyo tablero se regenera con su mazo y su semilla
+SESION = 8    # Token con el que un jugador puede volver a su asiento (REANUDAR)
+
+JUGADA_DATOS = struct.Struct("!HHHHBI")  # fila1, col1, fila2, col2, acierto, version
+SEMILLA_DATOS = struct.Struct("!IQ")      # huella del mazo, semilla
+INTERVALO_FSYNC = 0.05  # Segundos que se agrupan las escrituras antes de cada fsync
+
+def _texto(texto):
+    datos = texto.encode()
+    return struct.pack("!H", len(datos)) + datos
+
+def _leer_texto(datos, posicion):
+    longitud, = struct.unpack_from("!H", datos, posicion)
+    posicion += 2
+    return datos[posicion:posicion + longitud].decode(), posicion + longitud
+
+def _cartas_a_bytes(cartas):
+    # Siempre en orden de red para que el diario no dependa de la máquina
+    if sys.byteorder == "little":
+        cartas = array("H", cartas)
+        cartas.byteswap()
+    return cartas.tobytes()
+
+def _cartas_desde_bytes(datos):
+    cartas = array("H")
+    cartas.frombytes(datos)
+    if sys.byteorder == "little":
+        cartas.byteswap()
+    return cartas
+
+def _registro(tipo, datos):
+    return CABECERA.pack(tipo, len(datos)) + datos
+
+class PartidaRecuperada:
+    """Estado de una sala reconstruido a partir del diario.
+    
+    Las salas con semilla no guardan palabras ni cartas (None): el tablero
+    se regenera con el mazo y la semilla, si el mazo tiene la misma huella.
+    Los jugadores entran al orden de turnos por el final, así que el orden
+    de las puntuaciones (el de los registros UNIR) es el orden de turnos.
+    """
+    __slots__ = ("id_sala", "dificultad", "filas", "columnas", "palabras", "cartas", "mazo", "huella", "semilla",
+                 "destapadas", "casillas_destapadas", "puntuaciones", "tokens", "version")
+    
+    def __init__(self, id_sala, dificultad, filas, columnas, palabras, cartas, mazo=None, huella=None, semilla=None):
+        self.id_sala = id_sala
+        self.dificultad = dificultad
+        self.filas = filas
+        self.columnas = columnas
+        self.palabras = palabras
+        self.cartas = cartas
+        self.mazo = mazo
+        self.huella = huella
+        self.semilla = semilla
+        self.destapadas = bytearray((filas * columnas + 7) // 8)
+        self.casillas_destapadas = 0
+        self.puntuaciones = {}  # En el orden de turnos
+        self.tokens = {}  # diccionario {addr_str: token} de los jugadores con sesión
+        self.version = 0
+        # Las casillas vacías (tableros impares) cuentan como destapadas
+        for indice in self.vacias():
+            self.destapadas[indice >> 3] |= 1 << (indice & 7)
+    
+    def vacias(self):
+        """Índices de las casillas sin carta"""
+        if self.cartas is None:
+            # Un tablero repartido tiene como mucho una, siempre la última
+            total = self.filas * self.columnas
+            return [total - 1] if total % 2 else []
+        return [indice for indice, carta in enumerate(self.cartas) if carta == 0]
+    
+    def quitar_sin_sesion(self):
+        """Quita a los jugadores sin sesión: vuelven con otra dirección y no pueden reclamar su asiento.
+        
+        Devuelve True si queda algún jugador que pueda volver.
+        """
+        self.puntuaciones = {addr_str: puntos for addr_str, puntos in self.puntuaciones.items()
+                             if addr_str in self.tokens}
+        return bool(self.puntuaciones)
+
+class DiarioPartidas:
+    """Diario binario de solo anexado con las partidas en curso.
+    
+    Registra la creación de cada sala (con su mazo), las entradas y salidas
+    de jugadores, sus sesiones y cada jugada aceptada. Los métodos de registro solo
+    añaden bytes a una lista; un hilo aparte los escribe en bloque y hace
+    un fsync por bloque, así que la ruta de cada jugada nunca espera al
+    disco. Al arrancar, leer() reconstruye las partidas que no terminaron.
+    """
+    
+    def __init__(self, ruta, intervalo_fsync=INTERVALO_FSYNC):
+        self.ruta = ruta
+        self.intervalo_fsync = intervalo_fsync
+        self.pendientes = []
+        self.condicion = threading.Condition()
+        self.cerrando = False
+        self.archivo = None
+        self.hilo = None
+    
+    # -- Escritura -----------------------------------------------------------
+    
+    def abrir(self, partidas=()):
+        """Reescribe el diario con el estado de las partidas dadas y empieza a anexar.
+        
+        Compactar al arrancar evita que el diario crezca sin límite entre
+        reinicios: solo quedan las partidas en curso, una sala por registro.
+        """
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "wb") as archivo:
+            for partida in partidas:
+                if partida.semilla is not None:
+                    archivo.write(self._registro_crear_semilla(partida.id_sala, partida.dificultad, partida.filas,
+                                                               partida.columnas, partida.mazo, partida.huella,
+                                                               partida.semilla))
+                else:
+                    archivo.write(self._registro_crear(partida.id_sala, partida.dificultad, partida.filas,
+                                                       partida.columnas, partida.palabras, partida.cartas))
+                archivo.write(self._registro_estado(partida))
+                for addr_str, token in partida.tokens.items():
+                    archivo.write(self._registro_sesion(partida.id_sala, addr_str, token))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, self.ruta)
+        
+        self.archivo = open(self.ruta, "ab")
+        self.hilo = threading.Thread(target=self._escribir, name="diario", daemon=True)
+        self.hilo.start()
+    
+    def _agregar(self, datos):
+        with self.condicion:
+            if self.cerrando:
+                return  # Lo que ocurra durante el cierre no se anota
+            self.pendientes.append(datos)
+            if len(self.pendientes) == 1:
+                self.condicion.notify()
+    
+    def _escribir(self):
+        while True:
+            with self.condicion:
+                while not self.pendientes and not self.cerrando:
+                    self.condicion.wait()
+                lote, self.pendientes = self.pendientes, []
+                cerrar = self.cerrando
+            if lote:
+                try:
+                    self.archivo.write(b"".join(lote))
+                    self.archivo.flush()
+                    os.fsync(self.archivo.fileno())
+                except OSError as e:
+                    registro.error("diario", "Error al escribir el diario: %s", e)
+            if cerrar:
+                return
+            # Dejar que se junten más registros antes del siguiente fsync
+            time.sleep(self.intervalo_fsync)
+    
+    def cerrar(self):
+        """Escribe lo pendiente y cierra el diario"""
+        if self.hilo is None:
+            return
+        with self.condicion:
+            self.cerrando = True
+            self.condicion.notify()
+        self.hilo.join(5.0)
+        self.archivo.close()
+    
+    @staticmethod
+    def _registro_crear(id_sala, dificultad, filas, columnas, palabras, cartas):
+        datos = [_texto(id_sala), _texto(dificultad), struct.pack("!HHH", filas, columnas, len(palabras))]
+        datos.extend(_texto(palabra) for palabra in palabras)
+        datos.append(_cartas_a_bytes(cartas))
+        return _registro(CREAR, b"".join(datos))
+    
+    @staticmethod
+    def _registro_crear_semilla(id_sala, dificultad, filas, columnas, mazo, huella, semilla):
+        datos = (_texto(id_sala) + _texto(dificultad) + struct.pack("!HH", filas, columnas) + _texto(mazo)
+                 + SEMILLA_DATOS.pack(huella, semilla))
+        return _registro(CREAR_SEMILLA, datos)
+    
+    @staticmethod
+    def _registro_estado(partida):
+        datos = [_texto(partida.id_sala), struct.pack("!IH", partida.version, len(partida.puntuaciones))]
+        for addr_str, puntos in partida.puntuaciones.items():
+            datos.append(_texto(addr_str) + struct.pack("!I", puntos))
+        datos.append(bytes(partida.destapadas))
+        return _registro(ESTADO, b"".join(datos))
+    
+    @staticmethod
+    def _registro_sesion(id_sala, addr_str, token):
+        return _registro(SESION, _texto(id_sala) + _texto(addr_str) + _texto(token))
+    
+    def crear(self, sala):
+        tablero = sala.tablero
+        if tablero.semilla is not None:
+            # Basta con el mazo y la semilla: unos pocos bytes aunque el tablero sea enorme
+            self._agregar(self._registro_crear_semilla(sala.id_sala, sala.dificultad, tablero.filas, tablero.columnas,
+                                                       tablero.mazo.nombre, tablero.mazo.huella, tablero.semilla))
+        else:
+            self._agregar(self._registro_crear(sala.id_sala, sala.dificultad, tablero.filas, tablero.columnas,
+                                               tablero.palabras[1:], tablero.cartas))
+    
+    def unir(self, sala, addr_str):
+        self._agregar(_registro(UNIR, _texto(sala.id_sala) + _texto(addr_str)))
+    
+    def salir(self, sala, addr_str):
+        self._agregar(_registro(SALIR, _texto(sala.id_sala) + _texto(addr_str)))
+    
+    def sesion(self, sala, addr_str, token):
+        self._agregar(self._registro_sesion(sala.id_sala, addr_str, token))
+    
+    def jugada(self, sala, addr_str, fila1, col1, fila2, col2, acierto, version):
+        datos = _texto(sala.id_sala) + _texto(addr_str) + JUGADA_DATOS.pack(fila1, col1, fila2, col2, acierto, version)
+        self._agregar(_registro(JUGADA, datos))
+    
+    def fin(self, sala):
+        self._agregar(_registro(FIN, _texto(sala.id_sala)))
+    
+    # -- Recuperación --------------------------------------------------------
+    
+    def leer(self):
+        """Reproduce el diario y devuelve las partidas sin terminar {id_sala: PartidaRecuperada}.
+        
+        Un registro incompleto al final (el proceso murió a mitad de una
+        escritura) se ignora.
+        """
+        partidas = {}
+        try:
+            with open(self.ruta, "rb") as archivo:
+                datos = archivo.read()
+        except FileNotFoundError:
+            return partidas
+        
+        posicion = 0
+        total = len(datos)
+        while posicion + CABECERA.size <= total:
+            tipo, longitud = CABECERA.unpack_from(datos, posicion)
+            inicio = posicion + CABECERA.size
+            if inicio + longitud > total:
+                registro.aviso("diario", "Registro incompleto al final del diario; se ignora")
+                break
+            posicion = inicio + longitud
+            try:
+                self._aplicar(partidas, tipo, datos[inicio:posicion])
+            except (struct.error, UnicodeDecodeError, IndexError, KeyError) as e:
+                registro.aviso("diario", "Registro del diario dañado (tipo %s): %s", tipo, e)
+        return partidas
+    
+    @staticmethod
+    def _aplicar(partidas, tipo, datos):
+        id_sala, p = _leer_texto(datos, 0)
+        if tipo == CREAR:
+            dificultad, p = _leer_texto(datos, p)
+            filas, columnas, num_palabras = struct.unpack_from("!HHH", datos, p)
+            p += 6
+            palabras = []
+            for _ in range(num_palabras):
+                palabra, p = _leer_texto(datos, p)
+                palabras.append(palabra)
+            partidas[id_sala] = PartidaRecuperada(id_sala, dificultad, filas, columnas, palabras,
+                                                  _cartas_desde_bytes(datos[p:]))
+            return
+        if tipo == CREAR_SEMILLA:
+            dificultad, p = _leer_texto(datos, p)
+            filas, columnas = struct.unpack_from("!HH", datos, p)
+            mazo, p = _leer_texto(datos, p + 4)
+            huella, semilla = SEMILLA_DATOS.unpack_from(datos, p)
+            partidas[id_sala] = PartidaRecuperada(id_sala, dificultad, filas, columnas, None, None,
+                                                  mazo, huella, semilla)
+            return
+        
+        partida = partidas.get(id_sala)
+        if partida is None:
+            return  # Sala creada en un diario anterior a la última compactación
+        if tipo == FIN:
+            del partidas[id_sala]
+        elif tipo == UNIR:
+            addr_str, p = _leer_texto(datos, p)
+            partida.puntuaciones.setdefault(addr_str, 0)
+        elif tipo == SALIR:
+            addr_str, p = _leer_texto(datos, p)
+            partida.puntuaciones.pop(addr_str, None)
+            partida.tokens.pop(addr_str, None)
+        elif tipo == SESION:
+            addr_str, p = _leer_texto(datos, p)
+            token, p = _leer_texto(datos, p)
+            if addr_str in partida.puntuaciones:
+                partida.tokens[addr_str] = token
+        elif tipo == JUGADA:
+            addr_str, p = _leer_texto(datos, p)
+            fila1, col1, fila2, col2, acierto, version = JUGADA_DATOS.unpack_from(datos, p)
+            partida.version = version
+            if acierto:
+                for indice in (fila1 * partida.columnas + col1, fila2 * partida.columnas + col2):
+                    partida.destapadas[indice >> 3] |= 1 << (indice & 7)
+                partida.casillas_destapadas += 2
+                partida.puntuaciones[addr_str] = partida.puntuaciones.get(addr_str, 0) + 1
+        elif tipo == ESTADO:
+            partida.version, num_jugadores = struct.unpack_from("!IH", datos, p)
+            p += 6
+            partida.puntuaciones = {}
+            for _ in range(num_jugadores):
+                addr_str, p = _leer_texto(datos, p)
+                partida.puntuaciones[addr_str], = struct.unpack_from("!I", datos, p)
+                p += 4
+            partida.destapadas = bytearray(datos[p:])
+            vacias = len(partida.vacias())
+            partida.casillas_destapadas = sum(bin(byte).count("1") for byte in partida.destapadas) - vacias
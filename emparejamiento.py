@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import deque
+
+from registro import registro
+from tablero import DIFICULTADES, dimensiones_dificultad
+
+JUGADORES_POR_PARTIDA = 4  # Con tantos jugadores en cola la partida empieza en el momento
+TIEMPO_ESPERA = 10.0       # Segundos de espera máxima; después se juega con los que haya
+
+def clave_dificultad(dificultad):
+    """Nombre único de una dificultad: "1" y "4x4" son la misma cola. None si no es válida"""
+    dimensiones = dimensiones_dificultad(dificultad)
+    if dimensiones is None:
+        return None
+    for nombre, tamano in DIFICULTADES.items():
+        if tamano == dimensiones:
+            return nombre
+    return f"{dimensiones[0]}x{dimensiones[1]}"
+
+class Espera:
+    """Un jugador en la cola de emparejamiento"""
+    __slots__ = ("conn", "cliente_ip", "cliente_puerto", "capacidades", "dificultad", "llegada", "en_cola", "sala")
+    
+    def __init__(self, conn, cliente_ip, cliente_puerto, dificultad, capacidades):
+        self.conn = conn
+        self.cliente_ip = cliente_ip
+        self.cliente_puerto = cliente_puerto
+        self.capacidades = capacidades
+        self.dificultad = dificultad
+        self.llegada = time.monotonic()
+        self.en_cola = True
+        self.sala = None  # Sala asignada al formarse la partida
+
+class ColaDificultad:
+    """Jugadores esperando partida de una misma dificultad, por orden de llegada.
+    
+    Los que se van antes de emparejarse solo se marcan (en_cola = False) y
+    se descartan al llegar al frente, así que añadir, cancelar y sacar
+    son O(1) (amortizado) aunque esperen decenas de miles de jugadores.
+    """
+    __slots__ = ("esperas", "activos", "temporizador")
+    
+    def __init__(self):
+        self.esperas = deque()
+        self.activos = 0
+        self.temporizador = None  # Comprobación del tiempo de espera del primero de la cola
+    
+    def primero(self):
+        while self.esperas and not self.esperas[0].en_cola:
+            self.esperas.popleft()
+        return self.esperas[0] if self.esperas else None
+    
+    def sacar(self, cantidad):
+        grupo = []
+        while len(grupo) < cantidad and self.primero() is not None:
+            espera = self.esperas.popleft()
+            espera.en_cola = False
+            grupo.append(espera)
+        self.activos -= len(grupo)
+        return grupo
+
+class Emparejador:
+    """Sala de espera que agrupa a los jugadores en partidas nuevas.
+    
+    Cada dificultad tiene su propia cola. La partida se forma en cuanto
+    hay jugadores_por_partida esperando, o cuando el primero de la cola
+    lleva tiempo_espera segundos (con los que haya).
+    
+    Al entrar en la cola se llama a avisar(espera, en_cola), antes de que
+    la partida pueda formarse, así que el aviso llega antes que CONFIG.
+    Formar la partida llama a formar(dificultad, grupo), que crea la sala,
+    une a los jugadores y anota la sala en cada Espera. El emparejador solo
+    usa su propio lock, así que nunca bloquea las salas que ya están jugando.
+    """
+    
+    def __init__(self, rueda, formar, avisar=None, jugadores_por_partida=JUGADORES_POR_PARTIDA,
+                 tiempo_espera=TIEMPO_ESPERA):
+        self.rueda = rueda
+        self.formar = formar
+        self.avisar = avisar
+        self.jugadores_por_partida = jugadores_por_partida
+        self.tiempo_espera = tiempo_espera
+        self.colas = {}  # diccionario {dificultad: ColaDificultad}
+        self.lock = threading.Lock()
+    
+    def agregar(self, espera):
+        """Pone al jugador en la cola de su dificultad. Devuelve cuántos esperan en ella (incluido él)"""
+        dificultad = espera.dificultad
+        with self.lock:
+            cola = self.colas.get(dificultad)
+            if cola is None:
+                cola = self.colas[dificultad] = ColaDificultad()
+            cola.esperas.append(espera)
+            cola.activos += 1
+            en_cola = cola.activos
+            if self.avisar is not None:
+                self.avisar(espera, en_cola)
+            if cola.activos >= self.jugadores_por_partida:
+                self._formar(dificultad, cola.sacar(self.jugadores_por_partida))
+            elif cola.temporizador is None:
+                cola.temporizador = self.rueda.programar(self.tiempo_espera, self._vencer, dificultad)
+        return en_cola
+    
+    def cancelar(self, espera):
+        """Quita al jugador de la cola si aún espera.
+        
+        Devuelve la sala que se le asignó si la partida ya se había formado.
+        """
+        with self.lock:
+            if espera.en_cola:
+                espera.en_cola = False
+                self.colas[espera.dificultad].activos -= 1
+            return espera.sala
+    
+    def sala_de(self, espera):
+        """Sala asignada al jugador, o None si aún espera.
+        
+        Toma el lock para ver la sala aunque se acabe de formar en otro hilo.
+        """
+        with self.lock:
+            return espera.sala
+    
+    def esperando(self):
+        with self.lock:
+            return sum(cola.activos for cola in self.colas.values())
+    
+    def _vencer(self, dificultad):
+        """Temporizador de la rueda: forma partidas con los que superaron el tiempo de espera"""
+        with self.lock:
+            cola = self.colas.get(dificultad)
+            if cola is None:
+                return
+            cola.temporizador = None
+            limite = time.monotonic() - self.tiempo_espera
+            primero = cola.primero()
+            while primero is not None and primero.llegada <= limite:
+                self._formar(dificultad, cola.sacar(self.jugadores_por_partida))
+                primero = cola.primero()
+            if primero is None:
+                del self.colas[dificultad]
+            else:
+                restante = primero.llegada + self.tiempo_espera - time.monotonic()
+                cola.temporizador = self.rueda.programar(max(restante, 0), self._vencer, dificultad)
+    
+    def _formar(self, dificultad, grupo):
+        # Bajo el lock del emparejador: un jugador que se va a la vez no queda a medias
+        try:
+            self.formar(dificultad, grupo)
+        except Exception as e:
+            registro.error("emparejamiento", "Error al formar una partida de dificultad %s: %s", dificultad, e)
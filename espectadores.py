@@ -0,0 +1,175 @@
+import threading
+from collections import deque
+
+from registro import registro
+
+class _Union:
+    """Marca en la cola de un canal: el espectador entra en este punto del flujo"""
+    __slots__ = ("addr_str", "conn", "mensajes")
+    
+    def __init__(self, addr_str, conn, mensajes):
+        self.addr_str = addr_str
+        self.conn = conn
+        self.mensajes = mensajes
+
+class _Cierre:
+    """Marca en la cola de un canal: cerrar estas conexiones tras enviar lo anterior"""
+    __slots__ = ("conexiones",)
+    
+    def __init__(self, conexiones):
+        self.conexiones = conexiones
+
+class CanalEspectadores:
+    """Espectadores de una sala: reciben el flujo de la partida pero nunca juegan.
+    
+    publicar() solo encola el mensaje (ya codificado, ver protocolo.Difusion)
+    y avisa al repartidor la primera vez; el envío a cada espectador se hace
+    después, fuera del lock de la sala y sin retrasar la respuesta al
+    jugador. Si la sala no tiene espectadores publicar() no hace nada.
+    """
+    __slots__ = ("conexiones", "pendientes", "lock", "repartidor")
+    
+    def __init__(self, repartidor=None):
+        self.conexiones = {}  # diccionario {addr_str: conn}
+        self.pendientes = []
+        self.lock = threading.Lock()
+        self.repartidor = repartidor
+    
+    def __len__(self):
+        return len(self.conexiones)
+    
+    def agregar(self, addr_str, conn, mensajes):
+        """Añade un espectador que recibirá primero sus mensajes iniciales.
+        
+        Hay que llamarlo con el lock de la sala tomado, justo después de
+        generar el estado inicial: la marca de unión queda en la cola en el
+        mismo punto, así que el espectador no recibe mensajes anteriores a
+        su estado ni se pierde los posteriores.
+        """
+        with self.lock:
+            self.conexiones[addr_str] = conn
+            self.pendientes.append(_Union(addr_str, conn, mensajes))
+            avisar = len(self.pendientes) == 1
+        if avisar:
+            self._avisar()
+    
+    def quitar(self, addr_str):
+        """Quita un espectador. Devuelve False si no lo era"""
+        with self.lock:
+            return self.conexiones.pop(addr_str, None) is not None
+    
+    def publicar(self, mensaje):
+        if not self.conexiones:
+            return
+        with self.lock:
+            self.pendientes.append(mensaje)
+            avisar = len(self.pendientes) == 1
+        if avisar:
+            self._avisar()
+    
+    def cerrar(self, despedida=None):
+        """Envía la despedida a todos los espectadores y cierra sus conexiones"""
+        if despedida is not None:
+            self.publicar(despedida)
+        with self.lock:
+            conexiones = list(self.conexiones.items())
+            self.conexiones.clear()
+            self.pendientes.append(_Cierre(conexiones))
+            avisar = len(self.pendientes) == 1
+        if avisar:
+            self._avisar()
+    
+    def _avisar(self):
+        if self.repartidor is None:
+            self.repartir()
+        else:
+            self.repartidor.programar(self)
+    
+    def repartir(self):
+        """Envía lo pendiente a los espectadores (lo llama el repartidor)"""
+        with self.lock:
+            pendientes, self.pendientes = self.pendientes, []
+            # Los que se unen en este lote no deben recibir lo anterior a su marca;
+            # los de un cierre pendiente aún deben recibir lo anterior al cierre
+            presentes = dict(self.conexiones)
+            uniendose = set()
+            for elemento in pendientes:
+                if isinstance(elemento, _Union):
+                    uniendose.add(elemento.addr_str)
+                elif isinstance(elemento, _Cierre):
+                    presentes.update(elemento.conexiones)
+            destinatarios = {a: c for a, c in presentes.items() if a not in uniendose}
+        fallidos = []
+        for elemento in pendientes:
+            if isinstance(elemento, _Union):
+                if elemento.addr_str not in presentes:
+                    continue  # Se fue antes de recibir nada
+                destinatarios[elemento.addr_str] = elemento.conn
+                mensajes = elemento.mensajes
+                conexiones = ((elemento.addr_str, elemento.conn),)
+            elif isinstance(elemento, _Cierre):
+                for addr_str, conn in elemento.conexiones:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                destinatarios.clear()
+                continue
+            else:
+                mensajes = (elemento,)
+                conexiones = destinatarios.items()
+            for addr_str, conn in conexiones:
+                try:
+                    for mensaje in mensajes:
+                        conn.enviar(mensaje)
+                except Exception:
+                    fallidos.append(addr_str)
+        
+        for addr_str in fallidos:
+            if self.quitar(addr_str):
+                registro.info("espectador", "Espectador %s desconectado (no se le pudo enviar)", addr_str)
+
+class RepartidorEspectadores:
+    """Envía a los espectadores de todas las salas desde fuera de la ruta de las jugadas.
+    
+    En el modo de hilos lo hace un hilo propio; en el modo asyncio se
+    programa en el bucle de eventos para después de atender al jugador. Sin
+    iniciar, cada canal reparte en el momento (útil en pruebas).
+    """
+    
+    def __init__(self):
+        self.canales = deque()
+        self.condicion = threading.Condition(threading.Lock())
+        self.programar = self._repartir_ahora
+        self.hilo = None
+    
+    @staticmethod
+    def _repartir_ahora(canal):
+        canal.repartir()
+    
+    def iniciar_hilo(self):
+        def programar(canal):
+            with self.condicion:
+                self.canales.append(canal)
+                self.condicion.notify()
+        
+        def bucle():
+            while True:
+                with self.condicion:
+                    while not self.canales:
+                        self.condicion.wait()
+                    canal = self.canales.popleft()
+                try:
+                    canal.repartir()
+                except Exception as e:
+                    registro.error("espectador", "Error al repartir a los espectadores: %s", e)
+        
+        self.hilo = threading.Thread(target=bucle, name="espectadores", daemon=True)
+        self.hilo.start()
+        self.programar = programar
+    
+    def iniciar_async(self, loop):
+        def programar(canal):
+            loop.call_soon(canal.repartir)
+        
+        self.programar = programar
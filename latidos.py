@@ -0,0 +1,60 @@
+import time
+
+from metricas import metricas
+from protocolo import Difusion
+from registro import registro
+
+PING = Difusion("PING")  # El mismo para todas las conexiones
+
+class GestorLatidos:
+    """Envía PING a todas las conexiones desde una rueda de temporizadores.
+    
+    Cada conexión tiene su propio temporizador en la rueda, en lugar de un
+    hilo que duerme. Si una conexión deja sin responder maximo_perdidos PING
+    seguidos se aborta. Con cada PONG se actualiza el tiempo de ida y vuelta
+    (rtt) y su media móvil (rtt_medio) de la conexión.
+    """
+    
+    def __init__(self, rueda, intervalo=5.0, maximo_perdidos=3):
+        self.rueda = rueda
+        self.intervalo = intervalo
+        self.maximo_perdidos = maximo_perdidos
+    
+    def registrar(self, conn):
+        # Un jugador que pasa de la sala de espera a su partida ya tenía latido
+        self.cancelar(conn)
+        conn.latido = self.rueda.programar(self.intervalo, self._latido, conn)
+    
+    def cancelar(self, conn):
+        if conn.latido is not None:
+            conn.latido.cancelar()
+            conn.latido = None
+    
+    def _latido(self, conn):
+        if conn.ping_enviado:
+            conn.pings_perdidos += 1
+            if conn.pings_perdidos >= self.maximo_perdidos:
+                registro.aviso("latido", "Cliente sin responder a %s PING seguidos, desconectando", conn.pings_perdidos)
+                metricas.incrementar("latidos_perdidos")
+                conn.latido = None
+                conn.abortar()
+                return
+        
+        conn.ping_enviado = time.monotonic()
+        try:
+            conn.enviar(PING)
+        except Exception:
+            # La conexión ya está cerrada; su manejador la quitará de la sala
+            conn.latido = None
+            return
+        conn.latido = self.rueda.programar(self.intervalo, self._latido, conn)
+    
+    def pong(self, conn):
+        if not conn.ping_enviado:
+            return
+        rtt = time.monotonic() - conn.ping_enviado
+        conn.rtt = rtt
+        metricas.registrar("rtt", rtt)
+        conn.rtt_medio = rtt if conn.rtt_medio is None else 0.875 * conn.rtt_medio + 0.125 * rtt
+        conn.ping_enviado = 0
+        conn.pings_perdidos = 0
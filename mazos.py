@@ -0,0 +1,141 @@
+import os
+import threading
+import zlib
+from array import array
+
+from registro import registro
+
+MAZO_BASICO = "basico"
+PALABRAS_BASICAS = [
+    "árbol", "casa", "perro", "gato", "sol", "luna", "mar", "río",
+    "montaña", "bosque", "nube", "estrella", "flor", "pájaro", "libro", "pluma",
+    "avión", "tren", "camino", "jardín", "fuego", "agua", "tierra", "viento",
+    "puerta", "ventana", "mesa", "silla", "reloj", "lápiz", "papel", "tijera",
+    "manzana", "naranja", "plátano", "uva"
+]
+EXTENSION_MAZO = ".txt"  # Archivos de mazo: una palabra por línea; las que empiezan por # se ignoran
+
+def palabra_valida(palabra):
+    # ":" separa los campos de JUGADA y DELTA; un salto de línea rompería el archivo
+    return bool(palabra) and ":" not in palabra and "\n" not in palabra and "\r" not in palabra
+
+class Mazo:
+    """Lista de palabras guardada de forma compacta, compartida por todas las salas.
+    
+    Las palabras van seguidas en un único texto y un array de 32 bits guarda
+    dónde empieza cada una, así que un mazo de decenas de miles de palabras
+    ocupa unos pocos bytes por palabra (uno por letra si todas son latinas)
+    en lugar de un objeto str cada una; repartir una palabra es cortar el
+    texto. Las palabras repetidas se descartan: dos pares con la misma
+    palabra se confundirían al comparar las cartas.
+    """
+    __slots__ = ("nombre", "texto", "inicios", "huella")
+    
+    def __init__(self, nombre, palabras):
+        validas = [palabra for palabra in dict.fromkeys(palabras) if palabra_valida(palabra)]
+        self.nombre = nombre
+        self.texto = "".join(validas)
+        self.inicios = array("I", [0])
+        posicion = 0
+        for palabra in validas:
+            posicion += len(palabra)
+            self.inicios.append(posicion)
+        # Identifica el contenido: un tablero solo se regenera con el mismo mazo
+        self.huella = zlib.crc32(self.inicios.tobytes(), zlib.crc32(self.texto.encode()))
+    
+    def __len__(self):
+        return len(self.inicios) - 1
+    
+    def palabra(self, indice):
+        return self.texto[self.inicios[indice]:self.inicios[indice + 1]]
+    
+    def repartir(self, num_pares, aleatorio):
+        """Elige las palabras de num_pares pares con el generador dado (random.Random)"""
+        total = len(self)
+        if num_pares <= total:
+            return [self.palabra(indice) for indice in aleatorio.sample(range(total), num_pares)]
+        # No hay palabras suficientes: repetir el mazo numerando cada vuelta, saltando los números
+        # que darían una palabra que ya está en el reparto (un mazo con "sol" y "sol1")
+        palabras = [self.palabra(indice) for indice in range(total)]
+        aleatorio.shuffle(palabras)
+        repartidas = palabras[:]
+        usadas = set(palabras)
+        vueltas = [0] * total
+        for i in range(total, num_pares):
+            palabra = palabras[i % total]
+            numerada = palabra
+            while numerada in usadas:
+                vueltas[i % total] += 1
+                numerada = palabra + str(vueltas[i % total])
+            usadas.add(numerada)
+            repartidas.append(numerada)
+        return repartidas
+
+class CatalogoMazos:
+    """Mazos disponibles por nombre, cargados la primera vez que se usan.
+    
+    Cada mazo se registra con una función que devuelve sus palabras (por
+    ejemplo leyendo un archivo); la carga se hace una sola vez por proceso
+    y el Mazo resultante se comparte entre todas las salas. Un mazo que no
+    se puede cargar se anota en el registro y se trata como inexistente.
+    """
+    
+    def __init__(self):
+        self.cargadores = {}  # diccionario {nombre: función que devuelve las palabras}
+        self.mazos = {}       # diccionario {nombre: Mazo} con los ya cargados
+        self.lock = threading.Lock()
+        self.registrar(MAZO_BASICO, lambda: PALABRAS_BASICAS)
+    
+    def registrar(self, nombre, cargar):
+        with self.lock:
+            self.cargadores[nombre] = cargar
+            self.mazos.pop(nombre, None)
+    
+    def registrar_archivo(self, nombre, ruta):
+        """Registra un mazo que se leerá del archivo indicado al usarlo por primera vez"""
+        def cargar():
+            with open(ruta, encoding="utf-8") as archivo:
+                return [linea.strip() for linea in archivo if not linea.startswith("#")]
+        self.registrar(nombre, cargar)
+    
+    def registrar_directorio(self, ruta):
+        """Registra cada archivo .txt del directorio como un mazo con su nombre. Devuelve los nombres"""
+        nombres = []
+        for archivo in sorted(os.listdir(ruta)):
+            nombre, extension = os.path.splitext(archivo)
+            if extension == EXTENSION_MAZO and palabra_valida(nombre):
+                self.registrar_archivo(nombre, os.path.join(ruta, archivo))
+                nombres.append(nombre)
+        return nombres
+    
+    def nombres(self):
+        with self.lock:
+            return sorted(self.cargadores)
+    
+    def __contains__(self, nombre):
+        return nombre in self.cargadores
+    
+    def obtener(self, nombre):
+        """El mazo con ese nombre (cargándolo si hace falta), o None si no existe o no se pudo cargar"""
+        mazo = self.mazos.get(nombre)
+        if mazo is not None:
+            return mazo
+        with self.lock:
+            mazo = self.mazos.get(nombre)
+            cargar = self.cargadores.get(nombre)
+            if mazo is not None or cargar is None:
+                return mazo
+            try:
+                mazo = Mazo(nombre, cargar())
+            except (OSError, UnicodeDecodeError) as e:
+                registro.error("mazo", "No se pudo cargar el mazo '%s': %s", nombre, e)
+                return None
+            if not mazo:
+                registro.aviso("mazo", "El mazo '%s' no tiene palabras válidas", nombre)
+                return None
+            self.mazos[nombre] = mazo
+        registro.info("mazo", "Mazo '%s' cargado: %s palabras", nombre, len(mazo))
+        return mazo
+
+# Catálogo del proceso: las salas buscan aquí su mazo
+catalogo = CatalogoMazos()
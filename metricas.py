@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import json
+import socket
+import threading
+import time
+
+import protocolo
+
+COMANDO_ESTADISTICAS = "STATS"
+NUM_CUBETAS = 32  # La última cubeta acumula todo lo que supera 2^30 µs
+
+class Histograma:
+    """Histograma de latencias con cubetas logarítmicas.
+    
+    La cubeta i cuenta las muestras de menos de 2^i microsegundos (y al
+    menos 2^(i-1)), así que registrar una muestra solo cuesta un
+    bit_length y una suma. Los percentiles se informan como el límite
+    superior de su cubeta.
+    """
+    __slots__ = ("cubetas", "cuenta", "suma", "maximo")
+    
+    def __init__(self):
+        self.cubetas = [0] * NUM_CUBETAS
+        self.cuenta = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+    
+    def registrar(self, segundos):
+        self.cubetas[min(int(segundos * 1e6).bit_length(), NUM_CUBETAS - 1)] += 1
+        self.cuenta += 1
+        self.suma += segundos
+        if segundos > self.maximo:
+            self.maximo = segundos
+    
+    def percentil(self, p):
+        """Límite superior (en µs) de la cubeta que contiene el percentil p"""
+        objetivo = self.cuenta * p / 100
+        acumulado = 0
+        for i, cantidad in enumerate(self.cubetas):
+            acumulado += cantidad
+            if cantidad and acumulado >= objetivo:
+                return 1 << i
+        return 0
+    
+    def resumen(self):
+        if not self.cuenta:
+            return {"cuenta": 0}
+        return {
+            "cuenta": self.cuenta,
+            "media_us": round(self.suma / self.cuenta * 1e6, 1),
+            "p50_us": self.percentil(50),
+            "p90_us": self.percentil(90),
+            "p99_us": self.percentil(99),
+            "max_us": round(self.maximo * 1e6, 1),
+        }
+
+class Metricas:
+    """Contadores e histogramas del servidor.
+    
+    Se actualizan sin lock para no añadir contención en la ruta de cada
+    jugada: en el modo de hilos se puede perder algún incremento aislado
+    cuando dos hilos coinciden, algo aceptable para estadísticas.
+    """
+    
+    def __init__(self):
+        self.inicio = time.time()
+        self.contadores = dict.fromkeys((
+            "conexiones", "desconexiones", "espectadores", "jugadas", "aciertos",
+            "jugadas_invalidas", "fuera_de_turno", "comandos_desconocidos",
+            "errores_conexion", "latidos_perdidos", "traspasos", "emparejados",
+            "turnos_vencidos", "degradados", "revanchas", "rechazos_capacidad", "rechazos_tasa",
+            "mensajes_limitados", "expulsados", "sesiones_suspendidas", "sesiones_expiradas", "reanudaciones",
+            "reanudaciones_completas", "reanudaciones_fallidas",
+        ), 0)
+        self.histogramas = {nombre: Histograma() for nombre in (
+            "procesar_jugada", "difusion", "espera_lock", "retencion_lock", "rtt",
+        )}
+    
+    def incrementar(self, nombre, cantidad=1):
+        self.contadores[nombre] += cantidad
+    
+    def registrar(self, nombre, segundos):
+        self.histogramas[nombre].registrar(segundos)
+    
+    def instantanea(self, **indicadores):
+        """Copia de todas las métricas, lista para serializar como JSON"""
+        return {
+            "activo_s": round(time.time() - self.inicio, 1),
+            **indicadores,
+            "contadores": dict(self.contadores),
+            "histogramas": {nombre: h.resumen() for nombre, h in self.histogramas.items()},
+        }
+
+metricas = Metricas()  # Compartidas por todas las salas y conexiones del proceso
+
+class CerrojoMedido:
+    """RLock que registra cuánto se espera para tomarlo y cuánto se retiene.
+    
+    Solo se mide la adquisición más externa; las reentradas del mismo hilo
+    no cuentan como espera ni como una retención nueva.
+    """
+    __slots__ = ("_lock", "_profundidad", "_adquirido")
+    
+    # Referencias directas para no buscar los histogramas en cada adquisición
+    _espera = metricas.histogramas["espera_lock"]
+    _retencion = metricas.histogramas["retencion_lock"]
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._profundidad = 0
+        self._adquirido = 0.0
+    
+    def acquire(self, blocking=True, timeout=-1):
+        if self._profundidad and self._lock._is_owned():
+            # Reentrada: no hay espera posible
+            self._lock.acquire()
+            self._profundidad += 1
+            return True
+        inicio = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._adquirido = time.perf_counter()
+        self._espera.registrar(self._adquirido - inicio)
+        self._profundidad = 1
+        return True
+    
+    def release(self):
+        self._profundidad -= 1
+        if not self._profundidad:
+            self._retencion.registrar(time.perf_counter() - self._adquirido)
+        self._lock.release()
+    
+    def _is_owned(self):
+        # Lo usa threading.Condition para comprobar que el hilo tiene el lock
+        return self._lock._is_owned()
+    
+    __enter__ = acquire
+    
+    def __exit__(self, tipo, valor, traza):
+        self.release()
+
+def consultar_estadisticas(host, puerto):
+    """Pide las métricas a un servidor con el comando STATS (solo desde la misma máquina)"""
+    with socket.create_connection((host, puerto)) as sock:
+        sock.sendall(protocolo.codificar_trama(COMANDO_ESTADISTICAS))
+        decodificador = protocolo.DecodificadorTramas()
+        while True:
+            datos = sock.recv(65536)
+            if not datos:
+                raise ConnectionError("El servidor cerró la conexión sin responder")
+            for mensaje in decodificador.alimentar(datos):
+                if mensaje.startswith("STATS:"):
+                    return json.loads(mensaje[len("STATS:"):])
+                if mensaje.startswith("ERROR:"):
+                    raise PermissionError(mensaje[len("ERROR:"):])
+
+if __name__ == "__main__":
+    host = input("Ingrese la dirección IP del servidor (presione Enter para usar 127.0.0.1): ") or "127.0.0.1"
+    try:
+        puerto = int(input("Ingrese el puerto del servidor (presione Enter para usar 65432): ") or "65432")
+    except ValueError:
+        print("Puerto inválido. Usando 65432.")
+        puerto = 65432
+    print(json.dumps(consultar_estadisticas(host, puerto), indent=2, ensure_ascii=False))
@@ -0,0 +1,38 @@
+import time
+
+PLAZO_TURNO = 0.0           # Segundos por defecto para jugar cada turno (0: sin límite; se activa al configurarlo)
+MAXIMO_TURNOS_VENCIDOS = 3  # Turnos seguidos agotados antes de pasar al jugador a espectador
+
+class PlazosTurno:
+    """Plazo máximo de cada turno, vigilado desde la rueda de temporizadores compartida.
+    
+    Cada sala tiene como mucho un temporizador en la rueda, en lugar de un
+    hilo por sala. Dar el turno o aceptar una jugada solo adelanta
+    sala.limite_turno, sin tocar la rueda; si el temporizador vence antes
+    del límite se vuelve a programar para lo que falta, y si el límite ya
+    pasó la sala salta el turno (Sala.vencer_turno). Con degradar, el
+    jugador que agota maximo_vencidos turnos seguidos pasa a espectador.
+    """
+    
+    def __init__(self, rueda, plazo=PLAZO_TURNO, maximo_vencidos=MAXIMO_TURNOS_VENCIDOS, degradar=False):
+        self.rueda = rueda
+        self.plazo = plazo
+        self.maximo_vencidos = maximo_vencidos
+        self.degradar = degradar
+    
+    def plazo_de(self, sala):
+        """Segundos por turno de la sala: el suyo propio o el del servidor"""
+        return self.plazo if sala.plazo_turno is None else sala.plazo_turno
+    
+    def renovar(self, sala):
+        """Empieza a contar el plazo del turno actual (hay que tener el lock de la sala)"""
+        plazo = self.plazo_de(sala)
+        if not plazo or sala.turno_actual is None:
+            return
+        sala.limite_turno = time.monotonic() + plazo
+        if sala.temporizador_turno is None:
+            self.programar(sala, plazo)
+    
+    def programar(self, sala, retraso):
+        """Programa la comprobación del plazo de la sala (hay que tener su lock)"""
+        sala.temporizador_turno = self.rueda.programar(retraso, sala.vencer_turno, self)
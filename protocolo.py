@@ -0,0 +1,85 @@
+import struct
+
+# Protocolo con tramas: cada mensaje va precedido de su longitud en bytes
+# (4 bytes, big-endian). Los mensajes de texto del protocolo original nunca
+# empiezan por el byte 0, así que el servidor reconoce el modo de cada
+# cliente por el primer byte que recibe.
+CABECERA = struct.Struct("!I")
+TAMANO_MAXIMO_TRAMA = 16 * 1024 * 1024
+
+def es_inicio_de_trama(datos):
+    """Indica si los primeros bytes recibidos de un cliente son una trama"""
+    return len(datos) > 0 and datos[0] == 0
+
+def codificar_trama(mensaje):
+    datos = mensaje.encode()
+    return CABECERA.pack(len(datos)) + datos
+
+class Difusion:
+    """Mensaje que se envía a muchas conexiones, codificado una sola vez.
+    
+    Guarda los bytes de las dos formas del protocolo (con y sin trama) y
+    todas las conexiones reutilizan los mismos objetos inmutables, en lugar
+    de codificar el texto una vez por destinatario.
+    """
+    __slots__ = ("texto", "crudo", "trama")
+    
+    def __init__(self, texto):
+        self.texto = texto
+        self.crudo = texto.encode()
+        self.trama = CABECERA.pack(len(self.crudo)) + self.crudo
+    
+    def startswith(self, prefijo):
+        return self.texto.startswith(prefijo)
+    
+    def __str__(self):
+        return self.texto
+
+def codificar(mensaje, tramas):
+    """Codifica un mensaje según el modo de la conexión"""
+    if type(mensaje) is Difusion:
+        return mensaje.trama if tramas else mensaje.crudo
+    if tramas:
+        return codificar_trama(mensaje)
+    return mensaje.encode()
+
+class DecodificadorTramas:
+    """Decodificador incremental de tramas con prefijo de longitud.
+    
+    Acepta lecturas parciales (una trama repartida en varios recv) y
+    lecturas unidas (varias tramas en un solo recv).
+    """
+    __slots__ = ("buffer", "tamano_maximo")
+    
+    def __init__(self, tamano_maximo=TAMANO_MAXIMO_TRAMA):
+        self.buffer = bytearray()
+        self.tamano_maximo = tamano_maximo
+    
+    def alimentar(self, datos):
+        """Añade los bytes recibidos y devuelve la lista de mensajes completos"""
+        buffer = self.buffer
+        buffer += datos
+        mensajes = []
+        inicio = 0
+        total = len(buffer)
+        
+        while total - inicio >= CABECERA.size:
+            (longitud,) = CABECERA.unpack_from(buffer, inicio)
+            if longitud > self.tamano_maximo:
+                raise ValueError(f"Trama demasiado grande ({longitud} bytes)")
+            fin = inicio + CABECERA.size + longitud
+            if fin > total:
+                break  # Trama incompleta, esperar más datos
+            mensajes.append(buffer[inicio + CABECERA.size:fin].decode())
+            inicio = fin
+        
+        if inicio:
+            del buffer[:inicio]
+        return mensajes
+
+class DecodificadorCrudo:
+    """Protocolo original sin tramas: cada recv se trata como un mensaje"""
+    __slots__ = ()
+    
+    def alimentar(self, datos):
+        return [datos.decode()] if datos else []
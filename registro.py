@@ -0,0 +1,167 @@
+import os
+import queue
+import sys
+import threading
+import time
+
+# Niveles de registro
+DEBUG = 10
+INFO = 20
+AVISO = 30
+ERROR = 40
+NOMBRES_NIVEL = {DEBUG: "DEBUG", INFO: "INFO", AVISO: "AVISO", ERROR: "ERROR"}
+NIVELES = {nombre: nivel for nivel, nombre in NOMBRES_NIVEL.items()}
+
+MAXIMO_POR_SEGUNDO = 100     # Registros por segundo y categoría antes de omitirlos
+MAXIMO_PENDIENTES = 10000    # Registros en cola antes de omitir los que no son avisos o errores
+
+class Registro:
+    """Registro asíncrono por niveles y categorías.
+    
+    La ruta caliente solo compara el nivel, aplica el límite de su categoría
+    y encola una tupla; formatear el texto (incluido el volcado de tableros)
+    y escribirlo en la consola lo hace un hilo aparte, que junta todo lo
+    pendiente en una sola escritura. Los avisos y errores nunca se omiten
+    por el límite de frecuencia.
+    
+    El mensaje puede ser un texto con marcadores %s o una función; los
+    argumentos se aplican en el hilo de escritura, para no construir textos
+    (sobre todo los grandes) en la ruta caliente.
+    """
+    
+    def __init__(self, nivel=INFO, maximo_por_segundo=MAXIMO_POR_SEGUNDO):
+        self.nivel = nivel
+        self.maximo_por_segundo = maximo_por_segundo
+        self.volcar_tablero = False  # Mostrar el tablero completo tras cada jugada
+        self.cola = queue.SimpleQueue()
+        self.limites = {}            # {categoria: [fichas, ultimo_instante, omitidos]}
+        self.omitidos_cola = 0
+        self.lock = threading.Lock()
+        self.hilo = None
+    
+    def configurar(self, nivel=None, maximo_por_segundo=None, volcar_tablero=None):
+        if nivel is not None:
+            self.nivel = nivel
+        if maximo_por_segundo is not None:
+            self.maximo_por_segundo = maximo_por_segundo
+        if volcar_tablero is not None:
+            self.volcar_tablero = volcar_tablero
+    
+    def habilitado(self, nivel):
+        return nivel >= self.nivel
+    
+    def registrar(self, nivel, categoria, mensaje, *args):
+        if nivel < self.nivel:
+            return
+        omitidos = 0
+        if nivel < AVISO:
+            omitidos = self._permitir(categoria)
+            if omitidos < 0:
+                return
+            if self.cola.qsize() >= MAXIMO_PENDIENTES:
+                self.omitidos_cola += 1
+                return
+        if self.hilo is None:
+            self.iniciar()
+        self.cola.put((time.time(), nivel, categoria, omitidos, mensaje, args))
+    
+    def debug(self, categoria, mensaje, *args):
+        self.registrar(DEBUG, categoria, mensaje, *args)
+    
+    def info(self, categoria, mensaje, *args):
+        self.registrar(INFO, categoria, mensaje, *args)
+    
+    def aviso(self, categoria, mensaje, *args):
+        self.registrar(AVISO, categoria, mensaje, *args)
+    
+    def error(self, categoria, mensaje, *args):
+        self.registrar(ERROR, categoria, mensaje, *args)
+    
+    def _permitir(self, categoria):
+        """Cubeta de fichas por categoría.
+        
+        Devuelve -1 si el registro se omite, o cuántos se omitieron desde
+        el último que pasó para indicarlo en este. No usa lock: en el modo
+        de hilos el límite es aproximado.
+        """
+        ahora = time.monotonic()
+        limite = self.limites.get(categoria)
+        if limite is None:
+            limite = self.limites[categoria] = [self.maximo_por_segundo, ahora, 0]
+        fichas = min(self.maximo_por_segundo, limite[0] + (ahora - limite[1]) * self.maximo_por_segundo)
+        limite[1] = ahora
+        if fichas < 1:
+            limite[0] = fichas
+            limite[2] += 1
+            return -1
+        limite[0] = fichas - 1
+        omitidos = limite[2]
+        limite[2] = 0
+        return omitidos
+    
+    def iniciar(self):
+        with self.lock:
+            if self.hilo is None:
+                self.hilo = threading.Thread(target=self._escribir, name="registro", daemon=True)
+                self.hilo.start()
+    
+    def reiniciar_tras_fork(self):
+        """En un proceso hijo el hilo de escritura no existe: empezar con una cola nueva"""
+        self.cola = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.hilo = None
+    
+    def vaciar(self):
+        """Espera a que se escriba todo lo encolado (por ejemplo al cerrar el servidor)"""
+        if self.hilo is None:
+            return
+        listo = threading.Event()
+        self.cola.put(listo)
+        listo.wait(2.0)
+    
+    def _escribir(self):
+        while True:
+            lote = [self.cola.get()]
+            try:
+                while len(lote) < 1000:
+                    lote.append(self.cola.get_nowait())
+            except queue.Empty:
+                pass
+            
+            lineas = []
+            listos = []
+            for registro in lote:
+                if isinstance(registro, threading.Event):
+                    listos.append(registro)
+                    continue
+                try:
+                    lineas.append(self._formatear(*registro))
+                except Exception as e:
+                    lineas.append(f"Error al formatear un registro: {e}")
+            if self.omitidos_cola:
+                lineas.append(f"({self.omitidos_cola} registros omitidos: la consola no da abasto)")
+                self.omitidos_cola = 0
+            
+            if lineas:
+                try:
+                    sys.stdout.write("\n".join(lineas) + "\n")
+                    sys.stdout.flush()
+                except Exception:
+                    pass
+            for listo in listos:
+                listo.set()
+    
+    @staticmethod
+    def _formatear(instante, nivel, categoria, omitidos, mensaje, args):
+        if callable(mensaje):
+            texto = mensaje(*args)
+        else:
+            texto = mensaje % args if args else mensaje
+        hora = time.strftime("%H:%M:%S", time.localtime(instante))
+        linea = f"{hora}.{int(instante * 1000) % 1000:03d} {NOMBRES_NIVEL[nivel]:5} [{categoria}] {texto}"
+        if omitidos:
+            linea += f" ({omitidos} registros de '{categoria}' omitidos)"
+        return linea
+
+registro = Registro()  # Compartido por todos los módulos del servidor
+os.register_at_fork(after_in_child=registro.reiniciar_tras_fork)
@@ -0,0 +1,1093 @@
+import threading
+import time
+import json
+from collections import deque
+from itertools import islice
+
+from clasificacion import Clasificacion
+from espectadores import CanalEspectadores
+from mazos import MAZO_BASICO, catalogo
+from metricas import CerrojoMedido, metricas
+from protocolo import Difusion
+from registro import registro
+from sesiones import nuevo_token
+from tablero import Tablero, dimensiones_dificultad
+
+SALA_PRINCIPAL = "principal"
+MAXIMO_CASILLAS_IMPRESION = 144  # Tableros mayores se resumen en una línea en el volcado
+MAXIMO_JUGADORES_IMPRESION = 20  # Con más jugadores el registro solo muestra los mejores
+MINIMO_CAMBIOS_PUNTUACIONES = 64  # Cambios de puntuación compartidos antes de copiar la base
+VENTANA_REVANCHA = 15.0  # Segundos para aceptar la revancha al terminar una partida (0: sin revancha)
+
+def formatear_tablero(id_sala, tablero, destapadas, puntuaciones, total_jugadores, latencias, turno_actual, orden_turnos):
+    """Texto del volcado de un tablero a partir de una copia de su estado"""
+    lineas = []
+    if tablero.filas * tablero.columnas > MAXIMO_CASILLAS_IMPRESION:
+        casillas = sum(bin(byte).count("1") for byte in destapadas)
+        lineas.append(f"Sala '{id_sala}' - Tablero de {tablero.filas}x{tablero.columnas}: "
+                      f"{casillas} casillas destapadas o vacías de {tablero.filas * tablero.columnas}")
+    else:
+        encabezado = "  " + "".join(f" {j} " for j in range(tablero.columnas))
+        lineas.append(f"Sala '{id_sala}' - Tablero del servidor (todas las casillas):")
+        lineas.append(encabezado)
+        for i in range(tablero.filas):
+            celdas = (f"[{tablero.palabra(i * tablero.columnas + j)[:3]:3}]" for j in range(tablero.columnas))
+            lineas.append(f"{i} " + "".join(celdas))
+        
+        lineas.append("Tablero visible para los jugadores:")
+        lineas.append(encabezado)
+        for i in range(tablero.filas):
+            celdas = []
+            for j in range(tablero.columnas):
+                indice = i * tablero.columnas + j
+                if destapadas[indice >> 3] & (1 << (indice & 7)):
+                    celdas.append(f"[{tablero.palabra(indice)[:3]:3}]")
+                else:
+                    celdas.append("[?  ]")
+            lineas.append(f"{i} " + "".join(celdas))
+    
+    if len(puntuaciones) < total_jugadores:
+        lineas.append(f"Puntuaciones (los {len(puntuaciones)} mejores de {total_jugadores} jugadores):")
+    else:
+        lineas.append("Puntuaciones:")
+    for addr_str, puntos in puntuaciones.items():
+        if latencias.get(addr_str) is not None:
+            lineas.append(f"Jugador {addr_str}: {puntos} puntos (latencia {latencias[addr_str] * 1000:.1f} ms)")
+        else:
+            lineas.append(f"Jugador {addr_str}: {puntos} puntos")
+    if turno_actual:
+        lineas.append(f"Turno actual: {turno_actual}")
+    if len(orden_turnos) <= MAXIMO_JUGADORES_IMPRESION:
+        lineas.append(f"Orden de turnos: {orden_turnos}")
+    return "\n".join(lineas)
+
+class PuntuacionesInstantanea:
+    """Puntuaciones de una instantánea, compartidas con las siguientes (copia al escribir).
+    
+    Un acierto solo cambia la puntuación de un jugador: en vez de copiar
+    todas en cada jugada, las instantáneas comparten una base que no se
+    modifica y un registro de cambios al que solo se añade al final; cada
+    una sabe cuántos cambios le corresponden. El diccionario completo se
+    construye la primera vez que se pide. Cuando el registro llega al
+    tamaño de la base se empieza otra base, así que publicar un acierto
+    cuesta O(1) amortizado.
+    """
+    __slots__ = ("base", "cambios", "hasta", "_completas")
+    
+    def __init__(self, base, cambios=None, hasta=0):
+        self.base = base  # diccionario {addr_str: puntos} (no se modifica)
+        self.cambios = [] if cambios is None else cambios  # [(addr_str, puntos)], compartida entre instantáneas
+        self.hasta = hasta  # Cambios del registro que corresponden a esta instantánea
+        self._completas = base if hasta == 0 else None
+    
+    def __len__(self):
+        # Los jugadores solo entran o salen con una base nueva
+        return len(self.base)
+    
+    def con_cambio(self, addr_str, puntos):
+        """Puntuaciones siguientes con la de un jugador cambiada (hay que tener el lock de la sala)"""
+        if len(self.cambios) >= max(len(self.base), MINIMO_CAMBIOS_PUNTUACIONES):
+            base = dict(self.completas())
+            base[addr_str] = puntos
+            return PuntuacionesInstantanea(base)
+        # Solo la última instantánea publicada añade cambios: las anteriores no ven los nuevos
+        self.cambios.append((addr_str, puntos))
+        return PuntuacionesInstantanea(self.base, self.cambios, len(self.cambios))
+    
+    def completas(self):
+        """Diccionario {addr_str: puntos} de esta instantánea (no se modifica)"""
+        if self._completas is None:
+            puntuaciones = dict(self.base)
+            for addr_str, puntos in islice(self.cambios, self.hasta):
+                puntuaciones[addr_str] = puntos
+            self._completas = puntuaciones
+        return self._completas
+
+class InstantaneaSala:
+    """Copia inmutable del estado de una sala, para leerla sin tomar el lock.
+    
+    Cada cambio de estado publica una instantánea nueva con una sola
+    asignación, así que quien la lea ve siempre el tablero, las puntuaciones
+    y el turno de una misma versión. Nadie la modifica después de
+    publicarla; el JSON se genera la primera vez que se pide y se reutiliza
+    hasta la siguiente versión.
+    """
+    __slots__ = ("version", "partida", "juego_activo", "turno_actual", "tablero", "destapadas", "puntuaciones",
+                 "lider", "empate", "conexiones", "puntos_jugador", "_tablero_json", "_puntuaciones_json")
+    
+    def __init__(self, version, partida, juego_activo, turno_actual, tablero, destapadas, puntuaciones, lider, empate, conexiones,
+                 puntos_jugador=0):
+        self.version = version
+        self.partida = partida            # La versión vuelve a 0 en cada revancha; la partida no
+        self.juego_activo = juego_activo
+        self.turno_actual = turno_actual
+        self.tablero = tablero            # Solo se leen sus cartas y palabras, que no cambian
+        self.destapadas = destapadas      # bytes
+        self.puntuaciones = puntuaciones  # PuntuacionesInstantanea
+        self.lider = lider                # (addr_str, puntos) del primero en la puntuación más alta
+        self.empate = empate              # Más de un jugador con la puntuación más alta
+        self.conexiones = conexiones      # diccionario {addr_str: conn} (no se modifica)
+        self.puntos_jugador = puntos_jugador  # Puntuación de quien hizo la jugada de esta versión
+        self._tablero_json = None
+        self._puntuaciones_json = None
+    
+    def tablero_json(self):
+        if self._tablero_json is None:
+            self._tablero_json = json.dumps(self.tablero.visible(self.destapadas))
+        return self._tablero_json
+    
+    def puntuaciones_json(self):
+        if self._puntuaciones_json is None:
+            self._puntuaciones_json = json.dumps(self.puntuaciones.completas())
+        return self._puntuaciones_json
+
+class Sala:
+    """Estado completo de una partida independiente.
+    
+    Cada sala tiene su propio tablero, puntuaciones, orden de turnos y
+    dificultad, protegidos por su propio lock, de modo que un mismo proceso
+    puede alojar muchas partidas a la vez. El lock solo se toma para
+    modificar el estado: cada cambio publica una InstantaneaSala que los
+    lectores (estado, puntuaciones, difusiones) usan sin lock, y los
+    mensajes se envían después de soltarlo.
+    """
+    
+    def __init__(self, id_sala, dificultad="1", mazo=MAZO_BASICO, semilla=None):
+        if dimensiones_dificultad(dificultad) is None:
+            dificultad = "1"
+        
+        self.id_sala = id_sala
+        self.lock = CerrojoMedido()  # Para proteger acceso concurrente (mide espera y retención)
+        self.conexiones_clientes = {}  # diccionario {addr_str: conn}
+        self.clasificacion = Clasificacion()  # Puntuaciones ordenadas: líder, empate y mejores sin recorrerlas
+        self.puntuaciones = self.clasificacion.puntos  # diccionario {addr_str: puntos} (solo lectura)
+        
+        # Variables del juego
+        self.dificultad = dificultad
+        self.filas, self.columnas = dimensiones_dificultad(dificultad)
+        self.mazo = mazo  # Nombre del mazo del que se reparten las palabras
+        self.tablero = None
+        self.tiempo_inicio = time.time()
+        self.juego_activo = True
+        self.version = 0  # Aumenta con cada jugada aceptada
+        self.partida = 0  # Número de partida en la sala: aumenta con cada revancha
+        self.diario = None  # DiarioPartidas donde se anotan las jugadas, si está activado
+        self.espectadores = CanalEspectadores()  # Reciben la partida sin entrar en los turnos
+        
+        # Variables para control de turnos
+        self.turno_actual = None  # Almacena el cliente que tiene el turno actualmente
+        # Orden de turnos como anillo: avanzar y quitar a un jugador es O(1)
+        self.turno_siguiente = {}  # diccionario {addr_str: addr_str del siguiente}
+        self.turno_anterior = {}   # diccionario {addr_str: addr_str del anterior}
+        self.primero_turno = None  # Primero del orden; los nuevos jugadores entran justo antes
+        self.plazos = None  # PlazosTurno del servidor (None: los turnos no tienen límite de tiempo)
+        self.plazo_turno = None  # Segundos por turno de esta sala (None: los del servidor, 0: sin límite)
+        self.limite_turno = 0.0  # Instante (time.monotonic) en que vence el turno actual
+        self.temporizador_turno = None  # Comprobación del plazo en la rueda de temporizadores
+        self.turnos_vencidos = {}  # Turnos seguidos agotados sin jugar {addr_str: cantidad}
+        self.condiciones_clientes = {}  # Condiciones para cada cliente {addr_str: threading.Condition()}
+        self.instantanea = None  # InstantaneaSala con el último estado publicado
+        
+        # Revancha: al terminar, los jugadores pueden quedarse a otra partida en la misma sala
+        self.ventana_revancha = 0  # Segundos para aceptarla (0: la sala se cierra al terminar)
+        self.en_revancha = False   # La partida terminó y se esperan las respuestas
+        self.revancha_pendientes = {}  # Jugadores que aún no han respondido {addr_str: conn}
+        self.revancha_aceptados = {}   # Jugadores que se quedan, en el orden de turnos {addr_str: conn}
+        self.revancha_despedidos = set()  # Jugadores de la partida anterior que no se quedaron
+        self.temporizador_revancha = None  # Cierre de la ventana en la rueda de temporizadores
+        
+        # Sesiones: el asiento de quien pierde la conexión se guarda durante la gracia
+        self.sesiones = None  # GestorSesiones del servidor (None: no se guardan asientos)
+        self.tokens = {}      # diccionario {addr_str: token} de los jugadores con sesión
+        self.asientos = {}    # diccionario {token: addr_str}
+        self.ausentes = {}    # Jugadores sin conexión con el asiento guardado {addr_str: temporizador}
+        self.historial = deque()  # Últimas jugadas enviadas [(versión, DELTA)], para reenviarlas al reanudar
+        self.version_difundida = 0  # Versión de la última jugada del historial
+        self.lock_historial = threading.Lock()  # Historial y conexiones a las que se envía cada jugada
+        
+        self.inicializar_tablero(semilla)
+    
+    def inicializar_tablero(self, semilla=None):
+        """Reparte un tablero con el mazo de la sala; con la misma semilla sale el mismo tablero"""
+        mazo = self._cargar_mazo()
+        with self.lock:
+            self.tablero = Tablero(self.filas, self.columnas, mazo, semilla)
+            self.publicar(tablero=True, jugadores=True)
+    
+    def _cargar_mazo(self):
+        """Mazo de la sala, o el básico si no está disponible (se llama sin el lock)"""
+        # El mazo se carga (la primera vez) fuera del lock de la sala
+        mazo = catalogo.obtener(self.mazo)
+        if mazo is None:
+            registro.aviso("sala", "Mazo '%s' no disponible en la sala '%s'; se usa '%s'",
+                           self.mazo, self.id_sala, MAZO_BASICO)
+            self.mazo = MAZO_BASICO
+            mazo = catalogo.obtener(MAZO_BASICO)
+        return mazo
+    
+    def publicar(self, tablero=False, puntuaciones=False, jugadores=False, jugador=None):
+        """Publica una instantánea con el estado actual (hay que tener el lock).
+        
+        Solo se copia lo que cambió: el mapa de casillas con tablero, las
+        puntuaciones (y el líder) con puntuaciones y además las conexiones
+        con jugadores. El resto se comparte con la anterior. Si se indica
+        el jugador que acaba de jugar, con puntuaciones solo cambió la suya
+        y se comparten las demás (PuntuacionesInstantanea).
+        """
+        anterior = self.instantanea
+        if anterior is None:
+            tablero = jugadores = True
+        if jugadores:
+            puntuaciones = True
+        
+        if not puntuaciones:
+            nuevas = anterior.puntuaciones
+        elif jugador is None or jugadores:
+            nuevas = PuntuacionesInstantanea(dict(self.puntuaciones))
+        else:
+            nuevas = anterior.puntuaciones.con_cambio(jugador, self.puntuaciones[jugador])
+        self.instantanea = InstantaneaSala(
+            self.version, self.partida, self.juego_activo, self.turno_actual, self.tablero,
+            bytes(self.tablero.destapadas) if tablero else anterior.destapadas,
+            nuevas,
+            self.clasificacion.lider() if puntuaciones else anterior.lider,
+            self.clasificacion.empate() if puntuaciones else anterior.empate,
+            dict(self.conexiones_clientes) if jugadores else anterior.conexiones,
+            self.puntuaciones.get(jugador, 0) if jugador is not None else 0,
+        )
+        # El JSON de lo que no cambió sigue valiendo
+        if not tablero:
+            self.instantanea._tablero_json = anterior._tablero_json
+        if not puntuaciones:
+            self.instantanea._puntuaciones_json = anterior._puntuaciones_json
+    
+    def mensaje_config(self):
+        return f"CONFIG:{self.dificultad}:{self.filas}:{self.columnas}"
+    
+    def imprimir_tablero_servidor(self):
+        """Registra el tablero completo con todas las casillas (solo para el servidor).
+        
+        Se usa la última instantánea; el texto lo compone el hilo del
+        registro. Está desactivado salvo que se active el volcado de tableros.
+        """
+        if not registro.volcar_tablero:
+            return
+        estado = self.instantanea
+        latencias = {addr_str: conn.rtt_medio for addr_str, conn in estado.conexiones.items()}
+        registro.info("tablero", formatear_tablero, self.id_sala, estado.tablero, estado.destapadas,
+                      self.puntuaciones_a_mostrar(), len(estado.puntuaciones), latencias, estado.turno_actual,
+                      list(estado.conexiones))
+    
+    def mejores(self, cantidad):
+        """Los mejores jugadores [(addr_str, puntos)], de mayor a menor puntuación"""
+        with self.lock:
+            return self.clasificacion.mejores(cantidad)
+    
+    def puntuaciones_a_mostrar(self):
+        """Puntuaciones para el registro: todas, o solo las mejores en las partidas masivas"""
+        puntuaciones = self.instantanea.puntuaciones
+        if len(puntuaciones) <= MAXIMO_JUGADORES_IMPRESION:
+            return puntuaciones.completas()
+        return dict(self.mejores(MAXIMO_JUGADORES_IMPRESION))
+    
+    def procesar_jugada(self, fila1, col1, fila2, col2, cliente_ip, cliente_puerto):
+        with self.lock:
+            # Convertir dirección a string
+            cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
+            
+            # Verificar si el juego sigue activo
+            if not self.juego_activo:
+                return False, "El juego ha terminado", None, None
+            
+            # El turno se comprueba antes sin lock; aquí se confirma por si cambió entre medias
+            if self.turno_actual != cliente_addr_str:
+                return False, "No es tu turno", None, None
+            
+            # Verificar si las coordenadas son válidas
+            tablero = self.tablero
+            indice1 = tablero.indice(fila1, col1)
+            indice2 = tablero.indice(fila2, col2)
+            if indice1 < 0 or indice2 < 0:
+                return False, "Coordenadas inválidas", None, None
+            if indice1 == indice2:
+                return False, "No se puede seleccionar la misma casilla dos veces", None, None
+            
+            # Verificar si las casillas ya están destapadas
+            if tablero.esta_destapada(indice1) or tablero.esta_destapada(indice2):
+                return False, "Casilla(s) ya destapada(s)", None, None
+            
+            # Obtener el contenido de las casillas
+            contenido1 = tablero.palabra(indice1)
+            contenido2 = tablero.palabra(indice2)
+            
+            # Verificar si las cartas son del mismo par (por id: dos pares nunca comparten id)
+            acierto = tablero.cartas[indice1] == tablero.cartas[indice2]
+            self.version += 1
+            if self.diario is not None:
+                # Solo se encola: el hilo del diario escribe y hace fsync por bloques
+                self.diario.jugada(self, cliente_addr_str, fila1, col1, fila2, col2, acierto, self.version)
+            
+            # Actualizar el tablero visible permanentemente si hay acierto
+            if acierto:
+                tablero.destapar_par(indice1, indice2)
+                # Sumar punto al cliente (la clasificación se actualiza en O(1))
+                self.clasificacion.sumar(cliente_addr_str)
+                
+                # Verificar si el juego ha terminado
+                if tablero.completo():
+                    self.juego_activo = False
+                    # Ya aquí, para que las conexiones no se cierren antes de ofrecer la revancha
+                    self.en_revancha = self.ventana_revancha > 0
+            
+            # Ha jugado: deja de contar como ausente y su plazo vuelve a empezar
+            self.turnos_vencidos.pop(cliente_addr_str, None)
+            self._renovar_plazo()
+            
+            # Un fallo solo cambia la versión: no se copia nada más
+            self.publicar(tablero=acierto, puntuaciones=acierto, jugador=cliente_addr_str)
+            # La instantánea de esta jugada, para difundirla después sin el lock
+            return acierto, contenido1, contenido2, self.instantanea
+    
+    def cambiar_turno(self, mantener_turno=False):
+        with self.lock:
+            turno = self._siguiente_turno(mantener_turno)
+        
+        # Notificar a todos los clientes sobre el cambio (ya sin el lock)
+        if turno is not None:
+            self.enviar_a_todos(f"TURNO:{turno}")
+    
+    def _siguiente_turno(self, mantener_turno):
+        """Pasa el turno al siguiente jugador; hay que tener el lock.
+        
+        Devuelve el nuevo turno para anunciarlo, o None si no cambió.
+        """
+        # Si no hay jugadores, no hay turno
+        if self.primero_turno is None:
+            self.turno_actual = None
+            self.publicar()
+            return None
+        
+        # Si el jugador acertó, mantiene su turno
+        if mantener_turno and self.turno_actual in self.turno_siguiente:
+            registro.debug("turno", "Jugador %s acertó y mantiene su turno.", self.turno_actual)
+            return None
+        
+        # El siguiente en el anillo, o el primero si el turno no era de nadie
+        return self._dar_turno(self.turno_siguiente.get(self.turno_actual, self.primero_turno))
+    
+    def _dar_turno(self, cliente_addr_str):
+        """Da el turno al jugador indicado, o al siguiente conectado si está ausente; hay que tener el lock"""
+        self.turno_actual = self._presente(cliente_addr_str)
+        if self.turno_actual is None:
+            # Todos los jugadores están ausentes: el turno es del primero que vuelva
+            self.publicar()
+            return None
+        self._renovar_plazo()
+        self.publicar()
+        registro.debug("turno", "Cambiando turno al jugador %s", self.turno_actual)
+        
+        # Despertar al cliente que tiene el turno
+        if self.turno_actual in self.condiciones_clientes:
+            self.condiciones_clientes[self.turno_actual].notify_all()
+        return self.turno_actual
+    
+    def _presente(self, cliente_addr_str):
+        """El primer jugador con conexión en el orden de turnos a partir del indicado, o None si no hay"""
+        inicio = cliente_addr_str
+        while cliente_addr_str in self.ausentes:
+            cliente_addr_str = self.turno_siguiente[cliente_addr_str]
+            if cliente_addr_str == inicio:
+                return None
+        return cliente_addr_str
+    
+    def _renovar_plazo(self):
+        """Empieza a contar el plazo del turno actual, si la sala lo tiene; hay que tener el lock"""
+        if self.plazos is not None:
+            self.plazos.renovar(self)
+    
+    def vencer_turno(self, plazos):
+        """Comprueba el plazo del turno (lo llama la rueda de temporizadores).
+        
+        Si el jugador con el turno no ha jugado a tiempo se pasa el turno al
+        siguiente y se anuncia con TURNO; si además ha agotado demasiados
+        turnos seguidos y el servidor lo permite, pasa a ser espectador.
+        """
+        degradado = False
+        with self.lock:
+            self.temporizador_turno = None
+            if not self.juego_activo or self.turno_actual is None:
+                return
+            restante = self.limite_turno - time.monotonic()
+            if restante > 0:
+                # Hubo jugadas o cambios de turno desde que se programó
+                plazos.programar(self, restante)
+                return
+            
+            ausente = self.turno_actual
+            if self._presente(self.turno_siguiente[ausente]) == ausente:
+                # Es el único jugador con conexión (los demás asientos pueden estar guardados):
+                # no hay nadie a quien pasar el turno
+                plazos.renovar(self)
+                return
+            vencidos = self.turnos_vencidos[ausente] = self.turnos_vencidos.get(ausente, 0) + 1
+            # El turno pasa antes de degradar: nunca queda en manos de un espectador (la
+            # comprobación de arriba garantiza que hay otro jugador presente que lo recibe)
+            turno = self._siguiente_turno(False)
+            
+            conn = self.conexiones_clientes[ausente]
+            # Solo los clientes con DELTAS entienden el flujo de los espectadores
+            if plazos.degradar and vencidos >= plazos.maximo_vencidos and conn.deltas:
+                degradado = True
+                self._quitar_jugador(ausente)
+                self.publicar(jugadores=True)
+                if self.diario is not None:
+                    self.diario.salir(self, ausente)
+                conn.espectador = True
+                mensajes = [f"ESPECTADOR:Has agotado {vencidos} turnos seguidos sin jugar", self.mensaje_estado()]
+                self.espectadores.agregar(ausente, conn, mensajes)
+        
+        metricas.incrementar("turnos_vencidos")
+        registro.info("turno", "Turno de %s agotado en la sala '%s' (%s seguidos). Turno para %s",
+                      ausente, self.id_sala, vencidos, turno)
+        self.enviar_a_todos(f"TURNO:{turno}")
+        if degradado:
+            metricas.incrementar("degradados")
+            registro.info("turno", "Jugador %s pasa a espectador en la sala '%s'", ausente, self.id_sala)
+            self.enviar_a_todos(f"DESCONEXION:{ausente}")
+    
+    def _agregar_al_turno(self, cliente_addr_str):
+        """Añade al jugador al final del orden de turnos (justo antes del primero)"""
+        primero = self.primero_turno
+        if primero is None:
+            self.turno_siguiente[cliente_addr_str] = self.turno_anterior[cliente_addr_str] = cliente_addr_str
+            self.primero_turno = cliente_addr_str
+            return
+        ultimo = self.turno_anterior[primero]
+        self.turno_siguiente[ultimo] = cliente_addr_str
+        self.turno_anterior[cliente_addr_str] = ultimo
+        self.turno_siguiente[cliente_addr_str] = primero
+        self.turno_anterior[primero] = cliente_addr_str
+    
+    def _quitar_del_turno(self, cliente_addr_str):
+        """Quita al jugador del orden de turnos. Devuelve el que le seguía (None si no queda nadie)"""
+        siguiente = self.turno_siguiente.pop(cliente_addr_str, None)
+        if siguiente is None:
+            return None
+        anterior = self.turno_anterior.pop(cliente_addr_str)
+        if siguiente == cliente_addr_str:
+            self.primero_turno = None
+            return None
+        self.turno_siguiente[anterior] = siguiente
+        self.turno_anterior[siguiente] = anterior
+        if self.primero_turno == cliente_addr_str:
+            self.primero_turno = siguiente
+        return siguiente
+    
+    def mensaje_estado(self):
+        """Estado completo de la sala junto con su versión - ESTADO:version:tablero:puntuaciones"""
+        estado = self.instantanea  # Sin lock: tablero y puntuaciones de la misma versión
+        return f"ESTADO:{estado.version}:{estado.tablero_json()}:{estado.puntuaciones_json()}"
+    
+    def obtener_tablero_visible_json(self):
+        return self.instantanea.tablero_json()
+    
+    def obtener_puntuaciones_json(self):
+        return self.instantanea.puntuaciones_json()
+    
+    def agregar_cliente(self, conn, cliente_ip, cliente_puerto):
+        with self.lock:
+            cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
+            self.conexiones_clientes[cliente_addr_str] = conn
+            self.clasificacion.agregar(cliente_addr_str, 0)
+            
+            # Crear una condición para este cliente
+            self.condiciones_clientes[cliente_addr_str] = threading.Condition(self.lock)
+            
+            # Añadir cliente al orden de turnos
+            self._agregar_al_turno(cliente_addr_str)
+            
+            # Si es el primer cliente, darle el primer turno
+            if self.turno_actual is None:
+                self.turno_actual = cliente_addr_str
+                self._renovar_plazo()
+                registro.info("sala", "Primer cliente conectado en sala '%s'. Asignando turno a %s",
+                              self.id_sala, self.turno_actual)
+            self.publicar(jugadores=True)
+    
+    def agregar_espectador(self, conn, cliente_ip, cliente_puerto):
+        """Añade un espectador: recibe la configuración, el estado y el turno, y después la partida"""
+        with self.lock:
+            mensajes = [self.mensaje_config(), self.mensaje_estado()]
+            if self.turno_actual:
+                mensajes.append(f"TURNO:{self.turno_actual}")
+            self.espectadores.agregar(f"{cliente_ip}:{cliente_puerto}", conn, mensajes)
+    
+    def quitar_espectador(self, cliente_ip, cliente_puerto):
+        """Quita un espectador de la sala. Devuelve False si no lo era"""
+        return self.espectadores.quitar(f"{cliente_ip}:{cliente_puerto}")
+    
+    def eliminar_cliente(self, cliente_ip, cliente_puerto):
+        with self.lock:
+            cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
+            era_su_turno = (cliente_addr_str == self.turno_actual)
+            siguiente = self._quitar_jugador(cliente_addr_str)
+            
+            # Si era su turno, pasa al que le seguía
+            turno = None
+            if era_su_turno:
+                if siguiente is not None:
+                    turno = self._dar_turno(siguiente)
+                else:
+                    self.turno_actual = None
+            self.publicar(jugadores=True)
+        
+        if turno is not None:
+            self.enviar_a_todos(f"TURNO:{turno}")
+    
+    def _quitar_jugador(self, cliente_addr_str):
+        """Quita al jugador de la partida; hay que tener el lock.
+        
+        Devuelve el que le seguía en el orden de turnos (None si no queda nadie).
+        """
+        if cliente_addr_str in self.conexiones_clientes:
+            del self.conexiones_clientes[cliente_addr_str]
+        self.clasificacion.quitar(cliente_addr_str)
+        if cliente_addr_str in self.condiciones_clientes:
+            del self.condiciones_clientes[cliente_addr_str]
+        self.turnos_vencidos.pop(cliente_addr_str, None)
+        token = self.tokens.pop(cliente_addr_str, None)
+        if token is not None:
+            del self.asientos[token]
+        temporizador = self.ausentes.pop(cliente_addr_str, None)
+        if temporizador is not None:
+            temporizador.cancelar()
+        
+        # Quitar del orden de turnos
+        return self._quitar_del_turno(cliente_addr_str)
+    
+    def abrir_sesion(self, cliente_addr_str):
+        """Da al jugador un token para volver a su asiento si pierde la conexión. None si la sala no guarda asientos"""
+        if self.sesiones is None or not self.sesiones.gracia:
+            return None
+        token = nuevo_token()
+        with self.lock:
+            if cliente_addr_str not in self.conexiones_clientes:
+                return None
+            self.tokens[cliente_addr_str] = token
+            self.asientos[token] = cliente_addr_str
+            if self.diario is not None:
+                # Con el token en el diario el asiento también se puede reclamar tras un reinicio
+                self.diario.sesion(self, cliente_addr_str, token)
+        return token
+    
+    def suspender(self, cliente_addr_str, conn):
+        """Guarda el asiento de un jugador con sesión que ha perdido la conexión.
+        
+        El jugador deja de recibir mensajes pero conserva su puntuación y su
+        lugar en el orden de turnos, que se le salta mientras no vuelva; si
+        tenía el turno pasa al siguiente. Devuelve True si el asiento ya no
+        depende de esta conexión (se guarda ahora, ya estaba guardado u otra
+        conexión lo ha reanudado) y False si el jugador debe salir de la
+        partida como siempre.
+        """
+        with self.lock:
+            actual = self.conexiones_clientes.get(cliente_addr_str)
+            if actual is not conn:
+                return actual is not None or cliente_addr_str in self.ausentes
+            if cliente_addr_str not in self.tokens or not self.juego_activo:
+                return False
+            del self.conexiones_clientes[cliente_addr_str]
+            self.ausentes[cliente_addr_str] = self.sesiones.guardar(self, cliente_addr_str)
+            turno = None
+            if self.turno_actual == cliente_addr_str:
+                turno = self._dar_turno(self.turno_siguiente[cliente_addr_str])
+            self.publicar(jugadores=True)
+        
+        metricas.incrementar("sesiones_suspendidas")
+        registro.info("sala", "Jugador %s sin conexión en la sala '%s'; se le guarda el asiento %g segundos",
+                      cliente_addr_str, self.id_sala, self.sesiones.gracia)
+        if turno is not None:
+            self.enviar_a_todos(f"TURNO:{turno}")
+        return True
+    
+    def expirar_sesion(self, cliente_addr_str):
+        """Termina la gracia de un asiento guardado. Devuelve True si el jugador no ha vuelto"""
+        with self.lock:
+            return self.ausentes.pop(cliente_addr_str, None) is not None
+    
+    def reanudar(self, token, conn, version):
+        """Devuelve al jugador de la sesión a su asiento con una conexión nueva.
+        
+        La conexión recibe REANUDADO:ip:puerto (su identidad en la partida),
+        las jugadas posteriores a version si siguen en el historial, o el
+        ESTADO completo si no, y el turno. Se encolan con el historial
+        bloqueado, así que ninguna jugada se pierde ni llega dos veces. Si el
+        jugador aún tenía una conexión (medio abierta tras el corte), se
+        cierra. Devuelve la dirección del asiento, o None si la sesión no
+        existe o la partida ya terminó.
+        """
+        turno = None
+        with self.lock:
+            cliente_addr_str = self.asientos.get(token)
+            if cliente_addr_str is None or not self.juego_activo:
+                return None
+            anterior = self.conexiones_clientes.get(cliente_addr_str)
+            temporizador = self.ausentes.pop(cliente_addr_str, None)
+            if temporizador is not None:
+                temporizador.cancelar()
+            self.conexiones_clientes[cliente_addr_str] = conn
+            if self.turno_actual is None:
+                turno = self._dar_turno(cliente_addr_str)
+            with self.lock_historial:
+                self.publicar(jugadores=True)
+                historial = self.historial
+                primera = historial[0][0] if historial else self.version_difundida + 1
+                try:
+                    conn.enviar(f"REANUDADO:{cliente_addr_str}")
+                    if primera - 1 <= version <= self.version_difundida:
+                        for version_jugada, mensaje in historial:
+                            if version_jugada > version:
+                                conn.enviar(mensaje)
+                    else:
+                        metricas.incrementar("reanudaciones_completas")
+                        conn.enviar(self.mensaje_estado())
+                    if self.turno_actual:
+                        conn.enviar(f"TURNO:{self.turno_actual}")
+                except:
+                    pass  # Se cortó otra vez: su manejador volverá a guardar el asiento
+        
+        if anterior is not None:
+            anterior.abortar()
+        if turno is not None:
+            self.enviar_a_todos(f"TURNO:{turno}")
+        return cliente_addr_str
+    
+    def obtener_ganador(self):
+        # La clasificación ya tiene el líder: no hay que recorrer las puntuaciones
+        ganador, max_puntos = self.instantanea.lider
+        if not max_puntos:
+            return "desconocido:0", 0
+        return ganador, max_puntos
+    
+    def hay_empate(self):
+        return self.instantanea.empate
+    
+    def enviar_a_todos(self, mensaje, excluir_ip=None, excluir_puerto=None):
+        # Sin lock: se envía a las conexiones de la última instantánea publicada
+        inicio = time.perf_counter()
+        # Se codifica una sola vez para todos los jugadores y espectadores
+        mensaje = Difusion(mensaje)
+        clientes_a_eliminar = []
+        excluir_addr_str = None
+        
+        if excluir_ip is not None and excluir_puerto is not None:
+            excluir_addr_str = f"{excluir_ip}:{excluir_puerto}"
+        
+        for addr_str, conn in self.instantanea.conexiones.items():
+            if excluir_addr_str and addr_str == excluir_addr_str:
+                continue
+            
+            try:
+                conn.enviar(mensaje)
+            except:
+                # Marcar para eliminación posterior
+                clientes_a_eliminar.append((addr_str, conn))
+        self.espectadores.publicar(mensaje)
+        metricas.registrar("difusion", time.perf_counter() - inicio)
+        
+        # Eliminar clientes después de la iteración (los que tienen sesión conservan el asiento)
+        for addr_str, conn in clientes_a_eliminar:
+            if not self.suspender(addr_str, conn):
+                ip, puerto = addr_str.rsplit(":", 1)
+                self.eliminar_cliente(ip, int(puerto))
+    
+    def enviar_jugada(self, cliente_ip, cliente_puerto, fila1, col1, contenido1, fila2, col2, contenido2, acierto, estado):
+        """Envía el resultado de una jugada a todos los clientes de la sala.
+        
+        Los clientes con deltas reciben solo las casillas y la puntuación que
+        cambiaron (DELTA), así que el tamaño no depende del tablero. Los
+        clientes antiguos reciben el tablero y las puntuaciones completos
+        (JUGADA), que solo se serializan si hay alguno en la sala. Cada
+        mensaje se codifica una vez; los espectadores siempre reciben DELTA.
+        
+        Se llama sin el lock, justo después de procesar_jugada, con la
+        instantánea que esta devolvió: la de la jugada, aunque entre medias
+        alguien haya entrado o salido de la sala.
+        """
+        inicio = time.perf_counter()
+        cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
+        jugada = f"{cliente_ip}:{cliente_puerto}:{fila1},{col1}:{contenido1}:{fila2},{col2}:{contenido2}:{1 if acierto else 0}"
+        # DELTA:version:direccionIP:puerto:fila1,col1:palabra1:fila2,col2:palabra2:acierto:puntos
+        mensaje_delta = Difusion(f"DELTA:{estado.version}:{jugada}:{estado.puntos_jugador}")
+        mensaje_completo = None
+        clientes_a_eliminar = []
+        
+        conexiones = estado.conexiones
+        sesiones = self.sesiones
+        if sesiones is not None and sesiones.gracia:
+            # Quien reanuda a la vez recibe esta jugada del historial o aquí, nunca las dos veces
+            with self.lock_historial:
+                self.historial.append((estado.version, mensaje_delta))
+                if len(self.historial) > sesiones.historial:
+                    self.historial.popleft()
+                self.version_difundida = estado.version
+                conexiones = self.instantanea.conexiones
+        
+        for addr_str, conn in conexiones.items():
+            if conn.deltas:
+                mensaje = mensaje_delta
+            else:
+                if mensaje_completo is None:
+                    # JUGADA:direccionIP:puerto:fila1,col1:palabra1:fila2,col2:palabra2:acierto:tablero:puntuaciones
+                    mensaje_completo = Difusion(f"JUGADA:{jugada}:{estado.tablero_json()}:{estado.puntuaciones_json()}")
+                mensaje = mensaje_completo
+            
+            try:
+                conn.enviar(mensaje)
+            except:
+                # Marcar para eliminación posterior
+                clientes_a_eliminar.append((addr_str, conn))
+        self.espectadores.publicar(mensaje_delta)
+        metricas.registrar("difusion", time.perf_counter() - inicio)
+        
+        # Eliminar clientes después de la iteración (los que tienen sesión conservan el asiento)
+        for addr_str, conn in clientes_a_eliminar:
+            if not self.suspender(addr_str, conn):
+                ip, puerto = addr_str.rsplit(":", 1)
+                self.eliminar_cliente(ip, int(puerto))
+    
+    def finalizar_juego(self):
+        """Envía el resultado final a todos los clientes de la sala y cierra sus conexiones.
+        
+        Si la sala admite revancha, los jugadores que la entienden reciben
+        REVANCHA:segundos y su conexión sigue abierta; al resto se les
+        despide como siempre. Devuelve True si alguien puede quedarse.
+        """
+        # Determinar ganador
+        ganador, max_puntos = self.obtener_ganador()
+        hay_empate_result = self.hay_empate()
+        
+        tiempo_fin = time.time()
+        duracion = tiempo_fin - self.tiempo_inicio
+        
+        if hay_empate_result:
+            mensaje_fin = f"FIN:EMPATE:{duracion:.1f}:{max_puntos}:COMPLETADO"
+        else:
+            # Ganador ya es un string en formato "ip:puerto"
+            ganador_partes = ganador.split(":")
+            ganador_ip = ganador_partes[0]
+            ganador_puerto = ganador_partes[1]
+            mensaje_fin = f"FIN:{ganador_ip}:{ganador_puerto}:{duracion:.1f}:{max_puntos}:COMPLETADO"
+        
+        # Enviar mensaje de fin a todos los clientes
+        self.enviar_a_todos(mensaje_fin)
+        
+        # Registrar resumen final del juego
+        if hay_empate_result:
+            resultado = "El juego terminó en EMPATE"
+        else:
+            resultado = f"GANADOR: Jugador {ganador} con {max_puntos} puntos"
+        finales = ", ".join(f"{addr_str}: {puntos}" for addr_str, puntos in self.puntuaciones_a_mostrar().items())
+        registro.info("sala", "¡JUEGO TERMINADO EN LA SALA '%s'! Duración total: %.2f segundos. "
+                              "%s. Puntuaciones finales: %s", self.id_sala, duracion, resultado, finales)
+        
+        # Cerrar todas las conexiones de la sala (salvo las que esperan la revancha)
+        registro.debug("sala", "Cerrando las conexiones de la sala '%s'", self.id_sala)
+        despedida = Difusion("DESPEDIDA:El servidor ha terminado la partida")
+        with self.lock:
+            conexiones = list(self.conexiones_clientes.items())
+            # Quien no ha vuelto a tiempo se pierde el final: su asiento ya no se guarda
+            for temporizador in self.ausentes.values():
+                temporizador.cancelar()
+            self.ausentes.clear()
+            if self.en_revancha:
+                self.revancha_pendientes = {addr_str: conn for addr_str, conn in conexiones if conn.revancha}
+                self.revancha_aceptados = {}
+                self.revancha_despedidos = {addr_str for addr_str, _ in conexiones
+                                            if addr_str not in self.revancha_pendientes}
+                self.en_revancha = bool(self.revancha_pendientes)
+                if self.en_revancha and self.diario is not None:
+                    # La partida terminada sale del diario; la revancha se anotará como una nueva
+                    self.diario.fin(self)
+            self.conexiones_clientes.clear()
+            self.publicar(jugadores=True)
+            ofrecidos = self.revancha_pendientes if self.en_revancha else {}
+        self.espectadores.cerrar(despedida)
+        oferta = Difusion(f"REVANCHA:{self.ventana_revancha:g}")
+        for addr_str, conn in conexiones:
+            try:
+                if addr_str in ofrecidos:
+                    conn.enviar(oferta)
+                    continue
+                # Enviar mensaje de despedida antes de cerrar
+                conn.enviar(despedida)
+                conn.close()
+            except:
+                pass
+        if ofrecidos:
+            registro.info("sala", "Revancha ofrecida en la sala '%s' a %s jugadores durante %g segundos",
+                          self.id_sala, len(ofrecidos), self.ventana_revancha)
+        return bool(ofrecidos)
+    
+    def responder_revancha(self, cliente_ip, cliente_puerto, acepta):
+        """Anota si el jugador se queda a la revancha.
+        
+        Devuelve True si ya han respondido todos y la siguiente partida
+        puede empezar sin esperar a que termine la ventana.
+        """
+        cliente_addr_str = f"{cliente_ip}:{cliente_puerto}"
+        with self.lock:
+            conn = self.revancha_pendientes.pop(cliente_addr_str, None)
+            if not acepta:
+                # También si ya había aceptado y se desconecta antes de empezar
+                self.revancha_aceptados.pop(cliente_addr_str, None)
+            elif conn is not None:
+                self.revancha_aceptados[cliente_addr_str] = conn
+            return conn is not None and self.en_revancha and not self.revancha_pendientes
+    
+    def empezar_revancha(self):
+        """Empieza la siguiente partida en la misma sala con los que aceptaron la revancha.
+        
+        El tablero, las puntuaciones, la versión y el orden de turnos se
+        reinician sin cerrar las conexiones de quienes se quedan, que
+        reciben CONFIG, ESTADO y TURNO como al unirse; los que no
+        respondieron se despiden. Devuelve la lista de jugadores de la nueva
+        partida (vacía si nadie se quedó), o None si la ventana ya se cerró.
+        """
+        # Todo se reinicia en una sola sección del lock: así nadie ve la sala
+        # terminada y sin revancha a la vez (los hilos cerrarían su conexión)
+        mazo = self._cargar_mazo()
+        tablero = Tablero(self.filas, self.columnas, mazo)
+        with self.lock:
+            if not self.en_revancha:
+                return None
+            self.en_revancha = False
+            if self.temporizador_revancha is not None:
+                self.temporizador_revancha.cancelar()
+                self.temporizador_revancha = None
+            aceptados, rechazados = self.revancha_aceptados, self.revancha_pendientes
+            self.revancha_aceptados, self.revancha_pendientes = {}, {}
+            self.revancha_despedidos.update(rechazados)
+            if aceptados:
+                self.tablero = tablero
+                self.version = 0
+                self.partida += 1
+                self.clasificacion = Clasificacion()
+                self.puntuaciones = self.clasificacion.puntos
+                self.turno_actual = self.primero_turno = None
+                self.turno_siguiente, self.turno_anterior = {}, {}
+                self.turnos_vencidos = {}
+                self.condiciones_clientes = {}
+                # Las sesiones de los que se quedan siguen valiendo; el historial empieza de cero
+                self.tokens = {addr_str: token for addr_str, token in self.tokens.items() if addr_str in aceptados}
+                self.asientos = {token: addr_str for addr_str, token in self.tokens.items()}
+                self.historial.clear()
+                self.version_difundida = 0
+                for addr_str, conn in aceptados.items():
+                    # Su último ESPERAR era de la partida anterior
+                    conn.ultimo_esperar = None
+                    self.conexiones_clientes[addr_str] = conn
+                    self.clasificacion.agregar(addr_str, 0)
+                    self.condiciones_clientes[addr_str] = threading.Condition(self.lock)
+                    self._agregar_al_turno(addr_str)
+                self.tiempo_inicio = time.time()
+                self.juego_activo = True
+                self._dar_turno(self.primero_turno)
+                self.publicar(tablero=True, jugadores=True)
+                if self.diario is not None:
+                    self.diario.crear(self)
+                    for addr_str in aceptados:
+                        self.diario.unir(self, addr_str)
+                        if addr_str in self.tokens:
+                            self.diario.sesion(self, addr_str, self.tokens[addr_str])
+                mensajes = [Difusion(self.mensaje_config()), Difusion(self.mensaje_estado()),
+                            Difusion(f"TURNO:{self.turno_actual}")]
+        
+        despedida = Difusion("DESPEDIDA:No has aceptado la revancha")
+        for conn in rechazados.values():
+            try:
+                conn.enviar(despedida)
+                conn.close()
+            except:
+                pass
+        for conn in aceptados.values():
+            try:
+                # Como al unirse: el estado solo a los clientes con deltas
+                conn.enviar(mensajes[0])
+                if conn.deltas:
+                    conn.enviar(mensajes[1])
+                conn.enviar(mensajes[2])
+            except:
+                pass
+        return list(aceptados)
+
+class GestorSalas:
+    """Registro de las salas activas de un servidor.
+    
+    Las conexiones se asignan a una sala al unirse; las salas terminadas o
+    vacías se eliminan sin afectar a las demás.
+    """
+    
+    def __init__(self, dificultad_por_defecto="1"):
+        self.lock = threading.Lock()
+        self.salas = {}  # diccionario {id_sala: Sala}
+        self.dificultad_por_defecto = dificultad_por_defecto
+        self.mazo_por_defecto = MAZO_BASICO  # Mazo de las salas que no piden uno
+        self.diario = None  # DiarioPartidas compartido por todas las salas, si está activado
+        self.repartidor = None  # RepartidorEspectadores del servidor (None: se reparte en el momento)
+        self.plazos = None  # PlazosTurno del servidor (None: los turnos no tienen límite de tiempo)
+        self.sesiones = None  # GestorSesiones del servidor (None: no se guardan asientos)
+        self.rueda = None  # RuedaTemporizadores que cierra las ventanas de revancha
+        self.ventana_revancha = 0  # Segundos para aceptar la revancha (0: las salas se cierran al terminar)
+    
+    def _crear_sala(self, id_sala, dificultad, mazo=None, semilla=None):
+        sala = Sala(id_sala, dificultad, mazo or self.mazo_por_defecto, semilla)
+        sala.diario = self.diario
+        sala.espectadores.repartidor = self.repartidor
+        sala.plazos = self.plazos
+        sala.sesiones = self.sesiones
+        if self.rueda is not None:
+            sala.ventana_revancha = self.ventana_revancha
+        self.salas[id_sala] = sala
+        return sala
+    
+    def unir(self, id_sala, dificultad, conn, cliente_ip, cliente_puerto, plazo_turno=None, mazo=None):
+        """Añade el cliente a la sala indicada, creándola si no existe.
+        
+        La dificultad, el plazo por turno y el mazo solo se usan al crear la
+        sala; si la sala ya existe el cliente se une con los que eligió su
+        creador. Devuelve None si la sala está entre una partida y su
+        revancha.
+        """
+        with self.lock:
+            sala = self.salas.get(id_sala)
+            if sala is not None and sala.en_revancha:
+                return None
+            if sala is None or not sala.juego_activo:
+                sala = self._crear_sala(id_sala, dificultad or self.dificultad_por_defecto, mazo)
+                sala.plazo_turno = plazo_turno
+                if self.diario is not None:
+                    self.diario.crear(sala)
+                registro.info("sala", "Nueva sala '%s' creada (%sx%s). Salas activas: %s",
+                              id_sala, sala.filas, sala.columnas, len(self.salas))
+            # Se añade bajo el lock del gestor para que la sala no se elimine entre medias
+            sala.agregar_cliente(conn, cliente_ip, cliente_puerto)
+            if self.diario is not None:
+                self.diario.unir(sala, f"{cliente_ip}:{cliente_puerto}")
+            return sala
+    
+    def restaurar(self, partidas):
+        """Vuelve a crear las salas recuperadas del diario tras un reinicio.
+        
+        Se conservan el tablero, la versión, el orden de turnos y las
+        puntuaciones. Cada jugador recupera su asiento como si acabara de
+        perder la conexión: puede volver con REANUDAR y su token durante la
+        gracia de la sesión; si no vuelve sale de la partida, y la sala se
+        cierra cuando no queda nadie. El primero que vuelva recibe el turno.
+        Los tableros con semilla se vuelven a repartir con su mazo; si el
+        mazo ya no existe o ha cambiado, la partida no se puede recuperar.
+        """
+        with self.lock:
+            for partida in partidas:
+                if partida.semilla is not None:
+                    mazo = catalogo.obtener(partida.mazo)
+                    if mazo is None or mazo.huella != partida.huella:
+                        registro.aviso("sala", "Sala '%s' no recuperada: el mazo '%s' no existe o ha cambiado",
+                                       partida.id_sala, partida.mazo)
+                        continue
+                    sala = self._crear_sala(partida.id_sala, partida.dificultad, partida.mazo, partida.semilla)
+                    sala.tablero.destapadas[:] = partida.destapadas
+                    sala.tablero.casillas_destapadas = partida.casillas_destapadas
+                else:
+                    sala = self._crear_sala(partida.id_sala, partida.dificultad)
+                    sala.tablero = Tablero.restaurar(partida.filas, partida.columnas, partida.palabras,
+                                                     partida.cartas, partida.destapadas, partida.casillas_destapadas)
+                sala.version = sala.version_difundida = partida.version
+                with sala.lock:
+                    for addr_str, puntos in partida.puntuaciones.items():
+                        sala.clasificacion.agregar(addr_str, puntos)
+                        sala._agregar_al_turno(addr_str)
+                        token = partida.tokens[addr_str]
+                        sala.tokens[addr_str] = token
+                        sala.asientos[token] = addr_str
+                        sala.ausentes[addr_str] = self.sesiones.guardar(sala, addr_str)
+                    sala.publicar(tablero=True, jugadores=True)
+                registro.info("sala", "Sala '%s' recuperada del diario (%sx%s, versión %s, %s jugadores)",
+                              sala.id_sala, sala.filas, sala.columnas, sala.version, len(sala.puntuaciones))
+    
+    def reanudar(self, id_sala, token, conn, version):
+        """Devuelve al jugador de la sesión a su asiento. Devuelve (sala, addr_str) o (None, None)"""
+        with self.lock:
+            sala = self.salas.get(id_sala)
+            if sala is None:
+                return None, None
+            # Bajo el lock del gestor, como al unirse, para que la sala no se elimine entre medias
+            cliente_addr_str = sala.reanudar(token, conn, version)
+        if cliente_addr_str is None:
+            return None, None
+        return sala, cliente_addr_str
+    
+    def observar(self, id_sala, conn, cliente_ip, cliente_puerto):
+        """Añade un espectador a una sala en juego. Devuelve None si la sala no existe"""
+        with self.lock:
+            sala = self.salas.get(id_sala)
+            if sala is None or not sala.juego_activo:
+                return None
+            sala.agregar_espectador(conn, cliente_ip, cliente_puerto)
+            return sala
+    
+    def salir(self, sala, cliente_ip, cliente_puerto):
+        """Quita al cliente de su sala y elimina la sala si ha quedado vacía"""
+        sala.eliminar_cliente(cliente_ip, cliente_puerto)
+        if self.diario is not None:
+            self.diario.salir(sala, f"{cliente_ip}:{cliente_puerto}")
+        with self.lock:
+            # Los asientos guardados mantienen la sala hasta que vuelvan o venza su gracia
+            if not sala.instantanea.conexiones and not sala.ausentes:
+                self._quitar(sala)
+                sala.espectadores.cerrar(Difusion("DESPEDIDA:La sala se ha quedado sin jugadores"))
+    
+    def terminar(self, sala):
+        """Cierra una partida terminada, o abre su ventana de revancha si algún jugador puede quedarse"""
+        if not sala.finalizar_juego():
+            self.cerrar_sala(sala)
+            return
+        with sala.lock:
+            if sala.en_revancha:
+                sala.temporizador_revancha = self.rueda.programar(sala.ventana_revancha, self.empezar_revancha, sala)
+    
+    def responder_revancha(self, sala, cliente_ip, cliente_puerto, acepta):
+        """Anota la respuesta del jugador; si ya respondieron todos, la revancha empieza al momento"""
+        if sala.responder_revancha(cliente_ip, cliente_puerto, acepta):
+            self.empezar_revancha(sala)
+    
+    def empezar_revancha(self, sala):
+        """Cierra la ventana de revancha: empieza la partida nueva o, si nadie se quedó, cierra la sala"""
+        jugadores = sala.empezar_revancha()
+        if jugadores is None:
+            return
+        if not jugadores:
+            self.cerrar_sala(sala)
+            return
+        metricas.incrementar("revanchas")
+        registro.info("sala", "Revancha en la sala '%s' con %s jugadores", sala.id_sala, len(jugadores))
+    
+    def cerrar_sala(self, sala):
+        """Elimina una sala terminada del registro"""
+        with self.lock:
+            self._quitar(sala)
+    
+    def _quitar(self, sala):
+        if self.salas.get(sala.id_sala) is sala:
+            del self.salas[sala.id_sala]
+            if self.diario is not None:
+                self.diario.fin(sala)
+            registro.info("sala", "Sala '%s' cerrada. Salas activas: %s", sala.id_sala, len(self.salas))
+    
+    def total_conexiones(self):
+        with self.lock:
+            return sum(len(sala.instantanea.conexiones) for sala in self.salas.values())
+    
+    def total_espectadores(self):
+        with self.lock:
+            return sum(len(sala.espectadores) for sala in self.salas.values())
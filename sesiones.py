@@ -0,0 +1,37 @@
+import secrets
+
+GRACIA_SESION = 30.0      # Segundos que se guarda el asiento de un jugador que pierde la conexión (0: no se guarda)
+HISTORIAL_JUGADAS = 256   # Últimas jugadas de cada sala que se pueden reenviar al reanudar
+
+def nuevo_token():
+    # Hexadecimal: nunca contiene ":", que separa los campos de los mensajes
+    return secrets.token_hex(16)
+
+class GestorSesiones:
+    """Sesiones de los jugadores para volver a su asiento tras un corte.
+    
+    Al unirse, un cliente con la capacidad SESION recibe
+    SESION:sala:token:segundos justo después de CONFIG. Si su conexión se
+    cae, la sala le guarda la puntuación y el lugar en el orden de turnos
+    durante la gracia (Sala.suspender); al volver con
+    REANUDAR:sala:token:versión recibe solo las jugadas posteriores a esa
+    versión (Sala.reanudar). Cada asiento guardado tiene un temporizador en
+    la rueda compartida; si vence sin que el jugador vuelva, al_expirar lo
+    saca de la partida como a cualquier jugador desconectado. Con gracia 0
+    no se dan sesiones.
+    """
+    
+    def __init__(self, rueda, al_expirar, gracia=GRACIA_SESION, historial=HISTORIAL_JUGADAS):
+        self.rueda = rueda
+        self.al_expirar = al_expirar  # función (sala, addr_str) que quita al jugador que no volvió
+        self.gracia = gracia
+        self.historial = historial
+    
+    def guardar(self, sala, cliente_addr_str):
+        """Empieza a contar la gracia del asiento (hay que tener el lock de la sala). Devuelve el temporizador"""
+        return self.rueda.programar(self.gracia, self._expirar, sala, cliente_addr_str)
+    
+    def _expirar(self, sala, cliente_addr_str):
+        # La sala confirma con su lock que el jugador no ha vuelto entre medias
+        if sala.expirar_sesion(cliente_addr_str):
+            self.al_expirar(sala, cliente_addr_str)
@@ -0,0 +1,122 @@
+import random
+import re
+from array import array
+
+# Dificultad: (filas, columnas)
+DIFICULTADES = {
+    "1": (4, 4),    # Principiante
+    "2": (6, 6),    # Avanzado
+}
+MAXIMO_LADO = 256  # Hasta 256x256 casillas (32768 pares caben en un array de 16 bits)
+
+OCULTA = "?"
+VACIA = 0  # Id de las casillas sin carta (tableros con un número impar de casillas)
+
+def dimensiones_dificultad(dificultad):
+    """Devuelve (filas, columnas) para "1", "2" o un tamaño libre "FxC", o None si no es válida"""
+    if dificultad in DIFICULTADES:
+        return DIFICULTADES[dificultad]
+    coincidencia = re.fullmatch(r"(\d+)x(\d+)", dificultad or "")
+    if coincidencia:
+        filas, columnas = int(coincidencia.group(1)), int(coincidencia.group(2))
+        if 1 <= filas <= MAXIMO_LADO and 1 <= columnas <= MAXIMO_LADO and filas * columnas >= 2:
+            return filas, columnas
+    return None
+
+class Tablero:
+    """Tablero compacto de un memorama.
+    
+    Las cartas se guardan como ids en un array plano de 16 bits (fila*columnas
+    + columna) y las casillas destapadas en un mapa de bits, así que cada
+    casilla ocupa poco más de 2 bytes. Validar una jugada y saber si la
+    partida ha terminado cuesta O(1).
+    
+    Cada tablero se reparte con su propio generador a partir de una
+    semilla: con el mismo mazo y la misma semilla sale siempre el mismo
+    tablero, así que basta con guardar (mazo, semilla) para regenerarlo.
+    """
+    __slots__ = ("filas", "columnas", "num_pares", "palabras", "cartas", "destapadas", "casillas_destapadas",
+                 "mazo", "semilla")
+    
+    def __init__(self, filas, columnas, mazo, semilla=None):
+        if semilla is None:
+            semilla = random.getrandbits(63)
+        aleatorio = random.Random(semilla)
+        self.filas = filas
+        self.columnas = columnas
+        self.num_pares = (filas * columnas) // 2
+        self.mazo = mazo        # Mazo del que salen las palabras
+        self.semilla = semilla  # Semilla con la que se repartió
+        
+        # palabras[id] es la palabra de la carta con ese id; el id 0 es la casilla vacía
+        self.palabras = [""] + mazo.repartir(self.num_pares, aleatorio)
+        
+        # Crear tablero con pares de cartas
+        ids = list(range(1, self.num_pares + 1)) * 2
+        aleatorio.shuffle(ids)
+        if len(ids) < filas * columnas:
+            ids.append(VACIA)
+        self.cartas = array("H", ids)
+        
+        # Tablero visible (inicialmente todas las cartas ocultas); la casilla vacía, siempre la
+        # última, cuenta como destapada
+        self.destapadas = bytearray((filas * columnas + 7) // 8)
+        self.casillas_destapadas = 0
+        if len(ids) % 2:
+            indice = len(ids) - 1
+            self.destapadas[indice >> 3] |= 1 << (indice & 7)
+    
+    @classmethod
+    def restaurar(cls, filas, columnas, palabras, cartas, destapadas, casillas_destapadas, mazo=None, semilla=None):
+        """Reconstruye un tablero guardado (por ejemplo desde el diario) sin barajar"""
+        tablero = cls.__new__(cls)
+        tablero.filas = filas
+        tablero.columnas = columnas
+        tablero.num_pares = (filas * columnas) // 2
+        tablero.palabras = [""] + list(palabras)
+        tablero.cartas = cartas
+        tablero.destapadas = bytearray(destapadas)
+        tablero.casillas_destapadas = casillas_destapadas
+        tablero.mazo = mazo
+        tablero.semilla = semilla
+        return tablero
+    
+    @property
+    def total_cartas(self):
+        return self.num_pares * 2
+    
+    def indice(self, fila, col):
+        """Índice plano de una casilla, o -1 si está fuera del tablero"""
+        if 0 <= fila < self.filas and 0 <= col < self.columnas:
+            return fila * self.columnas + col
+        return -1
+    
+    def esta_destapada(self, indice):
+        return self.destapadas[indice >> 3] & (1 << (indice & 7)) != 0
+    
+    def palabra(self, indice):
+        return self.palabras[self.cartas[indice]]
+    
+    def contenido_visible(self, indice):
+        return self.palabra(indice) if self.esta_destapada(indice) else OCULTA
+    
+    def destapar_par(self, indice1, indice2):
+        self.destapadas[indice1 >> 3] |= 1 << (indice1 & 7)
+        self.destapadas[indice2 >> 3] |= 1 << (indice2 & 7)
+        self.casillas_destapadas += 2
+    
+    def completo(self):
+        return self.casillas_destapadas >= self.total_cartas
+    
+    def visible(self, destapadas=None):
+        """Tablero visible como lista de filas, en el formato que esperan los clientes.
+        
+        Con destapadas se usa ese mapa de casillas (por ejemplo el de una
+        instantánea de la sala) en lugar del actual.
+        """
+        if destapadas is None:
+            destapadas = self.destapadas
+        palabras, cartas, columnas = self.palabras, self.cartas, self.columnas
+        return [[palabras[cartas[indice]] if destapadas[indice >> 3] & (1 << (indice & 7)) else OCULTA
+                 for indice in range(fila * columnas, (fila + 1) * columnas)]
+                for fila in range(self.filas)]
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from registro import registro
+
+class Temporizador:
+    """Tarea programada en la rueda; cancelar() evita que se ejecute"""
+    __slots__ = ("vence", "funcion", "args", "cancelado")
+    
+    def __init__(self, vence, funcion, args):
+        self.vence = vence
+        self.funcion = funcion
+        self.args = args
+        self.cancelado = False
+    
+    def cancelar(self):
+        self.cancelado = True
+
+class RuedaTemporizadores:
+    """Rueda de temporizadores compartida por todas las conexiones y salas.
+    
+    Cada temporizador se guarda en la ranura de su tick de vencimiento
+    (vence / resolucion módulo el número de ranuras), así que programar es
+    O(1) y cada tick solo revisa una ranura. Un único hilo (o el bucle de
+    eventos en modo asyncio) llama a avanzar() periódicamente.
+    """
+    
+    def __init__(self, resolucion=0.1, num_ranuras=512):
+        self.resolucion = resolucion
+        self.ranuras = [[] for _ in range(num_ranuras)]
+        self.lock = threading.Lock()
+        self.tick_actual = int(time.monotonic() / resolucion)
+        self.hilo = None
+    
+    def programar(self, retraso, funcion, *args):
+        temporizador = Temporizador(time.monotonic() + retraso, funcion, args)
+        with self.lock:
+            # Primer tick que empieza después del vencimiento: al revisarlo ya ha vencido
+            # (en su propio tick podría faltar un poco y esperaría una vuelta entera)
+            tick = max(int(temporizador.vence / self.resolucion) + 1, self.tick_actual + 1)
+            self.ranuras[tick % len(self.ranuras)].append(temporizador)
+        return temporizador
+    
+    def avanzar(self, ahora=None):
+        """Ejecuta los temporizadores vencidos hasta el instante indicado"""
+        if ahora is None:
+            ahora = time.monotonic()
+        objetivo = int(ahora / self.resolucion)
+        num_ranuras = len(self.ranuras)
+        vencidos = []
+        
+        with self.lock:
+            # Si nos hemos retrasado más de una vuelta basta con revisar cada ranura una vez
+            for tick in range(self.tick_actual + 1, min(objetivo, self.tick_actual + num_ranuras) + 1):
+                ranura = self.ranuras[tick % num_ranuras]
+                if not ranura:
+                    continue
+                pendientes = []
+                for temporizador in ranura:
+                    if temporizador.cancelado:
+                        continue
+                    if temporizador.vence <= ahora:
+                        vencidos.append(temporizador)
+                    else:
+                        pendientes.append(temporizador)  # Vence en una vuelta posterior
+                self.ranuras[tick % num_ranuras] = pendientes
+            self.tick_actual = max(self.tick_actual, objetivo)
+        
+        # Las funciones se ejecutan fuera del lock para que puedan programar otras
+        for temporizador in vencidos:
+            if temporizador.cancelado:
+                continue
+            try:
+                temporizador.funcion(*temporizador.args)
+            except Exception as e:
+                registro.error("temporizador", "Error en temporizador: %s", e)
+    
+    def iniciar_hilo(self):
+        """Avanza la rueda desde un hilo propio (modo de hilos)"""
+        def bucle():
+            while True:
+                time.sleep(self.resolucion)
+                self.avanzar()
+        
+        self.hilo = threading.Thread(target=bucle, daemon=True)
+        self.hilo.start()
+    
+    def iniciar_async(self, loop):
+        """Avanza la rueda desde el bucle de eventos (modo asyncio)"""
+        def tick():
+            self.avanzar()
+            loop.call_later(self.resolucion, tick)
+        
+        loop.call_later(self.resolucion, tick)
@@ -0,0 +1,96 @@
+import unittest
+
+import MemoServer
+from admision import LimiteMensajes
+from conexion import Conexion, POLITICA_AGRUPAR
+from mazos import Mazo
+from sala import Sala
+from tablero import Tablero
+
+class ConexionPrueba(Conexion):
+    """Conexión sin socket que guarda lo que se le envía"""
+    
+    def __init__(self):
+        super().__init__(True, POLITICA_AGRUPAR, 256)
+        self.enviados = []
+    
+    def enviar(self, mensaje):
+        self.enviados.append(mensaje)
+    
+    def close(self):
+        pass
+
+class PruebaFueraDeTurno(unittest.TestCase):
+    
+    def test_esperar_tras_la_revancha(self):
+        # La revancha vuelve a la versión 0 con el mismo turno: el ESPERAR
+        # de la partida anterior no puede dejar sin respuesta el JUGAR
+        sala = Sala("prueba", semilla=1)
+        sala.ventana_revancha = 15
+        primero, segundo = ConexionPrueba(), ConexionPrueba()
+        for puerto, conn in ((1, primero), (2, segundo)):
+            conn.revancha = True
+            sala.agregar_cliente(conn, "127.0.0.1", puerto)
+        
+        MemoServer.procesar_mensaje(sala, segundo, "127.0.0.1", 2, "JUGAR:0,0:0,1")
+        self.assertEqual(segundo.enviados, ["ESPERAR:127.0.0.1:1"])
+        
+        sala.juego_activo = False
+        sala.en_revancha = True
+        self.assertTrue(sala.finalizar_juego())
+        sala.responder_revancha("127.0.0.1", 1, True)
+        sala.responder_revancha("127.0.0.1", 2, True)
+        self.assertEqual(sala.empezar_revancha(), ["127.0.0.1:1", "127.0.0.1:2"])
+        self.assertEqual((sala.instantanea.version, sala.instantanea.turno_actual), (0, "127.0.0.1:1"))
+        
+        segundo.enviados.clear()
+        MemoServer.procesar_mensaje(sala, segundo, "127.0.0.1", 2, "JUGAR:0,0:0,1")
+        self.assertEqual(segundo.enviados, ["ESPERAR:127.0.0.1:1"])
+    
+    def test_error_a_cada_jugar_limitado(self):
+        # Tras el primer aviso, un JUGAR descartado sigue recibiendo ERROR
+        sala = Sala("prueba", semilla=1)
+        conn = ConexionPrueba()
+        sala.agregar_cliente(conn, "127.0.0.1", 1)
+        conn.limite = LimiteMensajes(0.001, 1)
+        MemoServer.procesar_mensaje(sala, conn, "127.0.0.1", 1, "ESTADO")
+        conn.enviados.clear()
+        
+        MemoServer.procesar_mensaje(sala, conn, "127.0.0.1", 1, "ESTADO")
+        MemoServer.procesar_mensaje(sala, conn, "127.0.0.1", 1, "ESTADO")
+        self.assertEqual(len(conn.enviados), 1)
+        for _ in range(3):
+            MemoServer.procesar_mensaje(sala, conn, "127.0.0.1", 1, "JUGAR:0,0:0,1")
+        self.assertEqual(conn.enviados, ["ERROR:Demasiados mensajes, espera un momento"] * 4)
+    
+    def test_delta_con_la_instantanea_de_la_jugada(self):
+        # Alguien entra entre procesar_jugada y enviar_jugada: el DELTA lleva la puntuación de la jugada
+        sala = Sala("prueba", semilla=1)
+        conn = ConexionPrueba()
+        conn.deltas = True
+        sala.agregar_cliente(conn, "127.0.0.1", 1)
+        tablero = sala.tablero
+        primera = next(i for i in range(len(tablero.cartas)) if tablero.cartas[i])
+        pareja = next(i for i in range(primera + 1, len(tablero.cartas)) if tablero.cartas[i] == tablero.cartas[primera])
+        fila1, col1 = divmod(primera, tablero.columnas)
+        fila2, col2 = divmod(pareja, tablero.columnas)
+        
+        acierto, contenido1, contenido2, estado = sala.procesar_jugada(fila1, col1, fila2, col2, "127.0.0.1", 1)
+        self.assertTrue(acierto)
+        sala.agregar_cliente(ConexionPrueba(), "127.0.0.1", 2)
+        sala.enviar_jugada("127.0.0.1", 1, fila1, col1, contenido1, fila2, col2, contenido2, acierto, estado)
+        delta = str(conn.enviados[-1])
+        self.assertTrue(delta.startswith("DELTA:1:127.0.0.1:1:"))
+        self.assertTrue(delta.endswith(":1:1"))
+
+class PruebaMazoCorto(unittest.TestCase):
+    
+    def test_relleno_sin_palabras_repetidas(self):
+        # Al numerar las vueltas de un mazo corto, "sol" + "1" no puede repetir la "sol1" del mazo
+        mazo = Mazo("corto", ["sol", "sol1", "luna"])
+        tablero = Tablero(4, 4, mazo, 3)
+        palabras = tablero.palabras[1:]
+        self.assertEqual(len(set(palabras)), tablero.num_pares)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import zlib
+
+from registro import registro
+
+TAMANO_MAXIMO_TRASPASO = 128 * 1024  # Mayor que cualquier primer mensaje aceptado de un cliente
+
+def trabajador_de_sala(id_sala, num_trabajadores):
+    """Índice del proceso dueño de una sala (estable entre procesos y reinicios)"""
+    return zlib.crc32(id_sala.encode()) % num_trabajadores
+
+class Trabajador:
+    """Un proceso del modo multiproceso y sus canales hacia los demás.
+    
+    Todos los procesos escuchan en el mismo puerto (SO_REUSEPORT), así que
+    el núcleo reparte las conexiones sin saber a qué sala van. Cada sala
+    tiene un único proceso dueño; cuando un proceso recibe el primer
+    mensaje de una conexión para una sala ajena, le pasa el socket abierto
+    (SCM_RIGHTS por un socket Unix) junto con ese mensaje, y el dueño la
+    atiende como si la hubiera aceptado él.
+    """
+    
+    def __init__(self, indice, recepcion, envios):
+        self.indice = indice
+        self.num_trabajadores = len(envios)
+        self.recepcion = recepcion  # Socket Unix por el que llegan las conexiones traspasadas
+        self.envios = envios        # Socket Unix hacia cada proceso (el propio no se usa)
+    
+    def dueno(self, id_sala):
+        return trabajador_de_sala(id_sala, self.num_trabajadores)
+    
+    def traspasar(self, indice, fileno, tramas, data):
+        """Envía la conexión y su primer mensaje ya leído al proceso indicado"""
+        mensaje = (b"1" if tramas else b"0") + data.encode()
+        socket.send_fds(self.envios[indice], [mensaje], [fileno])
+    
+    def _recibir(self):
+        mensaje, fds, _, _ = socket.recv_fds(self.recepcion, TAMANO_MAXIMO_TRASPASO, 1)
+        if not fds:
+            return None
+        return socket.socket(fileno=fds[0]), mensaje[:1] == b"1", mensaje[1:].decode()
+    
+    def iniciar_hilo(self, atender):
+        """Recibe conexiones traspasadas en un hilo propio (modo de hilos).
+        
+        atender(sock, tramas, data) se llama por cada conexión recibida.
+        """
+        def bucle():
+            while True:
+                try:
+                    traspaso = self._recibir()
+                except OSError as e:
+                    registro.error("trabajador", "Error al recibir una conexión traspasada: %s", e)
+                    return
+                if traspaso is not None:
+                    atender(*traspaso)
+        
+        threading.Thread(target=bucle, name="traspasos", daemon=True).start()
+    
+    def iniciar_async(self, loop, atender):
+        """Recibe conexiones traspasadas desde el bucle de eventos (modo asyncio)"""
+        self.recepcion.setblocking(False)
+        
+        def leer():
+            while True:
+                try:
+                    traspaso = self._recibir()
+                except BlockingIOError:
+                    return
+                except OSError as e:
+                    registro.error("trabajador", "Error al recibir una conexión traspasada: %s", e)
+                    loop.remove_reader(self.recepcion.fileno())
+                    return
+                if traspaso is not None:
+                    atender(*traspaso)
+        
+        loop.add_reader(self.recepcion.fileno(), leer)
+
+def _ejecutar(indice, recepciones, envios, objetivo, args):
+    # Cada proceso solo conserva su propio extremo de recepción
+    for i, recepcion in enumerate(recepciones):
+        if i != indice:
+            recepcion.close()
+    objetivo(Trabajador(indice, recepciones[indice], envios), *args)
+
+def lanzar(num_trabajadores, objetivo, *args):
+    """Lanza los procesos trabajadores y espera a que terminen.
+    
+    Cada proceso ejecuta objetivo(trabajador, *args). Se usan procesos
+    bifurcados (fork) para que hereden los sockets Unix ya creados.
+    """
+    recepciones, envios = [], []
+    for _ in range(num_trabajadores):
+        recepcion, envio = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        recepciones.append(recepcion)
+        envios.append(envio)
+    
+    contexto = multiprocessing.get_context("fork")
+    procesos = [contexto.Process(target=_ejecutar, args=(indice, recepciones, envios, objetivo, args),
+                                 name=f"trabajador-{indice}")
+                for indice in range(num_trabajadores)]
+    for proceso in procesos:
+        proceso.start()
+    
+    try:
+        for proceso in procesos:
+            proceso.join()
+    except KeyboardInterrupt:
+        # Ctrl+C en la terminal llega a todo el grupo y cada trabajador se cierra solo;
+        # si solo lo recibió este proceso, reenviarlo
+        for proceso in procesos:
+            proceso.join(1.0)
+            if proceso.is_alive():
+                os.kill(proceso.pid, signal.SIGINT)
+        for proceso in procesos:
+            proceso.join(5.0)
+            if proceso.is_alive():
+                proceso.terminate()